@@ -0,0 +1,355 @@
+"""Mide el rendimiento del visor sin navegador ni GCS: carga, unificación, filtrado y navegación.
+
+Uso:
+    python benchmark_visor.py [--filas 1000 10000 100000] [--repeticiones 5] [--base benchmark_base.json] [--guardar-base]
+
+Genera (una sola vez, se reutilizan) libros Excel sintéticos de las tres familias con `--filas` filas cada uno,
+con varios PERSONAJE por foto (unas pocas personas aparecen en muchas fotos) y años vacíos o no numéricos. El visor
+los lee con el almacenamiento local (`VISOR_STORAGE=local`) y para cada tamaño se mide:
+
+- las etapas internas (Excel en frío, snapshot, catálogo con índices, unificación global y los filtros D, P, B y
+  por año), llamando directamente a las funciones del visor con las cachés vaciadas; el catálogo y la unificación
+  se miden también leídos del snapshot compartido, como los vería un segundo proceso;
+- el recorrido por los estados del menú (INICIO, consulta, modo, filtro, foto siguiente, cuadrícula, vuelta al
+  visor y presentación) con `streamlit.testing.v1.AppTest`, como lo haría una sesión real.
+
+De cada etapa se informa el mínimo, la mediana, p90 y máximo de la latencia y el pico de memoria (tracemalloc, en una
+ejecución aparte para no distorsionar los tiempos). Con `--guardar-base` los resultados se guardan en `--base`;
+si no, se comparan con ella y el proceso termina con error si alguna etapa empeora más que `--tolerancia`.
+Las bases solo son comparables en la misma máquina.
+"""
+import argparse
+import gc
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["VISOR_PRECARGA"] = "0"
+os.environ["VISOR_STORAGE"] = "local"
+
+import numpy as np
+import streamlit.logger
+from openpyxl import Workbook
+from streamlit import config
+
+# Sin los avisos de Streamlit por ejecutarse fuera de `streamlit run`
+config.set_option("global.showWarningOnDirectExecution", False)
+config.set_option("logger.level", "error")
+streamlit.logger.set_log_level("error")
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "visor_web.py")
+DIRECTORIO_DATOS = os.path.join(tempfile.gettempdir(), "visor_benchmark")
+TAMANOS = [1000, 10000, 100000]
+REPETICIONES = 5
+TOLERANCIA = 0.25 # Empeoramiento relativo admitido respecto de la base
+MINIMO_COMPARABLE = 0.005 # Segundos: por debajo, las diferencias son ruido
+SEMILLA = 1234
+CONSULTA = "41" # Consulta global: carga y mezcla las tres familias
+
+NOMBRES = ["José", "María", "Juan", "Ana", "Carlos", "Lucía", "Pedro", "Elena", "Luis", "Rosa", "Jorge", "Carmen",
+           "Diego", "Isabel", "Andrés", "Teresa", "Miguel", "Pilar", "Sebastián", "Mariana"]
+APELLIDOS = ["Velasco", "Espinosa", "Coner", "Endara", "Andrade", "Salazar", "Cevallos", "Mora", "Vásconez",
+             "Paredes", "Jaramillo", "Ortiz", "Benítez", "Carrión", "Donoso", "Larrea"]
+LUGARES = ["Quito", "Guayaquil", "Cuenca", "la playa", "Baños", "Otavalo", "la hacienda", "Loja"]
+PLANTILLAS = ["Cumpleaños de {p}", "Viaje a {l}", "Navidad en casa", "Boda de {p}", "Paseo a {l}",
+              "Graduación de {p}", "Bautizo de {p}", "Vacaciones en {l}", "Reunión familiar en {l}"]
+# Número de PERSONAJE por foto y su probabilidad
+PERSONAJES_POR_FOTO = [0, 1, 2, 3, 4, 5, 6]
+PROBABILIDAD_PERSONAJES = [0.15, 0.30, 0.25, 0.15, 0.08, 0.04, 0.03]
+
+
+# --- DATOS SINTÉTICOS ---
+
+def _personas(n, rng):
+    """`n` nombres distintos y su probabilidad de aparecer en una foto (ley de Zipf)."""
+    combinaciones = [f"{nombre} {apellido}" for apellido in APELLIDOS for nombre in NOMBRES]
+    personas = []
+    for i in range(n):
+        base = combinaciones[i % len(combinaciones)]
+        personas.append(base if i < len(combinaciones) else f"{base} {APELLIDOS[(i // len(combinaciones)) % len(APELLIDOS)]} {i}")
+    pesos = 1.0 / np.arange(1, n + 1) ** 1.1
+    rng.shuffle(personas)
+    return personas, pesos / pesos.sum()
+
+def generar_libro(ruta, carpeta, filas, semilla):
+    """Escribe un Excel de familia con las columnas (y el desorden en los encabezados) de los reales."""
+    rng = np.random.default_rng(semilla)
+    personas, pesos = _personas(min(5000, filas // 20 + 50), rng)
+    n_personajes = rng.choice(PERSONAJES_POR_FOTO, size=filas, p=PROBABILIDAD_PERSONAJES)
+    elegidas = rng.choice(len(personas), size=(filas, max(PERSONAJES_POR_FOTO)), p=pesos)
+    anios = rng.integers(1920, 2025, size=filas)
+    tipo_anio = rng.random(filas) # < 0.12 vacío, < 0.15 's/f', < 0.20 texto, resto número
+    plantillas = rng.integers(0, len(PLANTILLAS), size=filas)
+    lugares = rng.integers(0, len(LUGARES), size=filas)
+    sin_descripcion = rng.random(filas) < 0.10
+    videos = rng.random(filas) < 0.02
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(["Nombre ", "Descripcion", "año"] + [f"PERSONAJE {i}" for i in range(1, max(PERSONAJES_POR_FOTO) + 1)])
+    for i in range(filas):
+        fila_personas = list(dict.fromkeys(personas[j] for j in elegidas[i, :n_personajes[i]]))
+        if tipo_anio[i] < 0.12:
+            anio = None
+        elif tipo_anio[i] < 0.15:
+            anio = "s/f"
+        elif tipo_anio[i] < 0.20:
+            anio = str(anios[i])
+        else:
+            anio = int(anios[i])
+        protagonista = fila_personas[0] if fila_personas else personas[0]
+        descripcion = None if sin_descripcion[i] else PLANTILLAS[plantillas[i]].format(p=protagonista, l=LUGARES[lugares[i]])
+        extension = "mp4" if videos[i] else "jpg"
+        hoja.append([f"img_{carpeta}_{i:07d}.{extension}", descripcion, anio] + fila_personas)
+    ruta_tmp = f"{ruta}.tmp"
+    libro.save(ruta_tmp)
+    os.replace(ruta_tmp, ruta)
+    return personas[:50] # Las personas más frecuentes, para las búsquedas
+
+def preparar_datos(v, filas, semilla):
+    """Carpeta con forma de Bucket para `filas` filas por familia (se genera solo la primera vez)."""
+    raiz = os.path.join(DIRECTORIO_DATOS, f"{filas}_{semilla}")
+    bucket = os.path.join(raiz, v.BUCKET_NAME)
+    ruta_personas = os.path.join(raiz, "personas.json")
+    if not os.path.exists(ruta_personas):
+        os.makedirs(bucket, exist_ok=True)
+        personas = []
+        for i, (key, config) in enumerate(v.consultas_individuales.items()):
+            print(f"  Generando {config['ruta_excel']} ({filas} filas)...")
+            personas += generar_libro(os.path.join(bucket, config["ruta_excel"]), config["carpeta_fotos"], filas, semilla + i)
+            os.makedirs(os.path.join(bucket, config["carpeta_fotos"]), exist_ok=True)
+        with open(ruta_personas, "w", encoding="utf-8") as f:
+            json.dump(personas, f)
+    with open(ruta_personas, encoding="utf-8") as f:
+        return raiz, json.load(f)
+
+
+# --- MEDICIÓN ---
+
+def cargar_visor():
+    """Importa visor_web.py como módulo (sin `streamlit run`: solo se usan sus funciones)."""
+    spec = importlib.util.spec_from_file_location("visor_web", RUTA_APP)
+    v = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(v)
+    return v
+
+def configurar(v, raiz):
+    """Apunta el visor (el módulo importado y las ejecuciones de AppTest) a los datos de `raiz`."""
+    os.environ["VISOR_LOCAL_DIR"] = raiz
+    os.environ["CATALOG_CACHE_DIR"] = os.path.join(raiz, "snapshots")
+    os.environ["VISOR_SNAPSHOT_DIR"] = os.path.join(raiz, "snapshots", "compartido")
+    v.LOCAL_STORAGE_DIR = raiz
+    v.CATALOG_CACHE_DIR = os.path.join(raiz, "snapshots")
+    v.SNAPSHOT_COMPARTIDO_DIR = os.path.join(raiz, "snapshots", "compartido")
+    vaciar_caches(v)
+
+def vaciar_caches(v, snapshots=False, compartido=()):
+    """Vacía las cachés del proceso y, si se pide, los snapshots en disco.
+
+    `snapshots` borra todos (Parquet y compartido); `compartido` borra solo esos patrones del snapshot
+    compartido (p. ej. "familia_*"), para medir la construcción sin que la resuelva otra versión ya publicada.
+    """
+    v.st.cache_data.clear()
+    v.st.cache_resource.clear() # Incluye los registros de catálogos y vistas ya construidos
+    if snapshots:
+        shutil.rmtree(v.CATALOG_CACHE_DIR, ignore_errors=True)
+    for patron in compartido:
+        for ruta in glob.glob(os.path.join(v.SNAPSHOT_COMPARTIDO_DIR, patron)):
+            shutil.rmtree(ruta, ignore_errors=True)
+    gc.collect()
+
+def medir(etapa, repeticiones, preparar=None):
+    """Tiempos (s) de `etapa()` en cada repetición y pico de memoria (MB) de una ejecución aparte.
+
+    `preparar()` se llama antes de cada ejecución, fuera de la medición (p. ej. para vaciar cachés).
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        etapa()
+        tiempos.append(time.perf_counter() - inicio)
+    if preparar:
+        preparar()
+    gc.collect()
+    tracemalloc.start()
+    etapa()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tiempos, pico / (1024 * 1024)
+
+def resumen(tiempos, pico_mb):
+    return {
+        "n": len(tiempos),
+        "min": float(np.min(tiempos)),
+        "p50": float(np.percentile(tiempos, 50)),
+        "p90": float(np.percentile(tiempos, 90)),
+        "max": float(np.max(tiempos)),
+        "pico_mb": round(pico_mb, 2),
+    }
+
+def etapas_internas(v, repeticiones, personas):
+    """Mide las funciones de carga, unificación y filtrado del visor."""
+    fs = v.obtener_fs()
+    claves = v.consultas_globales[CONSULTA]["orden_carga"]
+    resultados = {}
+
+    def cargar_excel():
+        for key in claves:
+            v.load_excel_from_gcs(v.consultas_individuales[key]["ruta_excel"], fs)
+    resultados["excel_frio"] = medir(cargar_excel, repeticiones, lambda: vaciar_caches(v, snapshots=True))
+    resultados["excel_snapshot"] = medir(cargar_excel, repeticiones, lambda: vaciar_caches(v))
+
+    def construir_catalogos():
+        for key in claves:
+            v.obtener_catalogo_familia(key, v.generacion_familia(key, fs), fs)
+    resultados["catalogo"] = medir(construir_catalogos, repeticiones, lambda: vaciar_caches(v, compartido=["familia_*"]))
+    # Otro proceso (aquí, la medición anterior) ya publicó los catálogos: solo se mapean del disco.
+    resultados["catalogo_compartido"] = medir(construir_catalogos, repeticiones, lambda: vaciar_caches(v))
+
+    generaciones = v.generaciones_consulta(CONSULTA, fs)
+    def reiniciar_unificacion(compartido=True):
+        v.cargar_y_unificar_por_orden.clear()
+        v._vistas_globales_construidas().clear()
+        if compartido:
+            for ruta in glob.glob(os.path.join(v.SNAPSHOT_COMPARTIDO_DIR, "vista_*")):
+                shutil.rmtree(ruta, ignore_errors=True)
+    resultados["unificacion"] = medir(lambda: v.cargar_y_unificar_por_orden(claves, generaciones, fs), repeticiones, reiniciar_unificacion)
+    resultados["unificacion_compartida"] = medir(
+        lambda: v.cargar_y_unificar_por_orden(claves, generaciones, fs), repeticiones, lambda: reiniciar_unificacion(False)
+    )
+
+    vista = v.obtener_vista(CONSULTA, generaciones, fs)
+    v.st.session_state.opcion_elegida = CONSULTA
+    palabras = ["Quito", "Navidad", "Cumple", "Boda de", "playa"]
+    consultas = {
+        "filtro_D": [("D", p, "") for p in palabras],
+        "filtro_P": [("P", p.split()[0], "") for p in personas[:5]],
+        "filtro_B": [("B", f"{a} AND {b} NOT {c}", "") for a, b, c in zip(personas[:5], personas[5:10], personas[10:15])],
+        "filtro_anio": [("D", "", str(anio)) for anio in (1950, 1980, 1995, 2010, 2024)],
+    }
+    for nombre, lista in consultas.items():
+        ciclo = iter(lista * (repeticiones + 1))
+        resultados[nombre] = medir(lambda: v.filter_data(vista, *next(ciclo), avisos=[]), repeticiones)
+    return resultados
+
+def _pulsar(at, texto):
+    for boton in at.button:
+        if boton.key == texto or boton.label.startswith(texto):
+            boton.click()
+            return at.run()
+    raise KeyError(f"No hay botón '{texto}' en la pantalla")
+
+def recorrido_app(v, repeticiones, personas):
+    """Mide cada paso de una sesión real por los estados del menú con AppTest."""
+    from streamlit.testing.v1 import AppTest
+
+    pasos = {
+        "app_inicio": lambda at: at.run(),
+        "app_consulta": lambda at: _pulsar(at, f"btn_{CONSULTA}"),
+        "app_modo": lambda at: _pulsar(at, "P - PERSONAJE"),
+        "app_filtro": lambda at: (at.text_input[0].input(personas[0].split()[0]), _pulsar(at, "🔍")),
+        "app_siguiente": lambda at: _pulsar(at, "btn_next"),
+        "app_grilla": lambda at: _pulsar(at, "btn_grilla"),
+        "app_visor": lambda at: _pulsar(at, "🖼️ Volver al Visor"),
+        "app_presentacion": lambda at: _pulsar(at, "btn_presentacion"), # Construye y envía el manifiesto del tramo
+    }
+    tiempos = {paso: [] for paso in pasos}
+    picos = {}
+    for repeticion in range(repeticiones + 1):
+        at = AppTest.from_file(RUTA_APP, default_timeout=600)
+        ultima = repeticion == repeticiones # La última recorre los pasos solo para medir la memoria
+        for paso, accion in pasos.items():
+            if ultima:
+                gc.collect()
+                tracemalloc.start()
+            inicio = time.perf_counter()
+            accion(at)
+            duracion = time.perf_counter() - inicio
+            if ultima:
+                picos[paso] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+            else:
+                tiempos[paso].append(duracion)
+            if at.exception:
+                raise RuntimeError(f"{paso}: {at.exception[0].message}")
+    return {paso: (tiempos[paso], picos[paso]) for paso in pasos}
+
+
+# --- INFORME Y BASE ---
+
+def imprimir(filas, resultados):
+    print(f"\n{filas} filas por familia ({3 * filas} en la consulta global)")
+    print(f"  {'etapa':<24}{'min ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}{'pico MB':>10}")
+    for etapa, r in resultados.items():
+        print(f"  {etapa:<24}{r['min'] * 1000:>10.1f}{r['p50'] * 1000:>10.1f}{r['p90'] * 1000:>10.1f}{r['max'] * 1000:>10.1f}{r['pico_mb']:>10.1f}")
+
+def comparar(base, actuales, tolerancia):
+    """Etapas que empeoran respecto de la base más que `tolerancia`.
+    
+    La latencia se compara por el mínimo de las repeticiones, el valor menos afectado por otros procesos.
+    """
+    regresiones = []
+    for filas, etapas in actuales.items():
+        for etapa, r in etapas.items():
+            anterior = base.get(filas, {}).get(etapa)
+            if anterior is None:
+                continue
+            if r["min"] > MINIMO_COMPARABLE and r["min"] > anterior["min"] * (1 + tolerancia):
+                regresiones.append(f"{filas} filas, {etapa}: mínimo {anterior['min'] * 1000:.1f} -> {r['min'] * 1000:.1f} ms")
+            if r["pico_mb"] > 1 and r["pico_mb"] > anterior["pico_mb"] * (1 + tolerancia):
+                regresiones.append(f"{filas} filas, {etapa}: pico {anterior['pico_mb']:.1f} -> {r['pico_mb']:.1f} MB")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filas", nargs="+", type=int, default=TAMANOS, help="Filas por familia (p. ej. 1000 1000000)")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--semilla", type=int, default=SEMILLA)
+    parser.add_argument("--base", default="benchmark_base.json")
+    parser.add_argument("--guardar-base", action="store_true")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    parser.add_argument("--sin-app", action="store_true", help="Solo las etapas internas, sin el recorrido con AppTest")
+    args = parser.parse_args()
+
+    v = cargar_visor()
+    actuales = {}
+    for filas in args.filas:
+        raiz, personas = preparar_datos(v, filas, args.semilla)
+        configurar(v, raiz)
+        medidas = etapas_internas(v, args.repeticiones, personas)
+        if not args.sin_app:
+            medidas.update(recorrido_app(v, args.repeticiones, personas))
+        actuales[str(filas)] = {etapa: resumen(*m) for etapa, m in medidas.items()}
+        imprimir(filas, actuales[str(filas)])
+
+    if args.guardar_base:
+        base = {}
+        if os.path.exists(args.base):
+            with open(args.base, encoding="utf-8") as f:
+                base = json.load(f)
+        base.update(actuales)
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(base, f, indent=2)
+        print(f"\nBase guardada en {args.base}.")
+    elif os.path.exists(args.base):
+        with open(args.base, encoding="utf-8") as f:
+            regresiones = comparar(json.load(f), actuales, args.tolerancia)
+        if regresiones:
+            print(f"\nRegresiones respecto de {args.base} (tolerancia {args.tolerancia:.0%}):")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto de {args.base}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Genera versiones reducidas (WebP y JPEG) de las fotos del Bucket para que el visor no descargue originales.
+
+Uso:
+    python generar_derivados.py [--carpetas FOTOSCO FOTOSVE HIJOS] [--anchos 480 960 1600] [--procesos 4] [--punto-control 500]
+
+Los derivados se guardan en `_derivados/<ancho>/<carpeta>/<nombre con extensión>.webp|.jpg` (a.jpg y a.png no
+comparten derivados) y el índice `_derivados/indice.json` indica al visor qué anchos existen de cada foto (y el ancho
+del original, con la versión del original con que se generaron). Solo se generan los anchos que le faltan a cada
+foto, o todos si el original se reemplazó en el Bucket, repartiendo las fotos entre varios procesos;
+el índice se guarda cada `--punto-control` fotos, así que si se interrumpe no se repite lo ya hecho.
+"""
+import argparse
+import io
+import json
+import os
+
+import gcsfs
+from PIL import Image, ImageOps
+
+import indexado_fotos
+
+BUCKET_NAME = "fotosfamilialfve"
+CARPETAS_FOTOS = ["FOTOSCO", "FOTOSVE", "HIJOS"]
+PREFIJO_DERIVADOS = "_derivados"
+RUTA_INDICE_DERIVADOS = f"{PREFIJO_DERIVADOS}/indice.json"
+ANCHOS_DERIVADOS = [480, 960, 1600]
+CALIDAD_WEBP = 80
+CALIDAD_JPEG = 82
+PUNTO_CONTROL = 500
+FORMATO_INDICE = 2 # 2: derivados con el nombre completo del original. Los de un índice anterior se regeneran.
+
+
+def ruta_derivado(ancho, carpeta, nombre, extension):
+    return f"{PREFIJO_DERIVADOS}/{ancho}/{carpeta}/{nombre}.{extension}"
+
+
+def anchos_faltantes(hechos, anchos, version):
+    """Anchos pedidos que la foto aún no tiene (sin contar los que no son menores que su original).
+    
+    Si los derivados son de otra versión del original (se reemplazó en el Bucket), faltan todos.
+    """
+    if hechos is None or hechos.get("version") != version:
+        return list(anchos)
+    return [ancho for ancho in anchos if ancho < hechos["original"] and ancho not in hechos["anchos"]]
+
+
+def generar_derivados_foto(bucket, carpeta, nombre, version, anchos, hechos=None):
+    """Crea los derivados de una foto en cada ancho de `anchos` menor que el original.
+    
+    `hechos` es su entrada del índice si ya tenía derivados de esta `version` del original: se conservan en
+    el resultado. Devuelve (clave, {"anchos": anchos disponibles, "original": ancho del original,
+    "version": versión del original}) o (clave, error).
+    """
+    clave = f"{carpeta}/{nombre}"
+    fs = indexado_fotos.fs_proceso()
+    try:
+        with fs.open(f"{bucket}/{carpeta}/{nombre}", 'rb') as f:
+            imagen = Image.open(io.BytesIO(f.read()))
+            imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode not in ("RGB", "L"):
+            imagen = imagen.convert("RGB")
+
+        disponibles = list(hechos["anchos"]) if hechos else []
+        for ancho in sorted(anchos):
+            if ancho >= imagen.width:
+                break # No se amplían fotos: para anchos mayores el visor usa el original.
+            copia = imagen.copy()
+            copia.thumbnail((ancho, ancho * 10), Image.LANCZOS)
+            for extension, formato, calidad in (("webp", "WEBP", CALIDAD_WEBP), ("jpg", "JPEG", CALIDAD_JPEG)):
+                buffer = io.BytesIO()
+                copia.save(buffer, format=formato, quality=calidad)
+                with fs.open(f"{bucket}/{ruta_derivado(ancho, carpeta, nombre, extension)}", 'wb') as f:
+                    f.write(buffer.getvalue())
+            disponibles.append(ancho)
+        return clave, {"anchos": sorted(disponibles), "original": imagen.width, "version": version}
+    except Exception as e:
+        return clave, e
+
+
+def generar_derivados_lote(bucket, fotos):
+    """Derivados de un lote de fotos [(carpeta, nombre, versión, anchos, hechos)], para `indexado_fotos.procesar`."""
+    return [generar_derivados_foto(bucket, *foto) for foto in fotos]
+
+
+def leer_indice(fs, bucket):
+    """Fotos del índice ('CARPETA/nombre' -> entrada); vacío si no existe o es de un formato anterior."""
+    try:
+        with fs.open(f"{bucket}/{RUTA_INDICE_DERIVADOS}", 'rb') as f:
+            indice = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return indice.get("fotos", {}) if indice.get("formato") == FORMATO_INDICE else {}
+
+
+def guardar_indice(fs, bucket, fotos):
+    """Escribe el índice completo (la escritura de un objeto de GCS es atómica: nunca queda a medias)."""
+    indice = {"formato": FORMATO_INDICE, "fotos": fotos}
+    with fs.open(f"{bucket}/{RUTA_INDICE_DERIVADOS}", 'wb') as f:
+        f.write(json.dumps(indice).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--carpetas", nargs="+", default=CARPETAS_FOTOS)
+    parser.add_argument("--anchos", nargs="+", type=int, default=ANCHOS_DERIVADOS)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count())
+    parser.add_argument("--punto-control", type=int, default=PUNTO_CONTROL)
+    args = parser.parse_args()
+
+    fs = gcsfs.GCSFileSystem()
+    fotos_indice = leer_indice(fs, args.bucket)
+    anchos = sorted(set(args.anchos))
+
+    # Una foto queda pendiente si le falta alguno de los anchos pedidos (solo se generan esos) o si su original
+    # cambió desde que se generaron sus derivados (se generan todos de nuevo).
+    pendientes = []
+    for carpeta in args.carpetas:
+        prefijo = f"{args.bucket}/{carpeta}/"
+        for ruta, info in fs.find(prefijo, detail=True).items():
+            nombre = ruta[len(prefijo):]
+            if os.path.splitext(nombre)[1].lower() not in indexado_fotos.EXTENSIONES_IMAGEN:
+                continue
+            version = indexado_fotos.version_objeto(info)
+            hechos = fotos_indice.get(f"{carpeta}/{nombre}")
+            faltantes = anchos_faltantes(hechos, anchos, version)
+            if faltantes:
+                vigentes = hechos if hechos is not None and hechos.get("version") == version else None
+                pendientes.append((carpeta, nombre, version, faltantes, vigentes))
+
+    print(f"{len(pendientes)} fotos pendientes de {len(args.carpetas)} carpetas.")
+    errores = indexado_fotos.procesar(
+        args.bucket, pendientes, generar_derivados_lote, fotos_indice,
+        lambda fotos: guardar_indice(fs, args.bucket, fotos),
+        args.procesos, args.punto_control,
+    )
+    print(f"Listo: {len(pendientes) - errores} fotos procesadas, {errores} errores.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Calcula el hash perceptual (pHash) de las fotos del Bucket para encontrar la misma foto en varias carpetas.
+
+Uso:
+    python generar_huellas.py [--carpetas FOTOSCO FOTOSVE HIJOS] [--procesos 8] [--lote 64] [--punto-control 2000]
+
+El resultado es la tabla `_huellas/huellas.parquet` (una fila por foto, con su hash de 64 bits) que el visor usa
+para agrupar los duplicados de las consultas globales: el mismo original escaneado en varias carpetas da hashes
+con muy pocos bits distintos. Cada proceso del pool decodifica un lote de fotos ya reducidas (con el derivado más
+pequeño de `generar_derivados.py` si existe) y calcula los hashes del lote a la vez con NumPy. Como en
+`generar_metadatos.py`, la tabla se guarda cada `--punto-control` fotos y solo se procesan las que faltan o cambiaron.
+"""
+import argparse
+import io
+import json
+import os
+
+import gcsfs
+import numpy as np
+from PIL import Image, ImageOps
+
+import indexado_fotos
+
+BUCKET_NAME = "fotosfamilialfve"
+CARPETAS_FOTOS = ["FOTOSCO", "FOTOSVE", "HIJOS"]
+PREFIJO_HUELLAS = "_huellas"
+RUTA_HUELLAS = f"{PREFIJO_HUELLAS}/huellas.parquet"
+PREFIJO_DERIVADOS = "_derivados"
+RUTA_INDICE_DERIVADOS = f"{PREFIJO_DERIVADOS}/indice.json"
+FORMATO_DERIVADOS = 2 # El de generar_derivados.py: derivados con el nombre completo del original
+LOTE = 64 # Fotos por tarea del pool (los hashes de un lote se calculan juntos)
+PUNTO_CONTROL = 2000
+COLUMNAS = ["CARPETA", "NOMBRE_FOTO", "VERSION", "PHASH"]
+TIPOS = {"PHASH": "uint64"}
+
+# pHash: DCT 2D de la foto en grises reducida a 32x32; cada bit dice si uno de los 8x8 coeficientes de
+# frecuencia más baja supera la mediana de esos 64 coeficientes.
+TAMANO_DCT = 32
+TAMANO_HASH = 8
+_n = np.arange(TAMANO_DCT)
+DCT = np.sqrt(2 / TAMANO_DCT) * np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * TAMANO_DCT))
+DCT[0] /= np.sqrt(2) # Matriz DCT-II ortonormal
+
+
+def phash_lote(pixeles):
+    """Hashes (uint64) de un lote de fotos en grises de TAMANO_DCT x TAMANO_DCT, con forma (n, 32, 32)."""
+    coeficientes = DCT @ pixeles @ DCT.T # DCT 2D de todo el lote en dos productos de matrices
+    bajas = coeficientes[:, :TAMANO_HASH, :TAMANO_HASH].reshape(len(pixeles), -1)
+    bits = bajas > np.median(bajas, axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def _pixeles(datos):
+    imagen = Image.open(io.BytesIO(datos))
+    imagen.draft('L', (TAMANO_DCT * 4, TAMANO_DCT * 4)) # JPEG: se decodifica ya reducida (mucho más rápido)
+    imagen = ImageOps.exif_transpose(imagen).convert('L').resize((TAMANO_DCT, TAMANO_DCT), Image.LANCZOS)
+    return np.asarray(imagen, dtype=np.float32)
+
+
+def huellas_lote(bucket, fotos):
+    """Calcula los hashes de un lote de fotos [(carpeta, nombre, versión, ruta a leer)].
+
+    Devuelve una lista de (clave, fila de la tabla) o (clave, error).
+    """
+    fs = indexado_fotos.fs_proceso()
+    resultados, leidas, pixeles = [], [], []
+    for carpeta, nombre, version, ruta in fotos:
+        clave = f"{carpeta}/{nombre}"
+        try:
+            with fs.open(f"{bucket}/{ruta}", 'rb') as f:
+                pixeles.append(_pixeles(f.read()))
+            leidas.append((clave, carpeta, nombre, version))
+        except Exception as e:
+            resultados.append((clave, e))
+    if pixeles:
+        for (clave, carpeta, nombre, version), phash in zip(leidas, phash_lote(np.stack(pixeles))):
+            resultados.append((clave, {"CARPETA": carpeta, "NOMBRE_FOTO": nombre, "VERSION": version, "PHASH": phash}))
+    return resultados
+
+
+def leer_indice_derivados(fs, bucket):
+    try:
+        with fs.open(f"{bucket}/{RUTA_INDICE_DERIVADOS}", 'rb') as f:
+            indice = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return indice.get("fotos", {}) if indice.get("formato") == FORMATO_DERIVADOS else {}
+
+
+def ruta_lectura(carpeta, nombre, derivados):
+    """Ruta del derivado JPEG más pequeño de la foto, o la del original si no tiene derivados."""
+    anchos = derivados.get(f"{carpeta}/{nombre}", {}).get("anchos")
+    if anchos:
+        return f"{PREFIJO_DERIVADOS}/{min(anchos)}/{carpeta}/{nombre}.jpg"
+    return f"{carpeta}/{nombre}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--carpetas", nargs="+", default=CARPETAS_FOTOS)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count())
+    parser.add_argument("--lote", type=int, default=LOTE)
+    parser.add_argument("--punto-control", type=int, default=PUNTO_CONTROL)
+    args = parser.parse_args()
+
+    fs = gcsfs.GCSFileSystem()
+    filas = indexado_fotos.leer_tabla(fs, args.bucket, RUTA_HUELLAS, COLUMNAS)
+    derivados = leer_indice_derivados(fs, args.bucket)
+    # Una foto queda pendiente si no está en la tabla o si cambió desde que se calculó su hash.
+    pendientes, borradas = indexado_fotos.fotos_pendientes(
+        fs, args.bucket, args.carpetas, filas, indexado_fotos.version_objeto
+    )
+    pendientes = [(carpeta, nombre, version, ruta_lectura(carpeta, nombre, derivados)) for carpeta, nombre, version in pendientes]
+
+    print(f"{len(pendientes)} fotos pendientes de {len(args.carpetas)} carpetas ({len(filas)} ya calculadas).")
+    errores = indexado_fotos.procesar(
+        args.bucket, pendientes, huellas_lote, filas,
+        lambda hechas: indexado_fotos.guardar_tabla(fs, args.bucket, RUTA_HUELLAS, hechas, COLUMNAS, TIPOS),
+        args.procesos, args.punto_control, lote=args.lote, sin_guardar=borradas,
+    )
+    print(f"Listo: {len(pendientes) - errores} fotos procesadas, {errores} errores.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Indexa la fecha de captura, las dimensiones y la orientación de las fotos del Bucket (cabecera y EXIF).
+
+Uso:
+    python generar_metadatos.py [--carpetas FOTOSCO FOTOSVE HIJOS] [--procesos 8] [--punto-control 500]
+
+De cada foto solo se leen los primeros bloques (la cabecera con el EXIF), no la imagen entera. El resultado es la
+tabla `_metadatos/metadatos.parquet` (una fila por foto) que el visor une a los catálogos: da las dimensiones de
+cada foto y el año de las filas cuyo AÑO está vacío o no es numérico. La fecha de captura es solo la de
+DateTimeOriginal: la de digitalización o modificación de un escaneo no es el año de la foto. La tabla se guarda cada `--punto-control`
+fotos; si el proceso se interrumpe, al volver a lanzarlo solo se procesan las fotos que faltan o que cambiaron.
+"""
+import argparse
+import os
+
+import gcsfs
+from PIL import Image
+
+import indexado_fotos
+
+BUCKET_NAME = "fotosfamilialfve"
+CARPETAS_FOTOS = ["FOTOSCO", "FOTOSVE", "HIJOS"]
+PREFIJO_METADATOS = "_metadatos"
+RUTA_METADATOS = f"{PREFIJO_METADATOS}/metadatos.parquet"
+BLOQUE_CABECERA = 64 * 1024 # Lecturas pequeñas: la cabecera y el EXIF suelen estar en el primer bloque
+PUNTO_CONTROL = 500
+FORMATO = 2 # Forma parte de VERSION: al cambiar lo que se extrae de cada foto, se vuelven a indexar todas
+COLUMNAS = ["CARPETA", "NOMBRE_FOTO", "VERSION", "ANCHO", "ALTO", "ORIENTACION", "FECHA_CAPTURA", "ANIO_CAPTURA"]
+TIPOS = {"ANCHO": "Int32", "ALTO": "Int32", "ORIENTACION": "Int8", "ANIO_CAPTURA": "Int16"}
+
+# Etiquetas EXIF
+EXIF_IFD = 0x8769
+EXIF_ORIENTACION = 0x0112
+EXIF_FECHA_ORIGINAL = 0x9003 # DateTimeOriginal: cuándo se tomó la foto
+
+
+def _fecha_exif(valor):
+    """'AAAA:MM:DD HH:MM:SS' del EXIF como ('AAAA-MM-DD HH:MM:SS', año); (None, None) si no es una fecha válida."""
+    if isinstance(valor, bytes):
+        valor = valor.decode("ascii", errors="ignore")
+    valor = str(valor or "").strip().strip("\x00")
+    try:
+        anio, mes, dia = int(valor[0:4]), int(valor[5:7]), int(valor[8:10])
+    except ValueError:
+        return None, None
+    if anio < 1800 or not 1 <= mes <= 12 or not 1 <= dia <= 31: # Cámaras sin fecha: '0000:00:00 ...'
+        return None, None
+    return f"{valor[0:4]}-{valor[5:7]}-{valor[8:10]}{valor[10:19]}", anio
+
+
+def leer_metadatos_foto(bucket, carpeta, nombre, version):
+    """Lee la cabecera de una foto: (clave, fila de la tabla) o (clave, error).
+
+    ANCHO y ALTO son los de la foto tal como se muestra (ya aplicada la orientación EXIF).
+    """
+    clave = f"{carpeta}/{nombre}"
+    try:
+        with indexado_fotos.fs_proceso().open(f"{bucket}/{carpeta}/{nombre}", 'rb', block_size=BLOQUE_CABECERA) as f:
+            with Image.open(f) as imagen: # Image.open solo lee la cabecera; los píxeles no se decodifican.
+                ancho, alto = imagen.size
+                exif = imagen.getexif()
+        orientacion = int(exif.get(EXIF_ORIENTACION, 1) or 1)
+        if orientacion in (5, 6, 7, 8): # Rotada 90°: se muestra con ancho y alto intercambiados
+            ancho, alto = alto, ancho
+        # Solo DateTimeOriginal: DateTimeDigitized y DateTime de una foto escaneada son la fecha del escaneo.
+        fecha, anio = _fecha_exif(exif.get_ifd(EXIF_IFD).get(EXIF_FECHA_ORIGINAL))
+        return clave, {
+            "CARPETA": carpeta, "NOMBRE_FOTO": nombre, "VERSION": version,
+            "ANCHO": ancho, "ALTO": alto, "ORIENTACION": orientacion,
+            "FECHA_CAPTURA": fecha, "ANIO_CAPTURA": anio,
+        }
+    except Exception as e:
+        return clave, e
+
+
+def leer_metadatos_lote(bucket, fotos):
+    """Metadatos de un lote de fotos [(carpeta, nombre, versión)], para `indexado_fotos.procesar`."""
+    return [leer_metadatos_foto(bucket, carpeta, nombre, version) for carpeta, nombre, version in fotos]
+
+
+def _version(info):
+    """Versión del objeto con el FORMATO con que se indexó: cambia si la foto se reemplaza o si cambia lo que se extrae."""
+    return indexado_fotos.version_objeto(info, FORMATO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--carpetas", nargs="+", default=CARPETAS_FOTOS)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count())
+    parser.add_argument("--punto-control", type=int, default=PUNTO_CONTROL)
+    args = parser.parse_args()
+
+    fs = gcsfs.GCSFileSystem()
+    filas = indexado_fotos.leer_tabla(fs, args.bucket, RUTA_METADATOS, COLUMNAS)
+    # Una foto queda pendiente si no está en la tabla o si cambió desde que se indexó.
+    pendientes, borradas = indexado_fotos.fotos_pendientes(fs, args.bucket, args.carpetas, filas, _version)
+
+    print(f"{len(pendientes)} fotos pendientes de {len(args.carpetas)} carpetas ({len(filas)} ya indexadas).")
+    errores = indexado_fotos.procesar(
+        args.bucket, pendientes, leer_metadatos_lote, filas,
+        lambda hechas: indexado_fotos.guardar_tabla(fs, args.bucket, RUTA_METADATOS, hechas, COLUMNAS, TIPOS),
+        args.procesos, args.punto_control, sin_guardar=borradas,
+    )
+    print(f"Listo: {len(pendientes) - errores} fotos procesadas, {errores} errores.")
+
+
+if __name__ == "__main__":
+    main()
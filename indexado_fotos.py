@@ -0,0 +1,113 @@
+"""Partes comunes de los scripts que procesan las fotos del Bucket fuera del visor (`generar_metadatos.py`,
+`generar_huellas.py`, `generar_derivados.py`).
+
+Cada script calcula una fila por foto; este módulo lee y escribe la tabla Parquet de los dos primeros, decide qué
+fotos faltan o cambiaron y reparte el trabajo entre un pool de procesos, guardando la tabla (o el índice de
+derivados) cada `punto_control` fotos para que lo hecho no se repita si el proceso se interrumpe.
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gcsfs
+import pandas as pd
+
+EXTENSIONES_IMAGEN = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']
+
+_fs = None # Conexión a GCS propia de cada proceso del pool
+
+
+def iniciar_proceso():
+    global _fs
+    _fs = gcsfs.GCSFileSystem()
+
+
+def fs_proceso():
+    """Conexión a GCS del proceso del pool (la abre `iniciar_proceso`)."""
+    return _fs
+
+
+def version_objeto(info, formato=None):
+    """Identifica el contenido de un objeto: cambia si la foto se reemplaza en el Bucket.
+
+    Con `formato` (el de la tabla que lo indexa) también cambia al cambiar lo que se extrae de cada foto.
+    """
+    version = str(info.get("generation") or info.get("mtime") or info.get("size"))
+    return version if formato is None else f"{formato}:{version}"
+
+
+def leer_tabla(fs, bucket, ruta, columnas):
+    """Filas ya calculadas de la tabla, por clave "CARPETA/NOMBRE_FOTO" (vacía si aún no existe)."""
+    try:
+        with fs.open(f"{bucket}/{ruta}", 'rb') as f:
+            tabla = pd.read_parquet(io.BytesIO(f.read()))
+    except FileNotFoundError:
+        tabla = pd.DataFrame(columns=columnas)
+    return {f"{r['CARPETA']}/{r['NOMBRE_FOTO']}": r for r in tabla.to_dict("records")}
+
+
+def guardar_tabla(fs, bucket, ruta, filas, columnas, tipos=None):
+    """Escribe la tabla completa (la escritura de un objeto de GCS es atómica: nunca queda a medias)."""
+    tabla = pd.DataFrame(list(filas.values()), columns=columnas)
+    if tipos:
+        tabla = tabla.astype(tipos)
+    buffer = io.BytesIO()
+    tabla.sort_values(["CARPETA", "NOMBRE_FOTO"]).to_parquet(buffer, index=False)
+    with fs.open(f"{bucket}/{ruta}", 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def fotos_pendientes(fs, bucket, carpetas, filas, version):
+    """Fotos de `carpetas` que no están en `filas` o cambiaron desde que se calcularon [(carpeta, nombre, versión)].
+
+    `version(info)` da la versión de cada objeto. Las fotos borradas del Bucket salen de `filas` (solo las de
+    las carpetas procesadas); devuelve también cuántas se quitaron.
+    """
+    pendientes = []
+    existentes = set()
+    for carpeta in carpetas:
+        prefijo = f"{bucket}/{carpeta}/"
+        for ruta, info in fs.find(prefijo, detail=True).items():
+            nombre = ruta[len(prefijo):]
+            if os.path.splitext(nombre)[1].lower() not in EXTENSIONES_IMAGEN:
+                continue
+            existentes.add(f"{carpeta}/{nombre}")
+            hecha = filas.get(f"{carpeta}/{nombre}")
+            if hecha is None or hecha["VERSION"] != version(info):
+                pendientes.append((carpeta, nombre, version(info)))
+
+    borradas = [c for c in filas if c.split('/', 1)[0] in carpetas and c not in existentes]
+    for clave in borradas:
+        del filas[clave]
+    return pendientes, len(borradas)
+
+
+def procesar(bucket, pendientes, funcion, filas, guardar, procesos, punto_control, lote=1, sin_guardar=0):
+    """Reparte `pendientes` en lotes entre un pool de procesos y añade a `filas` lo que calcula cada uno.
+
+    `funcion(bucket, lote)` devuelve una lista de (clave, fila de la tabla) o (clave, error).
+    `guardar(filas)` escribe la tabla: cada `punto_control` filas nuevas (o quitadas, `sin_guardar`) y al
+    terminar. Devuelve el número de errores.
+    """
+    lotes = [pendientes[i:i + lote] for i in range(0, len(pendientes), lote)]
+    procesadas = 0
+    errores = 0
+    with ProcessPoolExecutor(max_workers=procesos, initializer=iniciar_proceso) as pool:
+        futuros = [pool.submit(funcion, bucket, fotos) for fotos in lotes]
+        for futuro in as_completed(futuros):
+            for clave, resultado in futuro.result():
+                procesadas += 1
+                if isinstance(resultado, Exception):
+                    errores += 1
+                    print(f"Error en {clave}: {resultado}")
+                else:
+                    filas[clave] = resultado
+                    sin_guardar += 1
+            if sin_guardar >= punto_control:
+                guardar(filas) # Punto de control: lo hecho no se repite si se interrumpe.
+                sin_guardar = 0
+                print(f"{procesadas}/{len(pendientes)} fotos procesadas.")
+
+    if sin_guardar or not filas: # Sin filas también se escribe: la tabla vacía indica que ya se procesó
+        guardar(filas)
+    return errores
@@ -1,9 +1,51 @@
 import streamlit as st
-import pandas as pd
-import gcsfs
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import streamlit.components.v1 as components
+import numpy as np
+import asyncio
+import bisect
+import contextlib
+import functools
+import hashlib
+import heapq
+import importlib
 import io
+import json
+import logging
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+try:
+    import fcntl
+except ImportError: # Windows: sin bloqueos entre procesos (el snapshot compartido queda desactivado)
+    fcntl = None
+
+
+class _ModuloDiferido:
+    """Importa el módulo la primera vez que se usa: el menú inicial se muestra sin esperar a pandas ni a gcsfs."""
+    def __init__(self, nombre):
+        self._nombre = nombre
+
+    def __getattr__(self, atributo):
+        valor = getattr(importlib.import_module(self._nombre), atributo)
+        setattr(self, atributo, valor) # Los siguientes accesos no pasan por __getattr__ (p. ej. pd.notna en bucles)
+        return valor
+
+pd = _ModuloDiferido("pandas")
+gcsfs = _ModuloDiferido("gcsfs")
+openpyxl = _ModuloDiferido("openpyxl")
+pa = _ModuloDiferido("pyarrow")
 
 # --- 0. CSS PARA OCULTAR, AJUSTAR ESPACIO Y HEADER FLOTANTE (VERSIÓN MÍNIMA Y AGRESIVA) ---
 hide_streamlit_style = """
@@ -123,22 +165,48 @@ st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 BUCKET_NAME = "fotosfamilialfve"
 # La ruta base de las fotos en tu Bucket
 GCS_BASE_PATH = f"gs://{BUCKET_NAME}/"
-CACHE_TTL = 3600 # Variable para el TTL (Time To Live) del caché (1 hora)
+# Bucket privado: el navegador no usa URLs públicas, las imágenes se sirven desde el servidor de medios
+# (solo si además VISOR_MEDIOS_URL indica cómo llega el navegador a él)
+BUCKET_PRIVADO = os.environ.get("VISOR_BUCKET_PRIVADO", "0") == "1"
+PRECARGA_AL_INICIO = os.environ.get("VISOR_PRECARGA", "1") != "0" # Calentar los catálogos en segundo plano al arrancar
+METADATA_TTL = 30 # Segundos entre comprobaciones de la generación de cada Excel en GCS
+LISTADO_TTL = 300 # Segundos entre listados de cada carpeta de fotos (fotos faltantes y huérfanas)
+# Carpeta local donde se guardan los snapshots Parquet de los catálogos ya procesados
+CATALOG_CACHE_DIR = os.environ.get("CATALOG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "visor_catalogos"))
+# Snapshot de catálogos, índices y órdenes globales compartido por los procesos que ven este disco
+SNAPSHOT_COMPARTIDO_DIR = os.environ.get("VISOR_SNAPSHOT_DIR", os.path.join(CATALOG_CACHE_DIR, "compartido"))
+SNAPSHOT_COMPARTIDO = os.environ.get("VISOR_SNAPSHOT_COMPARTIDO", "1") != "0" and fcntl is not None
+
+# Backend de almacenamiento: "gcs" (por defecto) o "local", una carpeta que contiene la carpeta
+# BUCKET_NAME con los mismos archivos que el Bucket (para trabajar y probar sin conexión).
+STORAGE_BACKEND = os.environ.get("VISOR_STORAGE", "gcs")
+LOCAL_STORAGE_DIR = os.environ.get("VISOR_LOCAL_DIR", ".")
+DESCARGA_INTENTOS = 4 # Intentos por objeto en las descargas (con espera exponencial entre ellos)
+DESCARGA_ESPERA_BASE = 0.5 # Segundos de espera antes del primer reintento
+DESCARGA_TIMEOUT = 120 # Segundos máximos por intento y objeto
+
+BACKENDS_ALMACENAMIENTO = {
+    "gcs": lambda: gcsfs.GCSFileSystem(),
+    "local": lambda: DirFileSystem(path=os.path.abspath(LOCAL_STORAGE_DIR), fs=LocalFileSystem()),
+}
 
 # Inicialización del FileSystem de GCS
 @st.cache_resource
 def init_gcs_fs():
-    """Inicializa la conexión a GCS (requiere autenticación de gcloud)."""
+    """Inicializa el almacenamiento configurado en VISOR_STORAGE (GCS requiere autenticación de gcloud)."""
     try:
-        fs = gcsfs.GCSFileSystem()
+        fs = BACKENDS_ALMACENAMIENTO[STORAGE_BACKEND]()
         return fs
     except Exception as e:
         return None
 
-fs = init_gcs_fs()
-if not fs:
-    st.error("Error al inicializar GCS FileSystem. Verifique la configuración de su llave JSON o permisos.")
-    st.stop() # Detiene la aplicación si la conexión falla.
+def obtener_fs():
+    """Devuelve el FileSystem, que se inicializa la primera vez que hace falta (no al mostrar el menú)."""
+    fs = init_gcs_fs()
+    if not fs:
+        st.error(f"Error al inicializar el almacenamiento '{STORAGE_BACKEND}'. Verifique la configuración de su llave JSON o permisos.")
+        st.stop() # Detiene la aplicación si la conexión falla.
+    return fs
 
 # Definición de las consultas (Mapeo de rutas de Excel a carpetas de GCS)
 consultas_individuales = {
@@ -166,87 +234,1742 @@ consultas_globales = {
 }
 consultas = {**consultas_individuales, **consultas_globales}
 
+EXTENSIONES_IMAGEN = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']
+EXTENSIONES_VIDEO = ['.mp4', '.avi', '.mov', '.mkv']
+
+# Derivados reducidos de las fotos (los genera generar_derivados.py)
+PREFIJO_DERIVADOS = "_derivados"
+RUTA_INDICE_DERIVADOS = f"{PREFIJO_DERIVADOS}/indice.json"
+FORMATO_DERIVADOS = 2 # Derivados con el nombre completo del original (a.jpg -> a.jpg.webp); un índice anterior se ignora
+# Fecha de captura, dimensiones y orientación de las fotos (las indexa generar_metadatos.py)
+PREFIJO_METADATOS = "_metadatos"
+RUTA_METADATOS = f"{PREFIJO_METADATOS}/metadatos.parquet"
+# Hash perceptual de las fotos para agrupar duplicados entre carpetas (lo calcula generar_huellas.py)
+PREFIJO_HUELLAS = "_huellas"
+RUTA_HUELLAS = f"{PREFIJO_HUELLAS}/huellas.parquet"
+DISTANCIA_DUPLICADOS = int(os.environ.get("VISOR_DISTANCIA_DUPLICADOS", "4")) # Bits distintos como máximo entre dos copias
+TAMANOS_IMAGEN = "(max-width: 768px) 100vw, 85vw" # Ancho aproximado con el que se muestra la foto (atributo sizes)
+
+
+# --- 1.1. MÉTRICAS DE RENDIMIENTO (OPCIONALES) ---
+# Con VISOR_METRICAS=1 se mide cada etapa (lectura de GCS, Excel, catálogos, mezcla global, filtrado y
+# pintado), se cuentan los aciertos y fallos de cada caché y la memoria de cada sesión. Todo se escribe
+# como líneas JSON en el log y se publica en formato Prometheus en `/metrics` del servidor de medios.
+# Desactivadas, los decoradores devuelven las funciones tal cual: no añaden ningún coste.
+METRICAS_ACTIVAS = os.environ.get("VISOR_METRICAS", "0") == "1"
+LIMITES_TRAMOS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # Segundos (buckets del histograma)
+
+registro = logging.getLogger("visor.metricas")
+
+def _valor_etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(**etiquetas):
+    """Etiquetas de una muestra de Prometheus: {clave="valor",...}."""
+    return "{" + ",".join(f'{clave}="{_valor_etiqueta(valor)}"' for clave, valor in etiquetas.items()) + "}"
+
+def _tamano_valor(valor):
+    """Memoria aproximada de un valor del estado de sesión (exacta para los arrays de NumPy)."""
+    return valor.nbytes if isinstance(valor, np.ndarray) else sys.getsizeof(valor)
+
+class Metricas:
+    """Duraciones por etapa, contadores de caché y memoria por sesión del proceso (compartidas por las sesiones)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tramos = {} # etapa -> [cuentas por límite, suma, total]
+        self.caches = {} # capa -> {"llamadas", "fallos"} (cachés de Streamlit)
+        self.fuentes = {} # capa -> función estadisticas() (cachés propias del visor)
+        self.reruns = {} # estado del menú -> ejecuciones
+        self.sesiones = {} # id de sesión -> bytes de su estado
+        if METRICAS_ACTIVAS and not registro.handlers:
+            manejador = logging.StreamHandler()
+            manejador.setFormatter(logging.Formatter("%(message)s"))
+            registro.addHandler(manejador)
+            registro.setLevel(logging.INFO)
+            registro.propagate = False
+
+    def observar(self, etapa, segundos):
+        with self._lock:
+            tramo = self.tramos.setdefault(etapa, [[0] * len(LIMITES_TRAMOS), 0.0, 0])
+            for i in range(bisect.bisect_left(LIMITES_TRAMOS, segundos), len(LIMITES_TRAMOS)):
+                tramo[0][i] += 1 # Buckets acumulados: observaciones <= límite
+            tramo[1] += segundos
+            tramo[2] += 1
+        ctx = get_script_run_ctx(suppress_warning=True)
+        registro.info(json.dumps({
+            "evento": "tramo", "etapa": etapa, "ms": round(segundos * 1000, 3),
+            "sesion": ctx.session_id if ctx else None, "hilo": threading.current_thread().name,
+        }))
+
+    def contar_cache(self, capa, resultado):
+        with self._lock:
+            contadores = self.caches.setdefault(capa, {"llamadas": 0, "fallos": 0})
+            contadores[resultado] += 1
+
+    def registrar_cache(self, capa, estadisticas):
+        self.fuentes[capa] = estadisticas
+
+    def registrar_rerun(self, estado, sesion, estado_sesion):
+        """Cuenta una ejecución del script y actualiza la memoria del estado de su sesión."""
+        memoria = sum(_tamano_valor(estado_sesion[clave]) for clave in list(estado_sesion.keys()))
+        with self._lock:
+            self.reruns[estado] = self.reruns.get(estado, 0) + 1
+            if sesion is not None:
+                self.sesiones[sesion] = memoria
+        registro.info(json.dumps({"evento": "rerun", "estado": estado, "sesion": sesion, "memoria_sesion_bytes": memoria}))
+
+    def _sesiones_activas(self):
+        """Quita las sesiones que ya se cerraron (si hay un runtime de Streamlit que lo indique)."""
+        try:
+            from streamlit import runtime
+            if runtime.exists():
+                instancia = runtime.get_instance()
+                for sesion in [s for s in self.sesiones if not instancia.is_active_session(s)]:
+                    del self.sesiones[sesion]
+        except Exception:
+            pass
+        return dict(self.sesiones)
+
+    def texto_prometheus(self):
+        """Todas las métricas en el formato de texto de Prometheus."""
+        lineas = []
+        with self._lock:
+            tramos = {k: (list(v[0]), v[1], v[2]) for k, v in self.tramos.items()}
+            caches = {k: dict(v) for k, v in self.caches.items()}
+            reruns = dict(self.reruns)
+            sesiones = self._sesiones_activas()
+
+        lineas += ["# HELP visor_tramo_segundos Duración de cada etapa.", "# TYPE visor_tramo_segundos histogram"]
+        for etapa, (cuentas, suma, total) in sorted(tramos.items()):
+            for limite, cuenta in zip(LIMITES_TRAMOS, cuentas):
+                lineas.append(f"visor_tramo_segundos_bucket{_etiquetas(etapa=etapa, le=limite)} {cuenta}")
+            lineas.append(f"visor_tramo_segundos_bucket{_etiquetas(etapa=etapa, le='+Inf')} {total}")
+            lineas.append(f"visor_tramo_segundos_sum{_etiquetas(etapa=etapa)} {suma:.6f}")
+            lineas.append(f"visor_tramo_segundos_count{_etiquetas(etapa=etapa)} {total}")
+
+        lineas += ["# HELP visor_cache_total Consultas a cada caché por resultado.", "# TYPE visor_cache_total counter"]
+        for capa, c in sorted(caches.items()):
+            lineas.append(f"visor_cache_total{_etiquetas(capa=capa, resultado='acierto')} {c['llamadas'] - c['fallos']}")
+            lineas.append(f"visor_cache_total{_etiquetas(capa=capa, resultado='fallo')} {c['fallos']}")
+        estadisticas = {}
+        for capa, fuente in sorted(self.fuentes.items()):
+            estadisticas[capa] = fuente()
+            lineas.append(f"visor_cache_total{_etiquetas(capa=capa, resultado='acierto')} {estadisticas[capa]['aciertos']}")
+            lineas.append(f"visor_cache_total{_etiquetas(capa=capa, resultado='fallo')} {estadisticas[capa]['fallos']}")
+        lineas += ["# HELP visor_cache_bytes Memoria (o disco) ocupada por cada caché.", "# TYPE visor_cache_bytes gauge"]
+        lineas += [f"visor_cache_bytes{_etiquetas(capa=capa)} {e['bytes']}" for capa, e in estadisticas.items()]
+        lineas += ["# HELP visor_cache_entradas Entradas guardadas en cada caché.", "# TYPE visor_cache_entradas gauge"]
+        lineas += [f"visor_cache_entradas{_etiquetas(capa=capa)} {e['entradas']}" for capa, e in estadisticas.items()]
+
+        lineas += ["# HELP visor_reruns_total Ejecuciones del script por estado del menú.", "# TYPE visor_reruns_total counter"]
+        lineas += [f"visor_reruns_total{_etiquetas(estado=estado)} {n}" for estado, n in sorted(reruns.items())]
+        lineas += ["# HELP visor_sesiones_activas Sesiones abiertas.", "# TYPE visor_sesiones_activas gauge",
+                   f"visor_sesiones_activas {len(sesiones)}"]
+        lineas += ["# HELP visor_sesion_memoria_bytes Memoria del estado de cada sesión.", "# TYPE visor_sesion_memoria_bytes gauge"]
+        lineas += [f"visor_sesion_memoria_bytes{_etiquetas(sesion=sesion)} {memoria}" for sesion, memoria in sesiones.items()]
+        if os.path.exists("/proc/self/statm"):
+            with open("/proc/self/statm") as f:
+                residente = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            lineas += ["# HELP visor_proceso_memoria_bytes Memoria residente del proceso.", "# TYPE visor_proceso_memoria_bytes gauge",
+                       f"visor_proceso_memoria_bytes {residente}"]
+        return "\n".join(lineas) + "\n"
+
+@st.cache_resource(show_spinner=False)
+def metricas():
+    """Métricas únicas por proceso (el script se vuelve a ejecutar en cada interacción)."""
+    return Metricas()
+
+METRICAS = metricas()
+
+class _Tramo:
+    __slots__ = ("etapa", "inicio")
+
+    def __init__(self, etapa):
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *excepcion):
+        METRICAS.observar(self.etapa, time.perf_counter() - self.inicio)
+
+_SIN_TRAMO = contextlib.nullcontext()
+
+def tramo(etapa):
+    """Contexto que mide la duración de `etapa` (no hace nada con las métricas desactivadas)."""
+    return _Tramo(etapa) if METRICAS_ACTIVAS else _SIN_TRAMO
+
+def medido(etapa):
+    """Decorador: mide cada llamada a la función como un tramo de `etapa`."""
+    def decorar(funcion):
+        if not METRICAS_ACTIVAS:
+            return funcion
+        @functools.wraps(funcion)
+        def medida(*args, **kwargs):
+            with _Tramo(etapa):
+                return funcion(*args, **kwargs)
+        return medida
+    return decorar
+
+def cache_medida(capa, cache):
+    """Aplica el decorador de caché de Streamlit `cache` contando los aciertos y fallos de `capa`.
+    
+    Los fallos (cuando la función se ejecuta de verdad) se miden además como un tramo de `capa`.
+    """
+    def decorar(funcion):
+        if not METRICAS_ACTIVAS:
+            return cache(funcion)
+        @functools.wraps(funcion)
+        def ejecucion(*args, **kwargs):
+            METRICAS.contar_cache(capa, "fallos")
+            with _Tramo(capa):
+                return funcion(*args, **kwargs)
+        cacheada = cache(ejecucion)
+        @functools.wraps(funcion)
+        def llamada(*args, **kwargs):
+            METRICAS.contar_cache(capa, "llamadas")
+            return cacheada(*args, **kwargs)
+        llamada.clear = cacheada.clear
+        return llamada
+    return decorar
+
 
 # --- 2. GESTIÓN DEL ESTADO Y DATOS (INICIALIZACIÓN) ---
 
 if 'menu_state' not in st.session_state: st.session_state.menu_state = 'INICIO' 
-if 'df_cache' not in st.session_state: st.session_state.df_cache = {} 
-if 'filtered_results' not in st.session_state: st.session_state.filtered_results = pd.DataFrame()
+if 'generaciones_vista' not in st.session_state: st.session_state.generaciones_vista = None
+if 'filas_resultado' not in st.session_state: st.session_state.filas_resultado = np.empty(0, dtype=np.int32)
 if 'photo_index' not in st.session_state: st.session_state.photo_index = 0
+if 'pagina_grilla' not in st.session_state: st.session_state.pagina_grilla = 0
 if 'config_actual' not in st.session_state: st.session_state.config_actual = None
 if 'opcion_elegida' not in st.session_state: st.session_state.opcion_elegida = None
 if 'modo_busqueda' not in st.session_state: st.session_state.modo_busqueda = None
 if 'criterio_busqueda' not in st.session_state: st.session_state.criterio_busqueda = None
 if 'anio_filtro' not in st.session_state: st.session_state.anio_filtro = None
+if 'anio_hasta' not in st.session_state: st.session_state.anio_hasta = None
+if 'ocultar_faltantes' not in st.session_state: st.session_state.ocultar_faltantes = False
+if 'revision_visible' not in st.session_state: st.session_state.revision_visible = False
+if 'agrupar_duplicados' not in st.session_state: st.session_state.agrupar_duplicados = False
+
+if METRICAS_ACTIVAS:
+    _ctx = get_script_run_ctx(suppress_warning=True)
+    METRICAS.registrar_rerun(st.session_state.menu_state, _ctx.session_id if _ctx else None, st.session_state)
 
 
 # --- 3. FUNCIÓN DE CARGA Y PROCESAMIENTO DE DATOS ---
-@st.cache_data(ttl=CACHE_TTL)
-def load_excel_from_gcs(file_name, _fs):
-    """Carga un solo archivo Excel desde GCS."""
+
+class ColumnasFaltantesError(ValueError):
+    """El Excel no contiene alguna de las columnas obligatorias."""
+    def __init__(self, faltantes, encontradas):
+        super().__init__(", ".join(faltantes))
+        self.faltantes = faltantes
+        self.encontradas = encontradas
+
+@cache_medida("generacion", st.cache_data(ttl=METADATA_TTL, show_spinner=False))
+def obtener_generacion_objeto(file_name, _fs):
+    """Devuelve la generación (o etag) actual de un objeto del Bucket (p. ej. un Excel) consultando solo sus metadatos."""
     try:
-        gcs_path = f"{BUCKET_NAME}/{file_name}"
-        with _fs.open(gcs_path, 'rb') as f:
-            data = f.read()
-            
-        df = pd.read_excel(io.BytesIO(data), engine='openpyxl')
-        
-        df.columns = df.columns.str.strip().str.upper()
+        info = _fs.info(f"{BUCKET_NAME}/{file_name}")
+    except Exception:
+        return None
+    for campo in ('generation', 'etag', 'md5Hash', 'mtime', 'updated'):
+        if info.get(campo):
+            return str(info[campo])
+    return None
+
+async def _leer_objeto_async(_fs, ruta):
+    """Lee un objeto con el cliente asíncrono del backend, reintentando con espera exponencial."""
+    with tramo("gcs_lectura"):
+        for intento in range(DESCARGA_INTENTOS):
+            try:
+                return await asyncio.wait_for(_fs._cat_file(ruta), DESCARGA_TIMEOUT)
+            except FileNotFoundError:
+                raise
+            except Exception:
+                if intento == DESCARGA_INTENTOS - 1:
+                    raise
+                await asyncio.sleep(DESCARGA_ESPERA_BASE * 2 ** intento)
+
+@medido("gcs_lectura")
+def _leer_objeto(_fs, ruta, inicio=None, fin=None):
+    """Versión síncrona de `_leer_objeto_async` para backends sin cliente asíncrono (p. ej. el local).
+    
+    Con `inicio`/`fin` lee solo ese rango de bytes (`fin` excluido).
+    """
+    for intento in range(DESCARGA_INTENTOS):
+        try:
+            return _fs.cat_file(ruta, start=inicio, end=fin)
+        except FileNotFoundError:
+            raise
+        except Exception:
+            if intento == DESCARGA_INTENTOS - 1:
+                raise
+            time.sleep(DESCARGA_ESPERA_BASE * 2 ** intento)
+
+def descargar_objetos(_fs, rutas):
+    """Descarga varios objetos a la vez y los entrega según van llegando, como pares (ruta, bytes o excepción).
+    
+    Con GCS todas las descargas comparten el bucle de eventos y la sesión HTTP del FileSystem
+    (reutilizan conexiones); un objeto lento no retrasa la entrega de los demás.
+    """
+    if not rutas:
+        return
+    fs_real = _fs.fs if isinstance(_fs, DirFileSystem) else _fs
+    if getattr(fs_real, "async_impl", False):
+        futuros = {asyncio.run_coroutine_threadsafe(_leer_objeto_async(_fs, ruta), _fs.loop): ruta for ruta in rutas}
+        pool = None
+    else:
+        pool = ThreadPoolExecutor(max_workers=len(rutas))
+        futuros = {pool.submit(_leer_objeto, _fs, ruta): ruta for ruta in rutas}
+    try:
+        for futuro in as_completed(futuros):
+            try:
+                yield futuros[futuro], futuro.result()
+            except Exception as e:
+                yield futuros[futuro], e
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+COLUMNAS_OBLIGATORIAS = ['DESCRIPCION', 'AÑO', 'NOMBRE']
+
+def _columnas_proyectadas(encabezado):
+    """Posición de cada columna que usa el visor (las obligatorias y las PERSONAJE*) según la fila de encabezado."""
+    columnas = {}
+    for posicion, valor in enumerate(encabezado):
+        if valor is None:
+            continue
+        nombre = str(valor).strip().upper()
+        if nombre in COLUMNAS_OBLIGATORIAS or "PERSONAJE" in nombre:
+            base, repetida = nombre, 1
+            while nombre in columnas: # Encabezados repetidos: PERSONAJE, PERSONAJE.1, ... como pandas
+                nombre = f"{base}.{repetida}"
+                repetida += 1
+            columnas[nombre] = posicion
+    return columnas
+
+def _valor_texto(valor):
+    """Celda como texto (los enteros guardados como número sin '.0'); las vacías quedan como nulo."""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor)
+    return texto if texto.strip() != "" else None
+
+@medido("excel")
+def _leer_excel(file_name, _fs, datos=None):
+    """Descarga (si no se recibe `datos`) y procesa el Excel (operación costosa: solo cuando cambia el objeto).
+    
+    La hoja se recorre en modo de solo lectura, fila a fila, y solo se conservan las columnas que usa el
+    visor: las obligatorias se validan en el encabezado antes de leer ningún dato y cada celda se tipa
+    al leerla (texto como str, AÑO numérico si todas sus celdas lo son).
+    """
+    gcs_path = f"{BUCKET_NAME}/{file_name}"
+    if datos is None:
+        for _, datos in descargar_objetos(_fs, [gcs_path]):
+            if isinstance(datos, Exception):
+                raise datos
 
-        required_cols = ['DESCRIPCION', 'AÑO', 'NOMBRE']
-        missing_cols = [col for col in required_cols if col not in df.columns]
+    libro = openpyxl.load_workbook(io.BytesIO(datos), read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        hoja.reset_dimensions() # Algunos Excel declaran mal su tamaño; así se leen todas las filas.
+        filas = hoja.iter_rows(values_only=True)
 
+        encabezado = next(filas, ())
+        columnas = _columnas_proyectadas(encabezado)
+        missing_cols = [col for col in COLUMNAS_OBLIGATORIAS if col not in columnas]
         if missing_cols:
-            st.error(f"Error Crítico: Faltan las columnas: {', '.join(missing_cols)} en el archivo {file_name}.")
-            st.warning(f"Columnas encontradas después de la normalización: {df.columns.tolist()}")
-            return pd.DataFrame()
-            
-        return df
-    except FileNotFoundError:
+            encontradas = [str(v).strip().upper() for v in encabezado if v is not None]
+            raise ColumnasFaltantesError(missing_cols, encontradas)
+
+        posiciones = list(columnas.values())
+        valores = {nombre: [] for nombre in columnas}
+        anio_numerico = True
+        for fila in filas:
+            celdas = [fila[i] if i < len(fila) else None for i in posiciones]
+            if all(_valor_texto(c) is None for c in celdas):
+                continue # Fila en blanco en las columnas del visor
+            for nombre, celda in zip(columnas, celdas):
+                if nombre == 'AÑO' and isinstance(celda, (int, float)) and not isinstance(celda, bool):
+                    valores[nombre].append(float(celda))
+                    continue
+                celda = _valor_texto(celda)
+                if nombre == 'AÑO' and celda is not None:
+                    anio_numerico = False
+                valores[nombre].append(celda)
+    finally:
+        libro.close()
+
+    df = pd.DataFrame({nombre: pd.Series(lista, dtype=object) for nombre, lista in valores.items()})
+    if anio_numerico:
+        df['AÑO'] = df['AÑO'].astype(float)
+    else:
+        # Años mezclados con texto: toda la columna como str (1985.0 -> "1985"), conservando los nulos.
+        df['AÑO'] = pd.Series([_valor_texto(v) for v in valores['AÑO']], dtype=object)
+    return df
+
+def _ruta_snapshot(file_name, generacion):
+    nombre_seguro = re.sub(r'[^A-Za-z0-9_.-]', '_', file_name)
+    generacion_segura = re.sub(r'[^A-Za-z0-9_-]', '_', generacion)
+    return os.path.join(CATALOG_CACHE_DIR, f"{nombre_seguro}.{generacion_segura}.parquet")
+
+def _guardar_snapshot(df, file_name, generacion):
+    """Escribe el snapshot de forma atómica y borra los de generaciones anteriores."""
+    ruta = _ruta_snapshot(file_name, generacion)
+    prefijo = os.path.basename(_ruta_snapshot(file_name, ""))[:-len(".parquet")]
+    try:
+        os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+        ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+        df.to_parquet(ruta_tmp, index=False)
+        os.replace(ruta_tmp, ruta)
+        for archivo in os.listdir(CATALOG_CACHE_DIR):
+            if archivo.startswith(prefijo) and archivo.endswith(".parquet") and archivo != os.path.basename(ruta):
+                os.remove(os.path.join(CATALOG_CACHE_DIR, archivo))
+    except Exception:
+        # El snapshot es solo una optimización: si no se puede escribir, se sigue con el DataFrame en memoria.
+        pass
+
+@medido("snapshot")
+def _cargar_catalogo_por_generacion(file_name, generacion, _fs, _datos=None):
+    """Devuelve el catálogo de una generación concreta: snapshot local si existe, si no parsea el Excel.
+    
+    Sin caché en memoria: el DataFrame solo se usa para construir el catálogo de la familia, que es lo que se guarda.
+    """
+    ruta = _ruta_snapshot(file_name, generacion)
+    if os.path.exists(ruta):
+        try:
+            return pd.read_parquet(ruta)
+        except Exception:
+            pass # Snapshot ilegible: se regenera desde el Excel.
+    df = _leer_excel(file_name, _fs, _datos)
+    _guardar_snapshot(df, file_name, generacion)
+    return df
+
+def cargar_excel(file_name, _fs, datos=None):
+    """Carga un solo archivo Excel desde GCS (solo se vuelve a procesar si cambia su generación).
+    
+    `datos` son los bytes del Excel si ya se descargaron (ver `precargar_catalogos`). Los errores se
+    propagan para que ninguna caché guarde un fallo; quien muestra la página los enseña con `mostrar_error_excel`.
+    """
+    generacion = obtener_generacion_objeto(file_name, _fs)
+    if generacion is None:
+        return _leer_excel(file_name, _fs, datos)
+    return _cargar_catalogo_por_generacion(file_name, generacion, _fs, datos)
+
+def mostrar_error_excel(file_name, error):
+    """Explica en la página por qué no se pudo cargar un Excel."""
+    if isinstance(error, ColumnasFaltantesError):
+        st.error(f"Error Crítico: Faltan las columnas: {', '.join(error.faltantes)} en el archivo {file_name}.")
+        st.warning(f"Columnas encontradas después de la normalización: {error.encontradas}")
+    elif isinstance(error, FileNotFoundError):
         st.error(f"Error: Archivo '{file_name}' no encontrado en el Bucket '{BUCKET_NAME}'.")
+    else:
+        st.error(f"Error al cargar el archivo Excel '{file_name}': {error}")
+
+def load_excel_from_gcs(file_name, _fs, datos=None):
+    """Como `cargar_excel`, pero si falla muestra el error y devuelve un DataFrame vacío."""
+    try:
+        return cargar_excel(file_name, _fs, datos)
     except Exception as e:
-        st.error(f"Error al cargar el archivo Excel '{file_name}': {e}")
+        mostrar_error_excel(file_name, e)
     return pd.DataFrame()
 
-@st.cache_data(ttl=CACHE_TTL)
-def cargar_y_unificar_por_orden(orden_claves, _fs, _cache):
-    """Implementa la lógica de Tkinter para cargar, unificar y ordenar DataFrames."""
-    df_list = []
-    family_order_map = {key: i for i, key in enumerate(orden_claves)}
+# --- 3.1. ÍNDICE INVERTIDO DE BÚSQUEDA (DESCRIPCION / PERSONAJE) ---
+
+_PATRON_TOKEN = re.compile(r'\w+')
+LONGITUD_GRAMA = 3 # Los tokens del vocabulario se indexan por sus n-gramas de 1 a 3 caracteres
+
+def normalizar_texto(texto):
+    """Pasa a minúsculas y quita acentos (José -> jose) para comparar sin distinguirlos."""
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+class IndiceTexto:
+    """Índice invertido token -> filas (posiciones) de un catálogo.
     
-    for key in orden_claves:
-        config = consultas_individuales.get(key)
-        if not config: continue
+    Responde con la misma semántica de subcadena que `str.contains`, pero sin recorrer todas las filas
+    ni el vocabulario: los tokens que contienen un fragmento salen de un índice de n-gramas del vocabulario.
+    """
+    def __init__(self, valores):
+        self.textos = ['' if pd.isna(v) else normalizar_texto(v) for v in valores]
+        postings = {}
+        for fila, texto in enumerate(self.textos):
+            for token in set(_PATRON_TOKEN.findall(texto)):
+                postings.setdefault(token, []).append(fila)
+        self.vocabulario = sorted(postings)
+        self.postings = {token: np.array(filas, dtype=np.int32) for token, filas in postings.items()}
+
+    def _indice_gramas(self):
+        """n-grama (1 a LONGITUD_GRAMA caracteres) -> posiciones en el vocabulario de los tokens que lo contienen.
         
-        excel_name_key = config["ruta_excel"].upper()
+        Se construye la primera vez que se busca (o se lee del snapshot compartido).
+        """
+        gramas = getattr(self, "_gramas", None)
+        if gramas is None:
+            posiciones = {}
+            for i, token in enumerate(self.vocabulario):
+                for grama in {token[j:j + n] for n in range(1, LONGITUD_GRAMA + 1) for j in range(len(token) - n + 1)}:
+                    posiciones.setdefault(grama, []).append(i)
+            gramas = {grama: np.array(lista, dtype=np.int32) for grama, lista in posiciones.items()}
+            self._gramas = gramas
+        return gramas
+
+    def _tokens_con(self, fragmento):
+        """Tokens del vocabulario que contienen `fragmento`.
         
-        if excel_name_key not in _cache:
-            _cache[excel_name_key] = load_excel_from_gcs(config["ruta_excel"], _fs)
+        Hasta LONGITUD_GRAMA caracteres la respuesta es la lista del n-grama; con más, se intersecan las
+        listas de sus trigramas ("vel", "ela", "las"...) y solo se comprueban esos candidatos.
+        """
+        gramas = self._indice_gramas()
+        vacio = np.empty(0, dtype=np.int32)
+        if len(fragmento) <= LONGITUD_GRAMA:
+            return [self.vocabulario[i] for i in gramas.get(fragmento, vacio)]
+        listas = sorted(
+            (gramas.get(fragmento[j:j + LONGITUD_GRAMA], vacio) for j in range(len(fragmento) - LONGITUD_GRAMA + 1)),
+            key=len,
+        )
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+        return [self.vocabulario[i] for i in candidatos if fragmento in self.vocabulario[i]]
+
+    def _filas_fragmento(self, fragmento):
+        tokens = self._tokens_con(fragmento)
+        if not tokens:
+            return np.empty(0, dtype=np.int32)
+        if len(tokens) == 1:
+            return self.postings[tokens[0]]
+        return np.unique(np.concatenate([self.postings[t] for t in tokens]))
+
+    def buscar(self, criterio):
+        """Devuelve las filas (ordenadas) cuyo texto contiene `criterio`, sin distinguir mayúsculas ni acentos."""
+        consulta = normalizar_texto(criterio)
+        fragmentos = _PATRON_TOKEN.findall(consulta)
+        if not fragmentos:
+            # Consulta sin letras ni números: recorrido completo como respaldo.
+            return np.array([i for i, t in enumerate(self.textos) if consulta in t], dtype=np.int32)
+
+        candidatos = None
+        for fragmento in sorted(set(fragmentos), key=len, reverse=True):
+            filas = self._filas_fragmento(fragmento)
+            candidatos = filas if candidatos is None else np.intersect1d(candidatos, filas, assume_unique=True)
+            if len(candidatos) == 0:
+                return candidatos
+
+        if fragmentos == [consulta]:
+            return candidatos
+        # Varias palabras o signos: se verifica la subcadena completa solo sobre los candidatos.
+        return np.array([i for i in candidatos if consulta in self.textos[i]], dtype=np.int32)
+
+    def actualizado(self, mapa, total, filas, valores):
+        """Índice nuevo tras un cambio del catálogo, sin volver a tokenizar las filas que no cambiaron.
+        
+        `mapa[fila_anterior]` es la posición nueva de cada fila conservada (-1 si se borró o cambió) y
+        `filas`/`valores` son las filas nuevas o modificadas (posiciones nuevas) con su texto.
+        """
+        nuevo = IndiceTexto.__new__(IndiceTexto)
+        conservadas = np.flatnonzero(mapa >= 0)
+        textos = np.full(total, '', dtype=object)
+        textos[mapa[conservadas]] = np.array(list(self.textos), dtype=object)[conservadas]
+
+        agregados = {}
+        for fila, valor in zip(filas, valores):
+            texto = '' if pd.isna(valor) else normalizar_texto(valor)
+            textos[fila] = texto
+            for token in set(_PATRON_TOKEN.findall(texto)):
+                agregados.setdefault(token, []).append(fila)
+        nuevo.textos = textos.tolist()
+
+        # Si ninguna fila cambió de posición solo hay que tocar los tokens de las filas quitadas.
+        desplazadas = not np.array_equal(mapa[conservadas], conservadas)
+        if desplazadas:
+            afectados = self.postings.keys()
+        else:
+            quitadas = np.flatnonzero(mapa < 0).tolist()
+            afectados = {token for fila in quitadas for token in _PATRON_TOKEN.findall(self.textos[fila])}
+        postings = dict(self.postings)
+        for token in afectados:
+            posiciones = mapa[self.postings[token]]
+            posiciones = posiciones[posiciones >= 0]
+            if len(posiciones):
+                postings[token] = posiciones
+            else:
+                del postings[token]
+        for token, filas_token in agregados.items():
+            anteriores = postings.get(token, np.empty(0, dtype=np.int32))
+            postings[token] = np.union1d(anteriores, np.array(filas_token, dtype=np.int32)).astype(np.int32)
+
+        nuevo.postings = postings
+        if desplazadas or agregados or len(postings) != len(self.postings):
+            nuevo.vocabulario = sorted(postings)
+        else: # Mismo vocabulario: también sirve su índice de n-gramas
+            nuevo.vocabulario = self.vocabulario
+            nuevo._gramas = getattr(self, "_gramas", None)
+        return nuevo
+
+    def guardar(self, directorio, nombre):
+        """Escribe el índice en `directorio`: las filas de todos los tokens en un solo array y los textos en Arrow."""
+        _guardar_filas(directorio, nombre, [self.postings[token] for token in self.vocabulario])
+        _escribir_textos(os.path.join(directorio, f"{nombre}_vocabulario.arrow"), self.vocabulario)
+        _escribir_textos(os.path.join(directorio, f"{nombre}_textos.arrow"), self.textos)
+        gramas = self._indice_gramas()
+        _guardar_filas(directorio, f"{nombre}_gramas", list(gramas.values()))
+        _escribir_textos(os.path.join(directorio, f"{nombre}_gramas.arrow"), gramas.keys())
+
+    @classmethod
+    def abrir(cls, directorio, nombre):
+        """Índice escrito con `guardar`, con las filas y los textos mapeados en memoria (sin copiarlos)."""
+        indice = cls.__new__(cls)
+        indice.vocabulario = _leer_textos(os.path.join(directorio, f"{nombre}_vocabulario.arrow")).to_pylist()
+        indice.textos = _TextosMapeados(_leer_textos(os.path.join(directorio, f"{nombre}_textos.arrow")))
+        indice.postings = dict(zip(indice.vocabulario, _abrir_filas(directorio, nombre)))
+        gramas = _leer_textos(os.path.join(directorio, f"{nombre}_gramas.arrow")).to_pylist()
+        indice._gramas = dict(zip(gramas, _abrir_filas(directorio, f"{nombre}_gramas")))
+        return indice
+
+class IndiceCompuesto:
+    """Reúne los índices de varias familias desplazando sus filas al rango de ids de la vista."""
+    def __init__(self, indices, desplazamientos):
+        self.indices = indices
+        self.desplazamientos = desplazamientos
+
+    def buscar(self, criterio):
+        return np.concatenate([
+            indice.buscar(criterio) + desplazamiento
+            for indice, desplazamiento in zip(self.indices, self.desplazamientos)
+        ]).astype(np.int32)
+
+# Operadores de las consultas de varias personas (en mayúsculas para no confundirlos con nombres).
+OPERADORES_PERSONAS = {"AND": "Y", "Y": "Y", "OR": "O", "O": "O", "NOT": "NO", "NO": "NO"}
+
+def _nombre_persona(valor):
+    return ' '.join(normalizar_texto(valor).split())
+
+def analizar_consulta_personas(expresion):
+    """Convierte una expresión como `José Velasco AND Ana Coner NOT Juan` en un árbol de tuplas.
+    
+    Operadores: AND/Y, OR/O y NOT/NO (en mayúsculas); las palabras entre operadores forman un nombre.
+    NOT sin operador delante equivale a AND NOT. Prioridad: NOT, luego AND, luego OR. El árbol usa
+    los nombres normalizados, así que también sirve de clave de caché. Lanza ValueError si no es válida.
+    """
+    piezas, palabras = [], []
+    for palabra in expresion.split():
+        operador = OPERADORES_PERSONAS.get(palabra)
+        if operador is None:
+            palabras.append(palabra)
+            continue
+        if palabras:
+            piezas.append(("NOMBRE", _nombre_persona(' '.join(palabras))))
+            palabras = []
+        piezas.append(("OP", operador))
+    if palabras:
+        piezas.append(("NOMBRE", _nombre_persona(' '.join(palabras))))
+
+    posicion = 0
+    def siguiente_es(operador):
+        return posicion < len(piezas) and piezas[posicion] == ("OP", operador)
+
+    def disyuncion():
+        nonlocal posicion
+        nodo = conjuncion()
+        while siguiente_es("O"):
+            posicion += 1
+            nodo = ("O", nodo, conjuncion())
+        return nodo
+
+    def conjuncion():
+        nonlocal posicion
+        nodo = factor()
+        while siguiente_es("Y") or siguiente_es("NO"):
+            if siguiente_es("Y"):
+                posicion += 1
+            nodo = ("Y", nodo, factor())
+        return nodo
+
+    def factor():
+        nonlocal posicion
+        if siguiente_es("NO"):
+            posicion += 1
+            return ("NO", factor())
+        if posicion < len(piezas) and piezas[posicion][0] == "NOMBRE":
+            posicion += 1
+            return piezas[posicion - 1]
+        raise ValueError("Falta un nombre en la consulta (p. ej. «José AND Ana NOT Juan»).")
+
+    arbol = disyuncion()
+    if posicion != len(piezas):
+        raise ValueError("La consulta tiene operadores seguidos o mal colocados.")
+    return arbol
+
+class IndicePersonas:
+    """Filas de cada persona de las columnas PERSONAJE* (ids ordenados) para consultas booleanas.
+    
+    Un nombre de la consulta se resuelve con las personas cuyo nombre lo contiene (como el modo P),
+    y AND/OR/NOT se responden intersecando, uniendo o restando esos conjuntos ordenados.
+    """
+    def __init__(self, filas_por_persona, total):
+        self.filas = filas_por_persona
+        self.nombres = sorted(filas_por_persona)
+        self.total = total
+
+    @classmethod
+    def desde_catalogo(cls, df):
+        partes = {}
+        for col in [col for col in df.columns if "PERSONAJE" in col]:
+            serie = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+            codigos = serie.cat.codes.to_numpy()
+            orden = np.argsort(codigos, kind='stable')
+            cortes = np.searchsorted(codigos[orden], np.arange(len(serie.cat.categories) + 1))
+            for codigo, valor in enumerate(serie.cat.categories):
+                nombre = _nombre_persona(valor)
+                if nombre:
+                    partes.setdefault(nombre, []).append(orden[cortes[codigo]:cortes[codigo + 1]])
+        filas = {nombre: _solo_lectura(np.unique(np.concatenate(trozos)).astype(np.int32)) for nombre, trozos in partes.items()}
+        return cls(filas, len(df))
+
+    @classmethod
+    def combinar(cls, indices, desplazamientos):
+        """Índice de una vista global: las filas de cada familia desplazadas a su tramo de ids."""
+        partes = {}
+        for indice, desplazamiento in zip(indices, desplazamientos):
+            for nombre, filas in indice.filas.items():
+                partes.setdefault(nombre, []).append(filas + desplazamiento)
+        filas = {nombre: _solo_lectura(np.concatenate(trozos).astype(np.int32)) for nombre, trozos in partes.items()}
+        return cls(filas, int(desplazamientos[-1]) + indices[-1].total if indices else 0)
+
+    def guardar(self, directorio, nombre):
+        _guardar_filas(directorio, nombre, [self.filas[persona] for persona in self.nombres])
+        _escribir_textos(os.path.join(directorio, f"{nombre}_nombres.arrow"), self.nombres)
+
+    @classmethod
+    def abrir(cls, directorio, nombre, total):
+        """Índice escrito con `guardar`, con las filas de cada persona mapeadas en memoria."""
+        nombres = _leer_textos(os.path.join(directorio, f"{nombre}_nombres.arrow")).to_pylist()
+        return cls(dict(zip(nombres, _abrir_filas(directorio, nombre))), total)
+
+    def filas_nombre(self, nombre):
+        personas = [self.filas[persona] for persona in self.nombres if nombre in persona]
+        if not personas:
+            return np.empty(0, dtype=np.int32)
+        if len(personas) == 1:
+            return personas[0]
+        return np.unique(np.concatenate(personas))
+
+    def _evaluar(self, nodo):
+        """Devuelve (negado, filas): con negado=True el resultado es el complemento de `filas`."""
+        if nodo[0] == "NOMBRE":
+            return False, self.filas_nombre(nodo[1])
+        if nodo[0] == "NO":
+            negado, filas = self._evaluar(nodo[1])
+            return not negado, filas
+        (neg_a, a), (neg_b, b) = self._evaluar(nodo[1]), self._evaluar(nodo[2])
+        if nodo[0] == "Y":
+            if neg_a and neg_b:
+                return True, np.union1d(a, b)
+            if neg_a or neg_b:
+                positivo, negativo = (b, a) if neg_a else (a, b)
+                return False, np.setdiff1d(positivo, negativo, assume_unique=True)
+            return False, np.intersect1d(a, b, assume_unique=True)
+        # "O"
+        if neg_a and neg_b:
+            return True, np.intersect1d(a, b, assume_unique=True)
+        if neg_a or neg_b:
+            positivo, negativo = (b, a) if neg_a else (a, b)
+            return True, np.setdiff1d(negativo, positivo, assume_unique=True)
+        return False, np.union1d(a, b)
+
+    def buscar(self, arbol):
+        """Filas (ordenadas) que cumplen el árbol de `analizar_consulta_personas`."""
+        negado, filas = self._evaluar(arbol)
+        if negado:
+            filas = np.setdiff1d(np.arange(self.total, dtype=np.int32), filas, assume_unique=True)
+        return np.asarray(filas, dtype=np.int32)
+
+def _textos_busqueda(df):
+    """Textos indexables de cada fila: DESCRIPCION y las columnas PERSONAJE* (un valor por línea)."""
+    descripciones = df["DESCRIPCION"].tolist() if "DESCRIPCION" in df.columns else [None] * len(df)
+    columnas_personaje = [col for col in df.columns if "PERSONAJE" in col]
+    if columnas_personaje:
+        # Un valor por línea para que ninguna coincidencia cruce de una columna PERSONAJE a otra.
+        personajes = [
+            '\n'.join(str(v) for v in fila if pd.notna(v))
+            for fila in df[columnas_personaje].itertuples(index=False, name=None)
+        ]
+    else:
+        personajes = [None] * len(df)
+    return descripciones, personajes
+
+def _anios_numericos(df):
+    anio_serie = df["AÑO"] if "AÑO" in df.columns else pd.Series(None, index=df.index, dtype=object)
+    return pd.to_numeric(anio_serie.astype(str).str.strip(), errors='coerce').to_numpy(dtype=float)
+
+def _indices_anio(anio_num):
+    """Índice de años: columna numérica y permutación ordenada por año (sin año al final)."""
+    orden_anio = np.argsort(anio_num, kind='stable')
+    rango_anio = np.empty(len(orden_anio), dtype=np.int64)
+    rango_anio[orden_anio] = np.arange(len(orden_anio))
+    return {
+        "ANIO_NUM": anio_num,
+        "ANIOS_ORDENADOS": anio_num[orden_anio],
+        "RANGO_ANIO": rango_anio,
+        "N_CON_ANIO": int(np.count_nonzero(~np.isnan(anio_num))),
+    }
+
+def construir_indices(df):
+    """Construye una vez los índices del catálogo: 'D' sobre DESCRIPCION, 'P' sobre las columnas PERSONAJE* y los de AÑO."""
+    descripciones, personajes = _textos_busqueda(df)
+    return {
+        "D": IndiceTexto(descripciones),
+        "P": IndiceTexto(personajes),
+        "PERSONAS": IndicePersonas.desde_catalogo(df),
+        **_indices_anio(_anios_numericos(df)),
+    }
+
+def actualizar_indices(indices, df, mapa, filas):
+    """Índices del catálogo nuevo `df` a partir de los del anterior, procesando solo las `filas` nuevas o modificadas."""
+    cambiadas = df.iloc[filas]
+    descripciones, personajes = _textos_busqueda(cambiadas)
+    conservadas = np.flatnonzero(mapa >= 0)
+    anio_num = np.empty(len(df), dtype=float)
+    anio_num[mapa[conservadas]] = indices["ANIO_NUM"][conservadas]
+    anio_num[filas] = _anios_numericos(cambiadas)
+    return {
+        "D": indices["D"].actualizado(mapa, len(df), filas, descripciones),
+        "P": indices["P"].actualizado(mapa, len(df), filas, personajes),
+        "PERSONAS": IndicePersonas.desde_catalogo(df), # Vectorizado sobre las categorías: no retokeniza filas
+        **_indices_anio(anio_num),
+    }
+
+
+# --- 3.2. CATÁLOGO COMPARTIDO Y VISTAS DE CONSULTA ---
+# Los catálogos, índices y órdenes son únicos por proceso y de solo lectura: cada sesión guarda
+# únicamente los ids de fila de sus resultados (int32) y el índice de la foto actual.
+
+def _solo_lectura(arr):
+    arr.flags.writeable = False
+    return arr
+
+def generacion_familia(key, _fs):
+    """Generación del catálogo de una familia: la de su Excel y, si existe, la de la tabla de metadatos."""
+    generacion = obtener_generacion_objeto(consultas_individuales[key]["ruta_excel"], _fs)
+    generacion_metadatos = obtener_generacion_objeto(RUTA_METADATOS, _fs)
+    if generacion is None or generacion_metadatos is None:
+        return generacion
+    return f"{generacion}+{generacion_metadatos}"
+
+def generaciones_consulta(opcion, _fs):
+    """Tupla (familia, generación de su catálogo) de las familias que forman una consulta."""
+    if opcion in consultas_individuales:
+        claves = [opcion]
+    else:
+        claves = consultas_globales[opcion]["orden_carga"]
+    return tuple((key, generacion_familia(key, _fs)) for key in claves)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _metadatos_por_generacion(generacion, _fs):
+    tabla = pd.read_parquet(io.BytesIO(_leer_objeto(_fs, f"{BUCKET_NAME}/{RUTA_METADATOS}")))
+    return {
+        carpeta: grupo.drop(columns=["CARPETA", "VERSION"]).drop_duplicates("NOMBRE_FOTO").set_index("NOMBRE_FOTO")
+        for carpeta, grupo in tabla.groupby("CARPETA")
+    }
 
-        df_original = _cache[excel_name_key]
-        if df_original.empty: continue
+def obtener_metadatos(_fs):
+    """Metadatos de las fotos por carpeta (carpeta -> tabla indexada por NOMBRE_FOTO); vacío si aún no se indexaron.
+    
+    Si la tabla no se puede leer también se devuelve vacío, sin guardarlo en caché: se reintenta en la próxima carga.
+    """
+    generacion = obtener_generacion_objeto(RUTA_METADATOS, _fs)
+    if generacion is None:
+        return {}
+    try:
+        return _metadatos_por_generacion(generacion, _fs)
+    except Exception:
+        return {}
+
+def unir_metadatos(df, metadatos):
+    """Une al catálogo ANCHO, ALTO, ORIENTACION y FECHA_CAPTURA de sus fotos.
+    
+    Las filas con AÑO vacío o no numérico toman el año de captura del EXIF; AÑO_EXIF las marca.
+    """
+    if metadatos is None or metadatos.empty:
+        return df
+    unidas = metadatos.reindex(df['NOMBRE_FOTO'])
+    for col in ("ANCHO", "ALTO", "ORIENTACION", "FECHA_CAPTURA"):
+        df[col] = unidas[col].array
+    anio_captura = unidas["ANIO_CAPTURA"].astype("Float64").to_numpy(dtype=float, na_value=np.nan)
+    sin_anio = np.isnan(_anios_numericos(df)) & ~np.isnan(anio_captura)
+    if sin_anio.any():
+        if df['AÑO'].dtype == float:
+            df.loc[sin_anio, 'AÑO'] = anio_captura[sin_anio]
+        else: # AÑO con texto: el año del EXIF se guarda también como texto
+            df.loc[sin_anio, 'AÑO'] = [str(int(a)) for a in anio_captura[sin_anio]]
+    df['AÑO_EXIF'] = sin_anio
+    return df
+
+@st.cache_resource(show_spinner=False)
+def _catalogos_construidos():
+    """Registro del proceso: familia -> último catálogo construido en memoria (base de los cambios incrementales)."""
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def _vistas_globales_construidas():
+    """Registro del proceso: orden de carga -> última vista global construida."""
+    return {}
+
+MAX_PROPORCION_CAMBIOS = 0.5 # Con más filas cambiadas que esta proporción se reconstruye el catálogo entero
+
+def _huellas_filas(df):
+    """Hash de cada fila (todas sus columnas del Excel) para detectar filas modificadas."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def _cambios_catalogo(anterior, df, huellas):
+    """Compara fila a fila el catálogo anterior de una familia con su nuevo Excel.
+    
+    Cada fila se identifica por (carpeta, NOMBRE); la carpeta es la de la familia, así que basta con
+    NOMBRE y, si se repite, su número de aparición. Devuelve `(mapa, filas)`: la posición nueva de
+    cada fila anterior que sigue igual (-1 si se borró o cambió) y las posiciones nuevas de las filas
+    insertadas o modificadas. Devuelve None si conviene reconstruir todo (otras columnas, filas
+    reordenadas o demasiados cambios).
+    """
+    previo = anterior["df"]
+    if list(previo.columns) != list(df.columns):
+        return None
+    def claves(tabla, huellas_tabla):
+        return pd.DataFrame({
+            "NOMBRE": tabla["NOMBRE_FOTO"].to_numpy(),
+            "APARICION": tabla.groupby("NOMBRE_FOTO", sort=False).cumcount().to_numpy(),
+            "HUELLA": huellas_tabla,
+            "POSICION": np.arange(len(tabla)),
+        })
+    cruce = claves(previo, anterior["huellas"]).merge(
+        claves(df, huellas), on=["NOMBRE", "APARICION", "HUELLA"], suffixes=("_ANTERIOR", "_NUEVA")
+    )
+    mapa = np.full(len(previo), -1, dtype=np.int32)
+    mapa[cruce["POSICION_ANTERIOR"].to_numpy()] = cruce["POSICION_NUEVA"].to_numpy()
+    conservadas = mapa[mapa >= 0]
+    if np.any(np.diff(conservadas) <= 0):
+        return None # Filas reordenadas: los ids de las vistas anteriores ya no se pueden trasladar.
+    nuevas = np.ones(len(df), dtype=bool)
+    nuevas[conservadas] = False
+    filas = np.flatnonzero(nuevas)
+    if len(filas) + (len(previo) - len(conservadas)) > MAX_PROPORCION_CAMBIOS * max(len(df), 1):
+        return None
+    return mapa, filas
+
+def _clave_preorden(anio_num, nombres):
+    """Clave de orden (sin año al final, año, nombre, posición) de una fila del catálogo."""
+    sin_anio = np.isnan(anio_num)
+    anio = np.nan_to_num(anio_num, nan=0.0)
+    return lambda fila: (bool(sin_anio[fila]), float(anio[fila]), nombres[fila], int(fila))
+
+def _preordenar(anio_num, nombres):
+    claves = pd.DataFrame({'SIN_ANIO': np.isnan(anio_num), 'ANIO': anio_num, 'NOMBRE': nombres})
+    return claves.sort_values(by=['SIN_ANIO', 'ANIO', 'NOMBRE'], kind='mergesort').index.to_numpy()
+
+def _insertar_ordenadas(conservadas, nuevas, clave):
+    """Inserta `nuevas` en la secuencia ya ordenada `conservadas` buscando su sitio por bisección."""
+    nuevas = sorted(nuevas, key=clave)
+    posiciones = [bisect.bisect_left(conservadas, clave(fila), key=clave) for fila in nuevas]
+    return np.insert(conservadas, posiciones, nuevas)
+
+@cache_medida("catalogo", st.cache_resource(max_entries=8, show_spinner=False))
+def obtener_catalogo_familia(key, generacion, _fs, _datos=None):
+    """Catálogo compartido de una familia para una generación de su Excel, con tipos compactos e índices.
+    
+    Si ya hay en memoria un catálogo anterior de la familia, solo se procesan las filas insertadas,
+    modificadas o borradas; `delta` guarda ese cambio para trasladarlo también a las vistas globales.
+    Si otro proceso ya lo construyó, se usa el de su snapshot compartido en disco (ver sección 3.4).
+    Si el Excel no se puede cargar se lanza la excepción (Streamlit no guarda en caché los fallos).
+    """
+    if generacion is None:
+        return _construir_catalogo_familia(key, generacion, _fs, _datos)
+    catalogo = obtener_compartido(
+        _directorio_familia(key), generacion,
+        abrir=_abrir_catalogo,
+        construir=lambda: _construir_catalogo_familia(key, generacion, _fs, _datos),
+        guardar=_guardar_catalogo,
+    )
+    if catalogo is not None:
+        _catalogos_construidos()[key] = catalogo
+    return catalogo
+
+def _construir_catalogo_familia(key, generacion, _fs, _datos=None):
+    config = consultas_individuales[key]
+    df = cargar_excel(config["ruta_excel"], _fs, _datos)
+    if df.empty:
+        raise ValueError("no tiene ninguna fila con datos")
+
+    # Rutas de carpeta y PERSONAJE* como categorías: cada valor distinto se guarda una sola vez.
+    df['_FOLDER_PATH'] = pd.Categorical([GCS_BASE_PATH.rstrip('/') + '/' + config["carpeta_fotos"].lstrip('/')] * len(df))
+    df['NOMBRE_FOTO'] = df['NOMBRE'].astype(str).str.strip()
+    df = unir_metadatos(df, obtener_metadatos(_fs).get(config["carpeta_fotos"]))
+    huellas = _huellas_filas(df.drop(columns=['_FOLDER_PATH']))
+    for col in df.columns:
+        if "PERSONAJE" in col:
+            df[col] = df[col].astype('category')
+    nombres = df['NOMBRE_FOTO'].to_numpy()
+
+    anterior = _catalogos_construidos().get(key)
+    cambios = _cambios_catalogo(anterior, df, huellas) if anterior is not None else None
+    if cambios is None:
+        indices = construir_indices(df)
+        # Preorden por (año, nombre), sin año al final: lo reutilizan todas las consultas globales.
+        preorden = _preordenar(indices["ANIO_NUM"], nombres)
+        delta = None
+    else:
+        mapa, filas = cambios
+        indices = actualizar_indices(anterior["indices"], df, mapa, filas)
+        # Las filas conservadas mantienen su orden relativo: solo se colocan las nuevas.
+        conservadas = mapa[anterior["preorden"]]
+        preorden = _insertar_ordenadas(conservadas[conservadas >= 0], filas, _clave_preorden(indices["ANIO_NUM"], nombres))
+        delta = {"desde": anterior["generacion"], "mapa": _solo_lectura(mapa), "filas": _solo_lectura(filas)}
+
+    catalogo = {
+        "clave": key,
+        "generacion": generacion,
+        "df": df,
+        "indices": indices,
+        "preorden": _solo_lectura(preorden.astype(np.int32)),
+        "huellas": _solo_lectura(huellas),
+        "delta": delta,
+    }
+    _catalogos_construidos()[key] = catalogo
+    return catalogo
+
+def _precargar_en_segundo_plano():
+    try:
+        fs = init_gcs_fs()
+        if fs:
+            precargar_catalogos(fs, [(key, generacion_familia(key, fs)) for key in consultas_individuales])
+    except Exception:
+        pass # Solo es una optimización: cada consulta vuelve a cargar (y a informar errores) bajo demanda.
+
+@st.cache_resource(show_spinner=False)
+def iniciar_precarga_en_segundo_plano():
+    """Arranca, una sola vez por proceso, un hilo que calienta los catálogos de todas las familias.
+    
+    El hilo no lleva el contexto de ninguna sesión (las cachés que usa son globales) ni pinta nada en la página;
+    si un Excel falla, su catálogo no queda en caché y la consulta que lo pida lo vuelve a intentar.
+    """
+    hilo = threading.Thread(target=_precargar_en_segundo_plano, name="precarga-catalogos", daemon=True)
+    hilo.start()
+    return hilo
+
+def precargar_catalogos(_fs, generaciones):
+    """Construye los catálogos de varias familias [(clave, generación)] descargando a la vez los Excel que haya que procesar.
+    
+    Solo se descargan los Excel sin catálogo en memoria ni snapshot (local o compartido) para esa generación,
+    y cada uno se procesa en cuanto llega, sin esperar a los demás. Los errores se ignoran: la consulta
+    lo vuelve a intentar y los muestra (ver `obtener_vista`).
+    """
+    generaciones = dict(generaciones)
+
+    def cargar(key, datos=None):
+        try:
+            obtener_catalogo_familia(key, generaciones[key], _fs, datos)
+        except Exception:
+            pass
+
+    construidos = _catalogos_construidos()
+    pendientes = {}
+    for key in generaciones:
+        ruta_excel = consultas_individuales[key]["ruta_excel"]
+        generacion = generaciones[key]
+        generacion_excel = obtener_generacion_objeto(ruta_excel, _fs)
+        if generacion is not None and (
+            construidos.get(key, {}).get("generacion") == generacion
+            or os.path.exists(_ruta_snapshot(ruta_excel, generacion_excel))
+            or existe_compartido(_directorio_familia(key), generacion)
+        ):
+            cargar(key)
+        else:
+            pendientes[f"{BUCKET_NAME}/{ruta_excel}"] = key
+
+    for ruta, datos in descargar_objetos(_fs, list(pendientes)):
+        # Si la descarga falló, obtener_catalogo_familia lo vuelve a intentar por su cuenta.
+        cargar(pendientes[ruta], None if isinstance(datos, Exception) else datos)
+
+def _vista_unificada(familias, desplazamientos, anio_num, orden):
+    total = len(anio_num)
+    rango = np.empty(total, dtype=np.int32)
+    rango[orden] = np.arange(total, dtype=np.int32)
+    # La mezcla ya está ordenada por año: sirve también de índice de años de la vista.
+    indices = {
+        "D": IndiceCompuesto([f["indices"]["D"] for f in familias], desplazamientos),
+        "P": IndiceCompuesto([f["indices"]["P"] for f in familias], desplazamientos),
+        "PERSONAS": IndicePersonas.combinar([f["indices"]["PERSONAS"] for f in familias], desplazamientos),
+        "ANIO_NUM": _solo_lectura(anio_num),
+        "ANIOS_ORDENADOS": _solo_lectura(anio_num[orden]),
+        "RANGO_ANIO": rango,
+        "N_CON_ANIO": int(np.count_nonzero(~np.isnan(anio_num))),
+    }
+    return {
+        "familias": familias,
+        "desplazamientos": _solo_lectura(desplazamientos),
+        "indices": indices,
+        "orden": _solo_lectura(orden),
+        "rango": _solo_lectura(rango),
+        "total": total,
+    }
 
-        temp_df = df_original.copy()
-        temp_df['_FOLDER_PATH'] = GCS_BASE_PATH.rstrip('/') + '/' + config["carpeta_fotos"].lstrip('/')
-        temp_df['_ORDER_INDEX'] = family_order_map[key]
-        temp_df['AÑO_NUM'] = pd.to_numeric(temp_df['AÑO'], errors='coerce')
-        temp_df['NOMBRE_FOTO'] = temp_df['NOMBRE'].astype(str).str.strip()
-        df_list.append(temp_df)
+def _mezcla_incremental(anterior, familias, desplazamientos, anio_num):
+    """Orden de la vista global trasladando el de la vista anterior con los `delta` de las familias que cambiaron.
+    
+    Devuelve None si alguna familia no se puede trasladar (p. ej. su catálogo se reconstruyó entero).
+    """
+    previas = anterior["familias"]
+    if [f["clave"] for f in previas] != [f["clave"] for f in familias]:
+        return None
+    mapas, insertadas = [], []
+    for previa, familia, desplazamiento in zip(previas, familias, desplazamientos):
+        if familia["generacion"] is None or previa["generacion"] is None:
+            return None
+        if familia["generacion"] == previa["generacion"]:
+            mapas.append(np.arange(len(familia["df"])) + desplazamiento)
+        elif familia["delta"] is not None and familia["delta"]["desde"] == previa["generacion"]:
+            mapa = familia["delta"]["mapa"]
+            mapas.append(np.where(mapa >= 0, mapa + desplazamiento, -1))
+            insertadas.append(familia["delta"]["filas"] + desplazamiento)
+        else:
+            return None
+
+    conservadas = np.concatenate(mapas)[anterior["orden"]]
+    conservadas = conservadas[conservadas >= 0]
+    # Desempate dentro de una familia: la posición de la fila en su preorden.
+    posicion_preorden = np.empty(len(anio_num), dtype=np.int64)
+    for f, d in zip(familias, desplazamientos):
+        posicion_preorden[f["preorden"] + d] = np.arange(len(f["preorden"])) + d
+    sin_anio = np.isnan(anio_num)
+    anio = np.nan_to_num(anio_num, nan=0.0)
+    clave = lambda fila: (bool(sin_anio[fila]), float(anio[fila]), int(posicion_preorden[fila]))
+    nuevas = np.concatenate(insertadas) if insertadas else np.empty(0, dtype=np.int64)
+    return _insertar_ordenadas(conservadas, nuevas, clave).astype(np.int32)
+
+@cache_medida("vista_global", st.cache_resource(max_entries=8, show_spinner=False))
+def cargar_y_unificar_por_orden(orden_claves, generaciones, _fs, generacion_huellas=None):
+    """Implementa la lógica de Tkinter para unificar y ordenar los catálogos por (año, familia, nombre).
+    
+    En lugar de concatenar y ordenar, mezcla (k-way) las familias ya preordenadas; el orden de carga
+    solo desempata entre familias con el mismo año. Las filas de la vista se numeran por tramos
+    (familia tras familia, en el orden de carga) y `orden` es la secuencia resultante de esos ids.
+    Si solo cambiaron algunas filas desde la vista anterior, se traslada su orden en vez de mezclar de nuevo.
+    Con `generacion_huellas` (la de la tabla de hashes perceptuales) cada grupo de fotos duplicadas queda
+    en una sola entrada (ver `agrupar_duplicados`). Si alguna familia no se puede cargar se lanza la excepción.
+    """
+    if generacion_huellas is not None:
+        vista = cargar_y_unificar_por_orden(orden_claves, generaciones, _fs)
+        return agrupar_duplicados(vista, _huellas_por_generacion(generacion_huellas, _fs))
+
+    generacion_de = dict(generaciones)
+    familias = [obtener_catalogo_familia(key, generacion_de.get(key), _fs) for key in orden_claves]
+
+    tamanos = [len(f["df"]) for f in familias]
+    desplazamientos = np.concatenate([[0], np.cumsum(tamanos)[:-1]]).astype(np.int32)
+    anio_num = np.concatenate([f["indices"]["ANIO_NUM"] for f in familias])
+
+    def mezclar():
+        anterior = _vistas_globales_construidas().get(tuple(orden_claves))
+        orden = _mezcla_incremental(anterior, familias, desplazamientos, anio_num) if anterior is not None else None
+        if orden is None:
+            sin_anio = np.isnan(anio_num).tolist()
+            anio = np.nan_to_num(anio_num, nan=0.0).tolist()
+            posicion_familia = np.repeat(np.arange(len(familias)), tamanos).tolist()
+            mezcla = heapq.merge(
+                *((f["preorden"] + d).tolist() for f, d in zip(familias, desplazamientos)),
+                key=lambda fila: (sin_anio[fila], anio[fila], posicion_familia[fila])
+            )
+            orden = np.fromiter(mezcla, dtype=np.int32, count=sum(tamanos))
+        return orden
+
+    generaciones_familias = [(f["clave"], f["generacion"]) for f in familias]
+    if any(generacion is None for _, generacion in generaciones_familias):
+        orden = mezclar()
+    else:
+        # El orden solo depende de las generaciones de las familias: lo calcula un proceso y los demás lo mapean.
+        orden = obtener_compartido(
+            _directorio_vista(orden_claves), repr(generaciones_familias),
+            abrir=lambda ruta: _abrir_array(ruta, "orden"),
+            construir=mezclar,
+            guardar=lambda orden, ruta: np.save(os.path.join(ruta, "orden.npy"), orden),
+        )
+
+    vista = _vista_unificada(familias, desplazamientos, anio_num, orden)
+    _vistas_globales_construidas()[tuple(orden_claves)] = vista
+    return vista
+
+def _catalogo_o_error(key, generacion, _fs):
+    """Catálogo de la familia, o None mostrando en la página por qué no se pudo cargar su Excel."""
+    try:
+        return obtener_catalogo_familia(key, generacion, _fs)
+    except Exception as e:
+        mostrar_error_excel(consultas_individuales[key]["ruta_excel"], e)
+        return None
 
-    if not df_list:
+def obtener_vista(opcion, generaciones, _fs, agrupar=False):
+    """Vista de solo lectura de una consulta (individual o global) para las generaciones dadas.
+    
+    Una consulta global une solo las familias de `generaciones`; si el Excel de alguna no se puede cargar,
+    se muestra el error y se sigue con las demás (None si no se cargó ninguna).
+    Con `agrupar`, una consulta global muestra una sola vez las fotos duplicadas en varias carpetas
+    (si ya se calcularon sus hashes); los ids de fila son los mismos con o sin agrupar.
+    """
+    generacion_de = dict(generaciones)
+    if opcion in consultas_individuales:
+        catalogo = _catalogo_o_error(opcion, generacion_de.get(opcion), _fs)
+        if catalogo is None:
+            return None
+        return {
+            "familias": [catalogo],
+            "desplazamientos": np.zeros(1, dtype=np.int32),
+            "indices": catalogo["indices"],
+            "orden": None, # Consulta individual: el orden es el del Excel.
+            "rango": None,
+            "total": len(catalogo["df"]),
+        }
+    orden_carga = [key for key in consultas_globales[opcion]["orden_carga"] if key in generacion_de]
+    cargadas = tuple(key for key in orden_carga if _catalogo_o_error(key, generacion_de[key], _fs) is not None)
+    if not cargadas:
         st.error("No se pudo cargar ningún archivo de Excel para la consulta global.")
         return None
+    generacion_huellas = obtener_generacion_objeto(RUTA_HUELLAS, _fs) if agrupar else None
+    if generacion_huellas is not None:
+        try:
+            return cargar_y_unificar_por_orden(cargadas, generaciones, _fs, generacion_huellas)
+        except Exception as e:
+            st.warning(f"No se pudo leer la tabla de fotos duplicadas; se muestran todas las fotos: {e}")
+    return cargar_y_unificar_por_orden(cargadas, generaciones, _fs)
+
+def obtener_fila(vista, fila):
+    """Devuelve (fila del DataFrame, clave de la familia) para un id de fila de la vista."""
+    i = int(np.searchsorted(vista["desplazamientos"], fila, side='right')) - 1
+    familia = vista["familias"][i]
+    return familia["df"].iloc[int(fila) - int(vista["desplazamientos"][i])], familia["clave"]
 
-    combined_df = pd.concat(df_list, ignore_index=True)
+
+# --- 3.3. LISTADO DE CARPETAS: FOTOS FALTANTES Y ARCHIVOS HUÉRFANOS ---
+# Una sola consulta de listado por carpeta de fotos (en lugar de un HEAD por foto) basta para saber
+# qué filas del catálogo no tienen archivo y qué archivos no aparecen en ningún Excel.
+
+@cache_medida("listado", st.cache_resource(ttl=LISTADO_TTL, show_spinner=False))
+def listar_carpeta(carpeta, _fs):
+    """Archivos de una carpeta de fotos, con un único listado (gcsfs recorre las páginas por dentro).
     
-    combined_df = combined_df.sort_values(
-        by=['AÑO_NUM', '_ORDER_INDEX', 'NOMBRE_FOTO'],
-        ascending=[True, True, True],
-        na_position='last'
-    )
+    Devuelve {"archivos": frozenset de nombres, "generacion": huella del listado}. Si el listado falla se
+    lanza la excepción (Streamlit no la guarda en caché: la próxima ejecución vuelve a listar).
+    """
+    prefijo = f"{BUCKET_NAME}/{carpeta.strip('/')}/"
+    rutas = _fs.find(prefijo)
+    archivos = frozenset(ruta[len(prefijo):] for ruta in rutas if ruta.startswith(prefijo) and len(ruta) > len(prefijo))
+    huella = hashlib.sha1('\n'.join(sorted(archivos)).encode('utf-8')).hexdigest()
+    return {"archivos": archivos, "generacion": huella}
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _revision_por_generacion(opcion, generaciones, generaciones_listado, _fs, _listados):
+    vista = obtener_vista(opcion, generaciones, _fs)
+    presentes, faltantes, huerfanos = [], {}, {}
+    extensiones = set(EXTENSIONES_IMAGEN + EXTENSIONES_VIDEO) # Ni Thumbs.db, ni .DS_Store, ni otros archivos de trabajo
+    for familia, listado in zip(vista["familias"], _listados):
+        nombres = familia["df"]["NOMBRE_FOTO"]
+        existe = nombres.isin(listado["archivos"]).to_numpy()
+        presentes.append(existe)
+        faltantes[familia["clave"]] = nombres[~existe].tolist()
+        huerfanos[familia["clave"]] = sorted(
+            archivo for archivo in listado["archivos"].difference(nombres)
+            if os.path.splitext(archivo)[1].lower() in extensiones
+        )
+    return {
+        "presentes": _solo_lectura(np.concatenate(presentes)),
+        "faltantes": faltantes,
+        "huerfanos": huerfanos,
+        "generacion": generaciones_listado,
+    }
+
+def revision_archivos(opcion, generaciones, _fs):
+    """Cruza la vista de una consulta con el listado de sus carpetas de fotos.
     
-    combined_df = combined_df.drop(columns=['AÑO_NUM', '_ORDER_INDEX']).reset_index(drop=True)
-    return combined_df
+    Devuelve `presentes` (por id de fila de la vista, si su archivo existe), y por familia los nombres
+    de las filas sin archivo (`faltantes`) y las fotos y vídeos que su Excel no menciona (`huerfanos`);
+    `generacion` identifica los listados usados.
+    None si la vista o algún listado no están disponibles.
+    """
+    vista = obtener_vista(opcion, generaciones, _fs)
+    if vista is None:
+        return None
+    try:
+        listados = [listar_carpeta(consultas_individuales[f["clave"]]["carpeta_fotos"], _fs) for f in vista["familias"]]
+    except Exception:
+        return None
+    return _revision_por_generacion(opcion, generaciones, tuple(l["generacion"] for l in listados), _fs, listados)
+
+def presencia_vista(opcion, generaciones, _fs):
+    """Máscara por id de fila de la vista: True si el archivo de la foto existe (None si no se pudo listar).
+    
+    Lista las carpetas de la consulta: solo se usa si la sesión pidió ocultar las fotos faltantes.
+    """
+    revision = revision_archivos(opcion, generaciones, _fs)
+    return None if revision is None else revision["presentes"]
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_derivados_por_generacion(generacion, _fs):
+    with _fs.open(f"{BUCKET_NAME}/{RUTA_INDICE_DERIVADOS}", 'rb') as f:
+        indice = json.load(f)
+    return indice.get("fotos", {}) if indice.get("formato") == FORMATO_DERIVADOS else {}
+
+def obtener_indice_derivados(_fs):
+    """Derivados disponibles por foto ('CARPETA/nombre' -> {"anchos", "original"}).
+    
+    Vacío si aún no se generaron, si el índice es de un formato anterior (hasta que generar_derivados.py lo
+    regenere) o si no se pudo leer (sin guardarlo en caché: se reintenta en la próxima ejecución).
+    """
+    generacion = obtener_generacion_objeto(RUTA_INDICE_DERIVADOS, _fs)
+    if generacion is None:
+        return {}
+    try:
+        return _indice_derivados_por_generacion(generacion, _fs)
+    except Exception:
+        return {}
+
+def url_objeto(ruta):
+    """URL con la que el navegador pide un objeto del Bucket (`ruta` relativa al Bucket).
+    
+    Con el Bucket privado y VISOR_MEDIOS_URL configurada la sirve el servidor de medios (leyendo con
+    credenciales y guardando una copia en disco); si no, o si el servidor no pudo arrancar, es la URL
+    pública de GCS (como en `url_video`).
+    """
+    if BUCKET_PRIVADO and MEDIOS_URL is not None and iniciar_servidor_medios(obtener_fs()) is not None:
+        return f"{MEDIOS_URL}/objeto/{quote(ruta)}"
+    return f"https://storage.googleapis.com/{BUCKET_NAME}/{ruta}"
+
+def _srcset_derivados(carpeta, nombre_archivo, derivado, extension):
+    """srcset con los derivados de la foto y, como candidato más grande, el propio original."""
+    if not derivado or not derivado.get("anchos"):
+        return ""
+    candidatos = [
+        f"{url_objeto(f'{PREFIJO_DERIVADOS}/{ancho}/{carpeta}/{nombre_archivo}.{extension}')} {ancho}w"
+        for ancho in derivado["anchos"]
+    ]
+    candidatos.append(f"{url_objeto(f'{carpeta}/{nombre_archivo}')} {derivado['original']}w")
+    return ", ".join(candidatos)
+
+def _url_miniatura(carpeta, nombre_archivo, derivado):
+    """URL del derivado más pequeño (para la cuadrícula); el original si no hay derivados."""
+    if not derivado or not derivado.get("anchos"):
+        return url_objeto(f"{carpeta}/{nombre_archivo}")
+    return url_objeto(f"{PREFIJO_DERIVADOS}/{min(derivado['anchos'])}/{carpeta}/{nombre_archivo}.webp")
+
+def _texto_celda(valor):
+    """Texto de una celda sin espacios; vacío si falta (NaN/None del Excel o NA de las columnas Arrow)."""
+    return str(valor).strip() if pd.notna(valor) else ""
+
+def _texto_anio(valor):
+    """AÑO de la celda como texto entero ("1985"); vacío si no es numérico."""
+    if pd.notna(valor) and str(valor).strip() != "":
+        try:
+            return str(int(float(str(valor).strip()))).strip()
+        except:
+            pass
+    return ""
+
+def _dimension(valor):
+    return int(valor) if pd.notna(valor) else 0
+
+def datos_foto(row, clave_familia, derivados=None):
+    """Extrae de una fila del catálogo lo que se muestra de la foto: archivo, URL, descripción, año y personajes.
+    
+    Con el índice de `obtener_indice_derivados` añade los `srcset` WebP/JPEG de sus versiones reducidas;
+    las dimensiones y el origen del año salen de los metadatos unidos al catálogo (`unir_metadatos`).
+    """
+    nombre_archivo = str(row["NOMBRE_FOTO"]).strip()
+    descripcion = _texto_celda(row.get("DESCRIPCION"))
+    ruta_carpeta = consultas_individuales[clave_familia]["carpeta_fotos"]
+    
+    personajes = []
+    for col in row.index:
+        if "PERSONAJE" in col:
+            valor = row.get(col)
+            if pd.notna(valor) and str(valor).strip() != "":
+                personajes.append(str(valor).strip())
+                
+    anio_foto = _texto_anio(row.get("AÑO"))
+
+    derivado = (derivados or {}).get(f"{ruta_carpeta}/{nombre_archivo}")
+    ancho, alto = row.get("ANCHO"), row.get("ALTO")
+
+    return {
+        "nombre_archivo": nombre_archivo,
+        "descripcion": descripcion,
+        "url": url_objeto(f"{ruta_carpeta}/{nombre_archivo}"),
+        "srcset_webp": _srcset_derivados(ruta_carpeta, nombre_archivo, derivado, "webp"),
+        "srcset_jpeg": _srcset_derivados(ruta_carpeta, nombre_archivo, derivado, "jpg"),
+        "url_miniatura": _url_miniatura(ruta_carpeta, nombre_archivo, derivado),
+        "personajes": personajes,
+        "anio": anio_foto,
+        "anio_exif": bool(row.get("AÑO_EXIF", False)),
+        # Dimensiones de la foto tal como se muestra (0 si no se conocen): el navegador reserva su hueco antes de cargarla
+        "ancho": _dimension(ancho),
+        "alto": _dimension(alto),
+    }
+
+
+# --- 3.4. SNAPSHOT COMPARTIDO ENTRE PROCESOS (DISCO) ---
+# Varios procesos (workers de un mismo contenedor o instancias con un disco común) comparten una sola
+# copia de cada catálogo con sus índices y de cada orden global. Cada versión es un directorio inmutable
+# `<familia o vista>/<hash de la generación>/`: los arrays numéricos (filas de los índices, años,
+# preorden, huellas, orden global) son .npy que se abren con mmap, y los textos y el DataFrame son Arrow
+# IPC mapeado en memoria. Un solo proceso construye cada versión bajo un bloqueo de archivo (flock) y la
+# publica renombrando su directorio temporal; los demás la leen sin descargar ni procesar el Excel.
+FORMATO_SNAPSHOT = 2 # Cambiarlo invalida los snapshots escritos con un formato anterior
+ESPERA_ESCRITOR = 300 # Segundos máximos esperando a que otro proceso publique una versión
+VERSIONES_COMPARTIDAS = 2 # Versiones que se conservan por familia o vista (la actual y la anterior)
+
+class _TextosMapeados:
+    """Secuencia de solo lectura sobre una columna de texto Arrow mapeada: cada texto se lee al pedirlo."""
+    def __init__(self, columna):
+        self._columna = columna
+
+    def __len__(self):
+        return len(self._columna)
+
+    def __getitem__(self, fila):
+        return self._columna[int(fila)].as_py()
+
+    def __iter__(self):
+        return iter(self._columna.to_pylist())
+
+def _escribir_textos(ruta, textos):
+    tabla = pa.table({"texto": pa.array(list(textos), type=pa.large_string())})
+    _escribir_tabla_arrow(ruta, tabla)
+
+def _leer_textos(ruta):
+    columna = _leer_tabla_arrow(ruta).column(0)
+    return columna.chunk(0) if columna.num_chunks == 1 else columna.combine_chunks()
+
+def _escribir_tabla_arrow(ruta, tabla):
+    with pa.OSFile(ruta, 'wb') as archivo, pa.ipc.new_file(archivo, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+def _leer_tabla_arrow(ruta):
+    return pa.ipc.open_file(pa.memory_map(ruta, 'r')).read_all()
+
+def _abrir_array(directorio, nombre):
+    """Array .npy mapeado en memoria (de solo lectura): las páginas las comparten todos los procesos."""
+    return np.asarray(np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode='r'))
+
+def _guardar_filas(directorio, nombre, listas):
+    """Guarda una lista de arrays de filas como un único array y los cortes entre ellos (formato CSR)."""
+    cortes = np.zeros(len(listas) + 1, dtype=np.int64)
+    np.cumsum([len(filas) for filas in listas], out=cortes[1:])
+    filas = np.concatenate(listas).astype(np.int32) if listas else np.empty(0, dtype=np.int32)
+    np.save(os.path.join(directorio, f"{nombre}_filas.npy"), filas)
+    np.save(os.path.join(directorio, f"{nombre}_cortes.npy"), cortes)
+
+def _abrir_filas(directorio, nombre):
+    """Arrays de filas escritos con `_guardar_filas`: vistas sobre el archivo mapeado, sin copias."""
+    filas = _abrir_array(directorio, f"{nombre}_filas")
+    cortes = _abrir_array(directorio, f"{nombre}_cortes").tolist()
+    return [filas[inicio:fin] for inicio, fin in zip(cortes[:-1], cortes[1:])]
+
+def _version_compartida(generacion):
+    return hashlib.sha1(f"{FORMATO_SNAPSHOT}:{generacion}".encode("utf-8")).hexdigest()[:20]
+
+def _directorio_familia(key):
+    return os.path.join(SNAPSHOT_COMPARTIDO_DIR, f"familia_{key}")
+
+def _directorio_vista(orden_claves):
+    return os.path.join(SNAPSHOT_COMPARTIDO_DIR, f"vista_{'_'.join(orden_claves)}")
+
+def existe_compartido(directorio, generacion):
+    """Indica si la versión de `generacion` ya está publicada en `directorio`."""
+    return SNAPSHOT_COMPARTIDO and os.path.isdir(os.path.join(directorio, _version_compartida(generacion)))
+
+def _esperar_bloqueo(archivo):
+    limite = time.monotonic() + ESPERA_ESCRITOR
+    while True:
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() > limite:
+                return False
+            time.sleep(0.05)
+        except OSError:
+            return False # Sistema de archivos sin flock
+
+@contextlib.contextmanager
+def _bloqueo_escritor(directorio):
+    """Bloqueo exclusivo entre procesos sobre `directorio`; indica si se obtuvo.
+    
+    El sistema lo libera si el proceso que lo tiene muere. Si no se obtiene (otro escritor tarda más de
+    ESPERA_ESCRITOR o el disco no admite flock), quien llama construye en memoria sin publicar nada.
+    """
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        archivo = open(os.path.join(directorio, ".bloqueo"), "a")
+    except OSError:
+        yield False
+        return
+    obtenido = _esperar_bloqueo(archivo)
+    try:
+        yield obtenido
+    finally:
+        if obtenido:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+        archivo.close()
+
+def _abrir_version(abrir, ruta):
+    if not os.path.isdir(ruta):
+        return None
+    try:
+        with tramo("snapshot_compartido"):
+            return abrir(ruta)
+    except Exception:
+        return None # Versión borrada o ilegible: se construye de nuevo.
+
+def _publicar_version(directorio, ruta, escribir):
+    """Escribe una versión en un directorio temporal y la publica renombrándolo (con el bloqueo tomado).
+    
+    El renombrado es atómico: los lectores ven la versión completa o no la ven. Después se borran las
+    versiones más antiguas; los procesos que aún las tengan mapeadas las siguen leyendo hasta soltarlas.
+    """
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp)
+        escribir(tmp)
+        os.rename(tmp, ruta)
+    except Exception:
+        # El snapshot es solo una optimización: si no se puede escribir, el valor sigue en memoria.
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    try:
+        versiones = []
+        for nombre in os.listdir(directorio):
+            ruta_version = os.path.join(directorio, nombre)
+            if nombre.endswith(".tmp"):
+                shutil.rmtree(ruta_version, ignore_errors=True) # Restos de un escritor que murió
+            elif not nombre.startswith(".") and os.path.isdir(ruta_version):
+                versiones.append((os.path.getmtime(ruta_version), ruta_version))
+        for _, vieja in sorted(versiones, reverse=True)[VERSIONES_COMPARTIDAS:]:
+            shutil.rmtree(vieja, ignore_errors=True)
+    except OSError:
+        pass
+
+def obtener_compartido(directorio, generacion, abrir, construir, guardar):
+    """Valor de `generacion` leído del snapshot compartido o, si aún no existe, construido y publicado.
+    
+    `abrir(ruta)` lee una versión publicada, `construir()` calcula el valor en memoria y
+    `guardar(valor, ruta)` lo escribe. Los procesos que esperaban el bloqueo mientras otro construía
+    leen después la versión publicada en vez de repetir el trabajo.
+    """
+    if not SNAPSHOT_COMPARTIDO:
+        return construir()
+    ruta = os.path.join(directorio, _version_compartida(generacion))
+    valor = _abrir_version(abrir, ruta)
+    if valor is not None:
+        return valor
+    with _bloqueo_escritor(directorio) as exclusivo:
+        valor = _abrir_version(abrir, ruta) if exclusivo else None
+        if valor is None:
+            valor = construir()
+            if valor is not None and exclusivo:
+                _publicar_version(directorio, ruta, lambda destino: guardar(valor, destino))
+    return valor
+
+def _guardar_catalogo(catalogo, ruta):
+    indices = catalogo["indices"]
+    tabla = pa.Table.from_pandas(catalogo["df"], preserve_index=False)
+    _escribir_tabla_arrow(os.path.join(ruta, "catalogo.arrow"), tabla)
+    for nombre in ("D", "P", "PERSONAS"):
+        indices[nombre].guardar(ruta, nombre)
+    arrays = {
+        "ANIO_NUM": indices["ANIO_NUM"],
+        "ANIOS_ORDENADOS": indices["ANIOS_ORDENADOS"],
+        "RANGO_ANIO": indices["RANGO_ANIO"],
+        "preorden": catalogo["preorden"],
+        "huellas": catalogo["huellas"],
+    }
+    delta = catalogo["delta"]
+    if delta is not None:
+        arrays.update({"delta_mapa": delta["mapa"], "delta_filas": delta["filas"]})
+    for nombre, arr in arrays.items():
+        np.save(os.path.join(ruta, f"{nombre}.npy"), arr)
+    meta = {
+        "clave": catalogo["clave"],
+        "generacion": catalogo["generacion"],
+        "n_con_anio": indices["N_CON_ANIO"],
+        "delta_desde": delta["desde"] if delta is not None else None,
+    }
+    with open(os.path.join(ruta, "catalogo.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def _abrir_catalogo(ruta):
+    """Catálogo publicado por `_guardar_catalogo`, con la misma forma que el de `obtener_catalogo_familia`."""
+    with open(os.path.join(ruta, "catalogo.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    # Columnas respaldadas por Arrow sobre el archivo mapeado: sin copiar los textos a objetos de Python.
+    df = _leer_tabla_arrow(os.path.join(ruta, "catalogo.arrow")).to_pandas(types_mapper=pd.ArrowDtype)
+    indices = {
+        "D": IndiceTexto.abrir(ruta, "D"),
+        "P": IndiceTexto.abrir(ruta, "P"),
+        "PERSONAS": IndicePersonas.abrir(ruta, "PERSONAS", len(df)),
+        "ANIO_NUM": _abrir_array(ruta, "ANIO_NUM"),
+        "ANIOS_ORDENADOS": _abrir_array(ruta, "ANIOS_ORDENADOS"),
+        "RANGO_ANIO": _abrir_array(ruta, "RANGO_ANIO"),
+        "N_CON_ANIO": meta["n_con_anio"],
+    }
+    delta = None
+    if meta["delta_desde"] is not None:
+        delta = {"desde": meta["delta_desde"], "mapa": _abrir_array(ruta, "delta_mapa"), "filas": _abrir_array(ruta, "delta_filas")}
+    return {
+        "clave": meta["clave"],
+        "generacion": meta["generacion"],
+        "df": df,
+        "indices": indices,
+        "preorden": _abrir_array(ruta, "preorden"),
+        "huellas": _abrir_array(ruta, "huellas"),
+        "delta": delta,
+    }
+
+
+# --- 3.5. FOTOS DUPLICADAS ENTRE CARPETAS (HASH PERCEPTUAL) ---
+# La misma copia en papel se escaneó en varias carpetas familiares: sus hashes perceptuales (pHash de
+# 64 bits, de generar_huellas.py) difieren en muy pocos bits. Las consultas globales pueden mostrar
+# cada grupo de copias una sola vez, conservando los datos de cada Excel.
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _huellas_por_generacion(generacion, _fs):
+    """Hash de cada foto por carpeta (carpeta -> serie uint64 indexada por NOMBRE_FOTO)."""
+    tabla = pd.read_parquet(io.BytesIO(_leer_objeto(_fs, f"{BUCKET_NAME}/{RUTA_HUELLAS}")))
+    return {
+        carpeta: grupo.drop_duplicates("NOMBRE_FOTO").set_index("NOMBRE_FOTO")["PHASH"]
+        for carpeta, grupo in tabla.groupby("CARPETA")
+    }
+
+def huellas_vista(vista, huellas_por_carpeta):
+    """Hash de cada id de fila de la vista, máscara de las filas que lo tienen y familia (su posición en la vista)."""
+    total = len(vista["rango"])
+    huellas = np.zeros(total, dtype=np.uint64)
+    con_huella = np.zeros(total, dtype=bool)
+    familia_de = np.searchsorted(vista["desplazamientos"], np.arange(total), side='right') - 1
+    for familia, desplazamiento in zip(vista["familias"], vista["desplazamientos"]):
+        serie = huellas_por_carpeta.get(consultas_individuales[familia["clave"]]["carpeta_fotos"])
+        if serie is None:
+            continue
+        posiciones = serie.index.get_indexer(familia["df"]["NOMBRE_FOTO"]) # Sin pasar por float: los hashes son uint64
+        encontradas = np.flatnonzero(posiciones >= 0)
+        huellas[encontradas + desplazamiento] = serie.to_numpy(dtype=np.uint64)[posiciones[encontradas]]
+        con_huella[encontradas + desplazamiento] = True
+    return huellas, con_huella, familia_de
+
+def _bandas(distancia):
+    """Reparte los 64 bits en `distancia` + 1 bandas (inicio, ancho).
+    
+    Dos hashes con `distancia` bits distintos o menos coinciden por completo en al menos una banda.
+    """
+    cortes = np.linspace(0, 64, min(distancia, 63) + 2).astype(int)
+    return list(zip(cortes[:-1].tolist(), np.diff(cortes).tolist()))
+
+def _pares_misma_clave(claves):
+    """Todos los pares (i, j) de posiciones con la misma clave, sin recorrer par a par en Python."""
+    orden = np.argsort(claves, kind='stable')
+    ordenadas = claves[orden]
+    inicios = np.flatnonzero(np.r_[True, ordenadas[1:] != ordenadas[:-1]])
+    tamanos = np.diff(np.r_[inicios, len(ordenadas)])
+    # Cuántas posiciones quedan detrás de cada una dentro de su grupo de claves iguales.
+    restantes = np.repeat(inicios + tamanos, tamanos) - np.arange(len(ordenadas)) - 1
+    pares_a, pares_b = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    activas = np.flatnonzero(restantes > 0)
+    salto = 1
+    while len(activas):
+        pares_a.append(orden[activas])
+        pares_b.append(orden[activas + salto])
+        salto += 1
+        activas = activas[restantes[activas] >= salto]
+    return np.concatenate(pares_a), np.concatenate(pares_b)
+
+def grupos_duplicados(huellas, con_huella, familia, distancia=DISTANCIA_DUPLICADOS):
+    """Grupo de cada fila: el menor id de las filas unidas por hashes con `distancia` bits distintos o menos.
+    
+    Solo se unen filas de familias distintas (la misma foto escaneada en otra carpeta); dos fotos de una
+    misma carpeta con hashes parecidos o idénticos quedan juntas solo si las une una copia de otra familia.
+    En lugar de comparar todos los pares se usa un índice multibanda: solo se comparan los hashes que
+    coinciden en alguna banda entera (ver `_bandas`). Cada par (hash, familia) se compara una sola vez.
+    Las filas sin hash quedan solas.
+    """
+    ids = np.flatnonzero(con_huella)
+    orden = np.lexsort((familia[ids], huellas[ids]))
+    hashes, familias = huellas[ids][orden], familia[ids][orden]
+    nuevo = np.ones(len(ids), dtype=bool)
+    nuevo[1:] = (hashes[1:] != hashes[:-1]) | (familias[1:] != familias[:-1])
+    unicos, familia_nodo = hashes[nuevo], familias[nuevo] # Nodos: pares (hash, familia) distintos
+    inverso = np.empty(len(ids), dtype=np.int64)
+    inverso[orden] = np.cumsum(nuevo) - 1
+    pares_a, pares_b = [], []
+    for inicio, ancho in _bandas(distancia):
+        a, b = _pares_misma_clave((unicos >> np.uint64(inicio)) & np.uint64((1 << ancho) - 1))
+        cercanos = (familia_nodo[a] != familia_nodo[b]) & (np.bitwise_count(unicos[a] ^ unicos[b]) <= distancia)
+        pares_a.append(a[cercanos])
+        pares_b.append(b[cercanos])
+    a, b = np.concatenate(pares_a), np.concatenate(pares_b)
+
+    # Componentes conexas: cada nodo toma la menor etiqueta de sus vecinos (con saltos de puntero) hasta estabilizarse.
+    etiqueta = np.arange(len(unicos))
+    while True:
+        nueva = etiqueta.copy()
+        minimo = np.minimum(etiqueta[a], etiqueta[b])
+        np.minimum.at(nueva, a, minimo)
+        np.minimum.at(nueva, b, minimo)
+        nueva = nueva[nueva]
+        if np.array_equal(nueva, etiqueta):
+            break
+        etiqueta = nueva
+
+    # Las filas de un nodo sin vecinos de otra familia no se agrupan (ni siquiera con las de su mismo hash).
+    con_copias = np.zeros(len(unicos), dtype=bool)
+    con_copias[a] = True
+    con_copias[b] = True
+    ids, inverso = ids[con_copias[inverso]], inverso[con_copias[inverso]]
+    componente = etiqueta[inverso]
+    primero = np.full(len(unicos), len(huellas), dtype=np.int64)
+    np.minimum.at(primero, componente, ids)
+    grupo = np.arange(len(huellas), dtype=np.int64)
+    grupo[ids] = primero[componente]
+    return grupo
+
+@medido("duplicados")
+def agrupar_duplicados(vista, huellas_por_carpeta, distancia=DISTANCIA_DUPLICADOS):
+    """Vista global con cada grupo de duplicados en una sola entrada: la copia que aparece primero en su orden.
+    
+    Los ids de fila no cambian. `orden` solo contiene los representantes, `rango[fila]` es la posición del
+    representante de `fila` (una búsqueda que encuentra cualquier copia muestra el grupo una vez) y
+    `duplicados[representante]` son los ids de todas las copias, en el orden de la vista.
+    """
+    grupo = grupos_duplicados(*huellas_vista(vista, huellas_por_carpeta), distancia)
+    total = len(grupo)
+    primera_posicion = np.full(total, total, dtype=np.int64)
+    np.minimum.at(primera_posicion, grupo, vista["rango"])
+    representante = vista["orden"][primera_posicion[grupo]]
+    orden = vista["orden"][(representante == np.arange(total))[vista["orden"]]]
+    posicion = np.empty(total, dtype=np.int32)
+    posicion[orden] = np.arange(len(orden), dtype=np.int32)
+
+    duplicados = {}
+    copias = np.flatnonzero(np.bincount(representante, minlength=total)[representante] > 1)
+    if len(copias):
+        copias = copias[np.lexsort((vista["rango"][copias], representante[copias]))]
+        for miembros in np.split(copias, np.flatnonzero(np.diff(representante[copias])) + 1):
+            duplicados[int(miembros[0])] = _solo_lectura(miembros.astype(np.int32))
+    return {
+        **vista,
+        "orden": _solo_lectura(orden),
+        "rango": _solo_lectura(posicion[representante]),
+        "total": len(orden),
+        "duplicados": duplicados,
+    }
 
 
 # --- 4. FUNCIÓN DE FILTRADO Y NAVEGACIÓN ---
@@ -254,12 +1977,15 @@ def cargar_y_unificar_por_orden(orden_claves, _fs, _cache):
 def go_home():
     """Vuelve al menú principal (Selección de Consulta)."""
     st.session_state.menu_state = 'INICIO'
-    st.session_state.filtered_results = pd.DataFrame()
+    st.session_state.filas_resultado = np.empty(0, dtype=np.int32)
     st.session_state.photo_index = 0
+    st.session_state.pagina_grilla = 0
     st.session_state.config_actual = None
     st.session_state.modo_busqueda = None
     st.session_state.criterio_busqueda = None
     st.session_state.anio_filtro = None
+    st.session_state.anio_hasta = None
+    st.session_state.revision_visible = False
     st.rerun()
 
 def go_to_filter():
@@ -268,69 +1994,239 @@ def go_to_filter():
     st.session_state.photo_index = 0
     st.rerun()
 
-def filter_data(df, modo, criterio, anio_filtro_str):
-    """Implementa la lógica de filtrado de DESCRIPCION/PERSONAJE de Tkinter."""
+@medido("filtrado")
+def filter_data(vista, modo, criterio, anio_filtro_str, presentes=None, avisos=None, anio_hasta_str=None):
+    """Implementa la lógica de filtrado de DESCRIPCION/PERSONAJE de Tkinter sobre una vista de `obtener_vista`.
+    
+    Devuelve los ids de fila (int32) de los resultados, en el orden en que se deben mostrar.
+    En el modo "B" (varias personas) `criterio` es una expresión AND/OR/NOT y los años
+    `anio_filtro_str`-`anio_hasta_str` son un rango (cualquiera de los dos puede quedar vacío).
+    Con `presentes` (ver `presencia_vista`) se descartan las filas cuyo archivo no existe en el Bucket.
+    Si se pasa la lista `avisos`, los avisos se agregan a ella en lugar de mostrarse.
+    """
+    avisar = st.warning if avisos is None else avisos.append
+    indices = vista["indices"]
+    orden, rango = vista["orden"], vista["rango"]
     
-    # 1. Filtrar por Descripción/Personaje
+    # 1. Filtrar por Descripción/Personaje (ids de fila, en el orden de la vista; np.unique porque con los
+    #    duplicados agrupados todas las copias de una foto comparten la posición de su representante)
     if modo == "D":
-        descripcion_serie = df.get("DESCRIPCION", pd.Series("", index=df.index))
-        
         if not criterio:
-            filtered_df = df.copy()
+            filas = orden if orden is not None else np.arange(vista["total"], dtype=np.int32)
         else:
-            filtered_df = df[descripcion_serie.astype(str).str.contains(criterio, case=False, na=False)]
+            filas = indices["D"].buscar(criterio)
+            if orden is not None:
+                filas = orden[np.unique(rango[filas])]
+    elif modo == "B": # Varias personas: conjuntos de filas por persona
+        try:
+            filas = indices["PERSONAS"].buscar(analizar_consulta_personas(criterio or ""))
+        except ValueError as e:
+            avisar(str(e))
+            return np.empty(0, dtype=np.int32)
+        if orden is not None:
+            filas = orden[np.unique(rango[filas])]
     else: # Modo "P" (Personaje)
         if not criterio:
-            return pd.DataFrame()
+            return np.empty(0, dtype=np.int32)
             
-        columnas_personaje = [col for col in df.columns if "PERSONAJE" in col]
-        filtro = pd.Series(False, index=df.index)
-        for col in columnas_personaje:
-            filtro |= df[col].astype(str).str.contains(criterio, case=False, na=False)
-        filtered_df = df[filtro]
+        filas = indices["P"].buscar(criterio)
+        if orden is not None:
+            filas = orden[np.unique(rango[filas])]
+
+    if presentes is not None:
+        filas = filas[presentes[filas]]
         
-    if filtered_df.empty:
-        return pd.DataFrame()
+    if len(filas) == 0:
+        return np.empty(0, dtype=np.int32)
 
-    # 2. Filtrar por Año (Lógica compleja de Tkinter)
+    if modo == "B":
+        return _filtrar_rango_anios(indices, filas, anio_filtro_str, anio_hasta_str, avisar)
+
+    # 2. Filtrar por Año (Lógica compleja de Tkinter) con el índice de años precalculado
+    rango_anio = indices["RANGO_ANIO"]
     if anio_filtro_str:
         try:
             anio_filtro_int = int(anio_filtro_str.strip())
             
-            anio_serie = filtered_df.get("AÑO", pd.Series(None, index=filtered_df.index))
-            filtered_df['AÑO_FILTRO_NUM'] = pd.to_numeric(anio_serie.astype(str).str.strip(), errors='coerce')
-            
-            siguiente_anio_val = filtered_df[filtered_df['AÑO_FILTRO_NUM'] >= anio_filtro_int]['AÑO_FILTRO_NUM'].min()
+            # Búsqueda binaria: las filas con año >= filtro ocupan las posiciones [corte, n_con_anio) del orden por año.
+            corte = np.searchsorted(indices["ANIOS_ORDENADOS"], anio_filtro_int, side='left')
+            posiciones = rango_anio[filas]
+            con_anio = (posiciones >= corte) & (posiciones < indices["N_CON_ANIO"])
             
-            if pd.notna(siguiente_anio_val):
-                anio_encontrado = int(siguiente_anio_val)
-                filtered_df = filtered_df[filtered_df['AÑO_FILTRO_NUM'] >= anio_encontrado]
+            if con_anio.any():
+                anio_encontrado = int(indices["ANIOS_ORDENADOS"][posiciones[con_anio].min()])
+                filas = filas[con_anio]
                 
                 if anio_encontrado > anio_filtro_int:
-                    st.warning(f"Filtro ajustado: No se encontraron fotos disponibles a partir del año {anio_filtro_int}. Mostrando resultados a partir del año {anio_encontrado} (el más próximo encontrado).")
+                    avisar(f"Filtro ajustado: No se encontraron fotos disponibles a partir del año {anio_filtro_int}. Mostrando resultados a partir del año {anio_encontrado} (el más próximo encontrado).")
             else:
-                filtered_df = pd.DataFrame()
+                return np.empty(0, dtype=np.int32)
 
-            if not filtered_df.empty:
-                filtered_df = filtered_df.drop(columns=['AÑO_FILTRO_NUM']) 
+        except ValueError:
+            avisar("El valor del año no es un número. Se ignorará el filtro de año.")
+    
+    if st.session_state.opcion_elegida in consultas_individuales and anio_filtro_str:
+        # Orden por año (sin año al final) reutilizando la permutación precalculada en lugar de un sort_values.
+        filas = filas[np.argsort(rango_anio[filas], kind='stable')]
 
+    return np.asarray(filas, dtype=np.int32)
+
+def _filtrar_rango_anios(indices, filas, desde_str, hasta_str, avisar):
+    """Filtro de años del modo "B": filas con año dentro de [desde, hasta]; sin años, no filtra."""
+    limites = []
+    for valor in (desde_str, hasta_str):
+        try:
+            limites.append(int(valor.strip()) if valor and valor.strip() else None)
         except ValueError:
-            st.warning("El valor del año no es un número. Se ignorará el filtro de año.")
+            avisar("El valor del año no es un número. Se ignorará ese límite del rango.")
+            limites.append(None)
+    desde, hasta = limites
+    if desde is None and hasta is None:
+        return np.asarray(filas, dtype=np.int32)
+
+    anios = indices["ANIO_NUM"][filas]
+    dentro = ~np.isnan(anios)
+    if desde is not None:
+        dentro &= anios >= desde
+    if hasta is not None:
+        dentro &= anios <= hasta
+    filas = filas[dentro]
+    if st.session_state.opcion_elegida in consultas_individuales:
+        filas = filas[np.argsort(indices["RANGO_ANIO"][filas], kind='stable')]
+    return np.asarray(filas, dtype=np.int32)
+
+# Caché de resultados compartida por todas las sesiones: muchas personas repiten las mismas búsquedas.
+RESULTADOS_CACHE_MB = float(os.environ.get("VISOR_CACHE_RESULTADOS_MB", "64")) # Memoria máxima de la caché de búsquedas
+
+class CacheResultados:
+    """LRU de resultados de `filter_data` (ids de fila de solo lectura y sus avisos), acotada por memoria.
     
-    if st.session_state.opcion_elegida in consultas_individuales and anio_filtro_str and filtered_df.shape[0] > 0:
-        anio_sort_serie = filtered_df.get("AÑO", pd.Series(None, index=filtered_df.index))
-        filtered_df['AÑO_ORDEN'] = pd.to_numeric(anio_sort_serie, errors='coerce')
-        filtered_df = filtered_df.sort_values(by='AÑO_ORDEN', ascending=True, na_position='last')
-        filtered_df = filtered_df.drop(columns=['AÑO_ORDEN']).reset_index(drop=True)
+    Las claves incluyen las generaciones de los Excel de la consulta: al guardar un resultado de una
+    generación nueva se descartan los de generaciones anteriores de esas familias.
+    """
+    BYTES_POR_ENTRADA = 200 # Estimación del coste fijo de cada entrada (clave, tupla, diccionario)
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+
+    def _tamano(self, filas):
+        return filas.nbytes + self.BYTES_POR_ENTRADA
+
+    def _quitar(self, clave):
+        filas, _ = self._entradas.pop(clave)
+        self._bytes -= self._tamano(filas)
+
+    def obtener(self, clave):
+        with self._lock:
+            encontrado = self._entradas.get(clave)
+            if encontrado is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return encontrado
+
+    def guardar(self, clave, filas, avisos):
+        generaciones = dict(clave[1])
+        with self._lock:
+            # Resultados de otras generaciones de las mismas familias: ya no corresponden al Excel actual.
+            obsoletas = [
+                otra for otra in self._entradas
+                if any(generaciones.get(familia, generacion) != generacion for familia, generacion in otra[1])
+            ]
+            for otra in obsoletas:
+                self._quitar(otra)
+            self.descartes += len(obsoletas)
+
+            if clave in self._entradas:
+                self._quitar(clave)
+            if self._tamano(filas) > self.max_bytes:
+                return
+            self._entradas[clave] = (filas, avisos)
+            self._bytes += self._tamano(filas)
+            while self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+                self.descartes += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "descartes": self.descartes,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+            }
+
+@st.cache_resource(show_spinner=False)
+def cache_resultados():
+    cache = CacheResultados(int(RESULTADOS_CACHE_MB * 1024 * 1024))
+    METRICAS.registrar_cache("resultados", cache.estadisticas)
+    return cache
+
+def _clave_anio(anio_filtro_str):
+    """Año del filtro tal como lo interpreta `filter_data` (" 1980" y "1980" son la misma búsqueda)."""
+    if not anio_filtro_str:
+        return ""
+    try:
+        return int(anio_filtro_str.strip())
+    except ValueError:
+        return anio_filtro_str
+
+def _clave_criterio(modo, criterio):
+    """Criterio tal como lo interpreta `filter_data`: texto normalizado o, en el modo "B", el árbol de la expresión."""
+    if modo == "B":
+        try:
+            return analizar_consulta_personas(criterio)
+        except ValueError:
+            return criterio
+    return (bool(criterio), normalizar_texto(criterio))
 
-    return filtered_df.reset_index(drop=True)
+def filtrar_resultados(opcion, generaciones, modo, criterio, anio_filtro_str, ocultar_faltantes, _fs, anio_hasta_str=None, agrupar_duplicados=False):
+    """`filter_data` sobre la vista de la consulta, pasando antes por la caché de resultados compartida.
+    
+    La clave es (consulta, generaciones, listados si se ocultan faltantes, hashes si se agrupan duplicados,
+    modo, criterio normalizado, años).
+    """
+    presentes, generacion_listados = None, None
+    if ocultar_faltantes:
+        revision = revision_archivos(opcion, generaciones, _fs)
+        if revision is not None:
+            presentes, generacion_listados = revision["presentes"], revision["generacion"]
+
+    agrupar_duplicados = agrupar_duplicados and opcion in consultas_globales
+    generacion_huellas = obtener_generacion_objeto(RUTA_HUELLAS, _fs) if agrupar_duplicados else None
+
+    criterio = criterio or ""
+    anios = (_clave_anio(anio_filtro_str), _clave_anio(anio_hasta_str) if modo == "B" else "")
+    clave = (opcion, generaciones, generacion_listados, generacion_huellas, modo, _clave_criterio(modo, criterio), anios)
+    cache = cache_resultados()
+    encontrado = cache.obtener(clave)
+    if encontrado is None:
+        avisos = []
+        vista = obtener_vista(opcion, generaciones, _fs, agrupar_duplicados)
+        filas = filter_data(vista, modo, criterio, anio_filtro_str, presentes, avisos, anio_hasta_str)
+        encontrado = (_solo_lectura(filas), tuple(avisos))
+        cache.guardar(clave, *encontrado)
+
+    filas, avisos = encontrado
+    for aviso in avisos:
+        st.warning(aviso)
+    return filas
 
 
 def update_index(direction): 
     """
     Cambia la foto actual con navegación circular.
+    Se usa como callback (on_click) de ANT/SIG: se ejecuta antes de volver a pintar el visor.
     """
-    total = len(st.session_state.filtered_results)
+    total = len(st.session_state.filas_resultado)
     if total == 0:
         return
 
@@ -342,165 +2238,145 @@ def update_index(direction):
         st.session_state.photo_index = total - 1
     else:
         st.session_state.photo_index = new_index
-        
-    st.rerun()
 
 
-# --- 5. INTERFAZ DE STREAMLIT ---
-
-st.set_page_config(layout="wide", page_title="Visor Familiar Cloud")
-
-# 5.1. Carga inicial de datos (para cache)
-for key, config in consultas_individuales.items():
-    excel_name_key = config["ruta_excel"].upper()
-    if excel_name_key not in st.session_state.df_cache:
-        st.session_state.df_cache[excel_name_key] = load_excel_from_gcs(config["ruta_excel"], fs)
-
-# 5.2. Lógica del Menú Principal (INICIO)
-if st.session_state.menu_state == 'INICIO':
-    st.subheader("Seleccione una Consulta") 
-    
-    col_ind, col_global = st.columns([1, 1])
+# --- 4.1. VISOR DE FOTOS (FRAGMENTO) ---
+
+# Fotos vecinas (i±1 … i±k) que el navegador descarga por adelantado mientras se ve la actual
+PRECARGA_VECINOS = int(os.environ.get("PRECARGA_VECINOS", "2"))
+
+# Precarga en segundo plano: espera a que termine la foto actual, descarga de una en una (nunca más
+# de una petición en curso), con prioridad baja y sin hacer nada si el usuario pidió ahorro de datos.
+PLANTILLA_PRECARGA = """
+<script>
+const actual = __ACTUAL__;
+const vecinas = __VECINAS__;
+const tamanos = "__TAMANOS__";
+const conexion = navigator.connection || {};
+const ahorro = conexion.saveData || ["slow-2g", "2g"].includes(conexion.effectiveType);
+
+// En este iframe de 1 px, "vw" mediría el iframe y el navegador elegiría el candidato más pequeño del srcset:
+// `sizes` se resuelve a píxeles con la ventana de la página, así se descarga el mismo candidato que la vista.
+function tamanosPagina() {
+  let pagina = null;
+  try { pagina = window.parent.innerWidth ? window.parent : null; } catch (e) {} // Iframe de otro origen
+  const ancho = pagina ? pagina.innerWidth : screen.width;
+  const entradas = tamanos.split(",").map((entrada) => entrada.trim().match(/^(\\(.*\\))?\\s*([\\d.]+)(vw|px)$/));
+  for (const m of entradas) {
+    if (!m || (m[1] && (!pagina || !pagina.matchMedia(m[1]).matches))) continue;
+    return (m[3] === "vw" ? Math.round(ancho * m[2] / 100) : Number(m[2])) + "px";
+  }
+  return tamanos;
+}
+const tamanosResueltos = tamanosPagina();
+
+function cargar(foto, siguiente) {
+  const img = new Image();
+  img.fetchPriority = "low";
+  img.onload = img.onerror = siguiente;
+  if (foto.s) { img.sizes = tamanosResueltos; img.srcset = foto.s; }
+  img.src = foto.u;
+}
 
-    with col_ind:
-        st.markdown("### Consultas Individuales")
-        for key, config in consultas_individuales.items():
-            if st.button(f"{key} - {config['nombre']}", key=f"btn_{key}"):
-                st.session_state.config_actual = config
-                st.session_state.opcion_elegida = key
-                df_temp = st.session_state.df_cache[config["ruta_excel"].upper()]
-                
-                if not df_temp.empty:
-                    df_base = df_temp.copy()
-                    df_base['_FOLDER_PATH'] = GCS_BASE_PATH.rstrip('/') + '/' + config["carpeta_fotos"].lstrip('/')
-                    df_base['NOMBRE_FOTO'] = df_base['NOMBRE'].astype(str).str.strip()
-                    
-                    st.session_state.df_base = df_base
-                    st.session_state.menu_state = 'MODO_BUSQUEDA'
-                    st.rerun()
+function precargar(i) {
+  if (ahorro || i >= vecinas.length) return;
+  cargar(vecinas[i], () => precargar(i + 1));
+}
 
-    with col_global:
-        st.markdown("### Consultas Globales")
-        for key, config in consultas_globales.items():
-            if st.button(f"{key} - {config['nombre']}", key=f"btn_{key}"):
-                st.session_state.config_actual = config
-                st.session_state.opcion_elegida = key
-                
-                st.session_state.df_base = cargar_y_unificar_por_orden(
-                    config['orden_carga'], fs, st.session_state.df_cache
-                )
-                if st.session_state.df_base is not None and not st.session_state.df_base.empty:
-                    st.session_state.menu_state = 'MODO_BUSQUEDA'
-                st.rerun()
-                
-    st.sidebar.markdown("Presione el botón para empezar.")
+cargar(actual, () => precargar(0));
+</script>
+"""
 
-# 5.3. Selección de Modo de Búsqueda (MODO_BUSQUEDA)
-elif st.session_state.menu_state == 'MODO_BUSQUEDA':
-    st.subheader(f"Consulta: {st.session_state.config_actual['nombre']}") 
-    
-    st.markdown(f"**Modo Actual: {'DESCRIPCIÓN' if st.session_state.modo_busqueda == 'D' else 'PERSONAJE'}**")
-    st.warning("Seleccione D para DESCRIPCIÓN o P para PERSONAJE:")
+def vecinas_circulares(index, total, k):
+    """Índices i+1, i-1, i+2, i-2 … hasta k a cada lado, con vuelta circular y sin repetir."""
+    vecinas = []
+    for distancia in range(1, k + 1):
+        for candidata in ((index + distancia) % total, (index - distancia) % total):
+            if candidata != index and candidata not in vecinas:
+                vecinas.append(candidata)
+    return vecinas
+
+def precargar_vecinas(vista, filas, index, derivados, foto_actual):
+    """Inserta un iframe mínimo (1 px) que precarga las fotos vecinas a la actual en la caché del navegador.
     
-    col_d, col_p, col_volver = st.columns([1, 1, 1])
-    
-    if col_d.button("D - DESCRIPCIÓN"):
-        st.session_state.modo_busqueda = "D"
-        st.session_state.menu_state = 'FILTRAR'
-        st.rerun()
-    
-    if col_p.button("P - PERSONAJE"):
-        st.session_state.modo_busqueda = "P"
-        st.session_state.menu_state = 'FILTRAR'
-        st.rerun()
-
-    if col_volver.button("⬅️ Volver al Menú"):
-        go_home()
-        st.rerun()
-
-# 5.4. Interfaz de Filtrado (FILTRAR)
-elif st.session_state.menu_state == 'FILTRAR':
-    st.subheader(f"Filtrar: {st.session_state.config_actual['nombre']} (Modo: {'DESCRIPCIÓN' if st.session_state.modo_busqueda == 'D' else 'PERSONAJE'})") 
+    El iframe resuelve `TAMANOS_IMAGEN` con el ancho de la página, así que pide el mismo candidato del srcset que la vista.
+    """
+    if PRECARGA_VECINOS <= 0 or len(filas) < 2:
+        return
+    vecinas = []
+    for i in vecinas_circulares(index, len(filas), PRECARGA_VECINOS):
+        row, clave_familia = obtener_fila(vista, filas[i])
+        foto = datos_foto(row, clave_familia, derivados)
+        if os.path.splitext(foto["nombre_archivo"])[1].lower() in EXTENSIONES_IMAGEN:
+            vecinas.append({"u": foto["url"], "s": foto["srcset_webp"]})
+    if not vecinas:
+        return
+    html = (PLANTILLA_PRECARGA
+        .replace("__ACTUAL__", json.dumps({"u": foto_actual["url"], "s": foto_actual["srcset_webp"]}).replace("</", "<\\/"))
+        .replace("__VECINAS__", json.dumps(vecinas).replace("</", "<\\/"))
+        .replace("__TAMANOS__", TAMANOS_IMAGEN))
+    incrustar_html(html, 1)
+
+def botones_navegacion(index):
+    """Botones del visor: anterior/siguiente (callbacks del fragmento), menú, cuadrícula y presentación."""
+    # Espacio para alinear verticalmente con la imagen
+    st.markdown('<div style="height: 50px;"></div>', unsafe_allow_html=True) 
     
-    st.session_state.criterio_busqueda = st.text_input("Ingrese palabra o nombre clave (Vacío para ver todo en modo D):")
-    st.session_state.anio_filtro = st.text_input("Ingrese un año para filtrar (dejar en blanco para ver todas):")
+    # 1. Botón Anterior (ANT)
+    st.button("⬅️ ANT", key="btn_prev", on_click=update_index, args=(-1,))
+        
+    # 2. Botón Siguiente (SIG)
+    st.button("SIG ➡️", key="btn_next", on_click=update_index, args=(1,))
+        
+    st.markdown('<div style="height: 50px;"></div>', unsafe_allow_html=True) 
 
-    col_filtrar, col_cambiar_modo, col_volver = st.columns([1, 1, 1])
-    
-    if col_filtrar.button("🔍 Buscar (Ver Fotos)"):
-        if st.session_state.modo_busqueda == "P" and not st.session_state.criterio_busqueda:
-            st.error("Debe ingresar una palabra para buscar por PERSONAJE.")
-        else:
-            st.session_state.filtered_results = filter_data(
-                st.session_state.df_base,
-                st.session_state.modo_busqueda,
-                st.session_state.criterio_busqueda,
-                st.session_state.anio_filtro
-            )
+    # 3. Botón Volver/Menú
+    if st.button("🏠 MENÚ", key="btn_volver_filtro"):
+        go_home() 
 
-            if st.session_state.filtered_results.empty:
-                st.warning("❌ No se encontró ninguna imagen que coincida con el criterio.")
-            else:
-                st.session_state.photo_index = 0
-                st.session_state.menu_state = 'VER_FOTO'
-                st.rerun()
-    
-    if col_cambiar_modo.button("🔄 Cambiar Modo (D/P)"):
-        st.session_state.menu_state = 'MODO_BUSQUEDA'
+    # 4. Botón Cuadrícula (hoja de contactos paginada)
+    if st.button("🔲 CUADRÍCULA", key="btn_grilla"):
+        st.session_state.pagina_grilla = index // FOTOS_POR_PAGINA
+        st.session_state.menu_state = 'GRILLA'
         st.rerun()
 
-    if col_volver.button("⬅️ Volver al Menú"):
-        go_home()
+    # 5. Botón Presentación (navegación en el navegador, sin volver al servidor)
+    if st.button("▶️ PRESENTACIÓN", key="btn_presentacion"):
+        st.session_state.menu_state = 'PRESENTACION'
         st.rerun()
 
-# 5.5. Visualización de Foto y Navegación (VER_FOTO)
-elif st.session_state.menu_state == 'VER_FOTO':
+@st.fragment
+@medido("pintado_visor")
+def visor_foto():
+    """Muestra la foto actual con su encabezado, navegación y contador.
     
-    df = st.session_state.filtered_results
+    Es un fragmento: ANT/SIG solo vuelven a ejecutar esta función, no todo el script
+    (CSS, carga inicial y menús quedan como están).
+    """
+    filas = st.session_state.filas_resultado
     index = st.session_state.photo_index
-    total_photos = len(df)
+    total_photos = len(filas)
     
-    if total_photos == 0:
-        st.warning("No hay resultados para mostrar.")
-        if st.button("Volver al Filtro"):
-            st.session_state.menu_state = 'FILTRAR'
-            st.rerun()
-        st.stop()
-
-    row = df.iloc[index]
+    fs = obtener_fs()
+    vista = obtener_vista(st.session_state.opcion_elegida, st.session_state.generaciones_vista, fs, st.session_state.agrupar_duplicados)
+    row, clave_familia = obtener_fila(vista, filas[index])
+    presentes = presencia_vista(st.session_state.opcion_elegida, st.session_state.generaciones_vista, fs) if st.session_state.ocultar_faltantes else None
     
     # 1. Determinar rutas y metadatos
-    opcion_elegida = st.session_state.opcion_elegida
-    nombre_archivo = str(row["NOMBRE_FOTO"]).strip()
-    descripcion = str(row.get("DESCRIPCION", "")).strip()
-
-    if opcion_elegida in consultas_individuales:
-        ruta_carpeta = consultas_individuales[opcion_elegida]["carpeta_fotos"]
-    else:
-        ruta_carpeta = row['_FOLDER_PATH'].split('/')[-1]
-    
-    public_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{ruta_carpeta}/{nombre_archivo}"
-    
-    # Obtener metadatos
-    personajes = []
-    for col in df.columns:
-        if "PERSONAJE" in col:
-            valor = row.get(col)
-            if pd.notna(valor) and str(valor).strip() != "":
-                personajes.append(str(valor).strip())
-                
-    anio_valor = row.get("AÑO")
-    anio_foto = ""
-    if pd.notna(anio_valor) and str(anio_valor).strip() != "":
-        try:
-            anio_foto = str(int(float(str(anio_valor).strip()))).strip()
-        except:
-            pass
+    derivados = obtener_indice_derivados(fs)
+    foto = datos_foto(row, clave_familia, derivados)
+    nombre_archivo = foto["nombre_archivo"]
+    descripcion = foto["descripcion"]
+    public_url = foto["url"]
+    personajes = foto["personajes"]
+    anio_foto = foto["anio"]
             
     # 2. ENCABEZADO FLOTANTE (STICKY) - SE MANTIENE EL CÓDIGO
     descripcion_header_val = descripcion if descripcion else "*No disponible*"
     descripcion_header = f"Descripción: {descripcion_header_val}"
     anio_header = f"{anio_foto}" if anio_foto else "*Desconocido*"
+    if anio_foto and foto["anio_exif"]:
+        anio_header += " (fecha de la cámara)"
     
     html_header_content = f"""
     <div class="sticky-header">
@@ -515,7 +2391,7 @@ elif st.session_state.menu_state == 'VER_FOTO':
     
     try:
         ext = os.path.splitext(nombre_archivo)[1].lower()
-        if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']:
+        if ext in EXTENSIONES_IMAGEN:
             
             # --- PREPARACIÓN DEL TEXTO PARA LA SUPERPOSICIÓN ---
             descripcion_mostrar = descripcion.strip() if descripcion.strip() else ""
@@ -523,6 +2399,31 @@ elif st.session_state.menu_state == 'VER_FOTO':
             
             texto_superpuesto = f"{descripcion_mostrar}{anio_mostrar}"
 
+            # --- VERSIONES REDUCIDAS: el navegador elige la de ancho adecuado (srcset) ---
+            fuente_webp = ""
+            srcset_jpeg = ""
+            if foto["srcset_webp"]:
+                fuente_webp = f'<source type="image/webp" srcset="{foto["srcset_webp"]}" sizes="{TAMANOS_IMAGEN}">'
+                srcset_jpeg = f'srcset="{foto["srcset_jpeg"]}" sizes="{TAMANOS_IMAGEN}"'
+            dimensiones = f'width="{foto["ancho"]}" height="{foto["alto"]}"' if foto["ancho"] and foto["alto"] else ""
+
+            imagen = f"""
+                <picture style="display: contents;">
+                    {fuente_webp}
+                    <img src="{public_url}" {srcset_jpeg} {dimensiones} style="
+                        max-width: 100%; 
+                        max-height: 100%; 
+                        object-fit: contain; 
+                        display: block;
+                    ">
+                </picture>"""
+            if presentes is not None and not presentes[filas[index]]:
+                # El listado de la carpeta no tiene este archivo: no se pide la imagen.
+                imagen = f"""
+                <div style="padding: 40px; color: #b00020; font-weight: bold;">
+                    🚫 El archivo {nombre_archivo} no está en la carpeta {consultas_individuales[clave_familia]["carpeta_fotos"]} del Bucket.
+                </div>"""
+
             # --- CÓDIGO HTML/CSS para ESCALADO INTELIGENTE Y SUPERPOSICIÓN EN LA FOTO ---
             html_img_code = f"""
             <div style="
@@ -533,12 +2434,7 @@ elif st.session_state.menu_state == 'VER_FOTO':
                 justify-content: left; 
                 overflow: hidden;
             ">
-                <img src="{public_url}" style="
-                    max-width: 100%; 
-                    max-height: 100%; 
-                    object-fit: contain; 
-                    display: block;
-                ">
+                {imagen}
                 <div style="
                     position: absolute; /* Superposición */
                     bottom: 0; 
@@ -563,31 +2459,19 @@ elif st.session_state.menu_state == 'VER_FOTO':
             
             with col_img:
                 st.markdown(html_img_code, unsafe_allow_html=True)
+                precargar_vecinas(vista, filas, index, derivados, foto)
             
             # --- BOTONES DE NAVEGACIÓN (Pequeños y Juntos) ---
             with col_nav_next:
-                
-                # Espacio para alinear verticalmente con la imagen
-                st.markdown('<div style="height: 50px;"></div>', unsafe_allow_html=True) 
-                
-                # 1. Botón Anterior (ANT)
-                if st.button("⬅️ ANT", key="btn_prev"):
-                    update_index(-1)
-                    
-                # 2. Botón Siguiente (SIG)
-                if st.button("SIG ➡️", key="btn_next"):
-                    update_index(1)
-                    
-                st.markdown('<div style="height: 50px;"></div>', unsafe_allow_html=True) 
-
-                # 3. Botón Volver/Menú
-                if st.button("🏠 MENÚ", key="btn_volver_filtro"):
-                    go_home() 
+                botones_navegacion(index)
             
-        elif ext in ['.mp4', '.avi', '.mov', '.mkv']:
+        elif ext in EXTENSIONES_VIDEO:
             with col_img:
-                st.warning("⚠️ Archivo es un video. Haga clic derecho -> Guardar para descargar y ver.")
+                # Con VISOR_MEDIOS_URL se reproduce por rangos de bytes desde el servidor de medios (no se descarga entero).
+                st.video(url_video(consultas_individuales[clave_familia]["carpeta_fotos"], nombre_archivo, public_url))
                 st.markdown(f"**Archivo de video:** `{nombre_archivo}`")
+            with col_nav_next:
+                botones_navegacion(index)
         else:
             with col_img:
                 st.error(f"Tipo de archivo no soportado: {ext}")
@@ -608,8 +2492,885 @@ elif st.session_state.menu_state == 'VER_FOTO':
             
         # NOMBRE DE ARCHIVO
         st.markdown(f"**NOMBRE DE ARCHIVO:** `{nombre_archivo}`")
+
+        # COPIAS: la misma foto en otras carpetas (duplicados agrupados), con los datos de cada Excel
+        copias = vista.get("duplicados", {}).get(int(filas[index]), ())
+        for copia in copias[1:]:
+            row_copia, clave_copia = obtener_fila(vista, copia)
+            datos = datos_foto(row_copia, clave_copia)
+            detalles = [f"`{datos['nombre_archivo']}`", datos["anio"] or "*sin año*", datos["descripcion"] or "*sin descripción*"]
+            if datos["personajes"]:
+                detalles.append(", ".join(datos["personajes"]))
+            st.markdown(f"**TAMBIÉN EN {consultas_individuales[clave_copia]['nombre']}:** " + " · ".join(detalles))
         
     st.markdown("---")
     
     # 5. Contador (Al final) - MANTENIDO Y CON ESPACIO CORREGIDO
     st.subheader(f"Foto {index + 1} de {total_photos} - {st.session_state.config_actual['nombre']}")
+
+
+# --- 4.3. CUADRÍCULA PAGINADA DE RESULTADOS (HOJA DE CONTACTOS) ---
+
+FOTOS_POR_PAGINA = 24
+COLUMNAS_GRILLA = 6
+ALTO_MINIATURA = 160 # px
+
+def abrir_foto(indice):
+    """Abre el visor individual en la foto elegida de la cuadrícula (rerun completo, no solo del fragmento)."""
+    st.session_state.photo_index = indice
+    st.session_state.menu_state = 'VER_FOTO'
+    st.rerun()
+
+def cambiar_pagina(direccion, total_paginas):
+    """Callback de la cuadrícula: página anterior/siguiente (circular)."""
+    st.session_state.pagina_grilla = (st.session_state.pagina_grilla + direccion) % total_paginas
+
+@st.fragment
+@medido("pintado_grilla")
+def grilla_resultados():
+    """Muestra una página de miniaturas de los resultados.
+    
+    Solo se leen del catálogo las filas de la página visible; las imágenes se cargan en diferido
+    (loading="lazy") y cambiar de página solo vuelve a ejecutar este fragmento.
+    """
+    filas = st.session_state.filas_resultado
+    total_paginas = max(1, -(-len(filas) // FOTOS_POR_PAGINA))
+    pagina = min(st.session_state.pagina_grilla, total_paginas - 1)
+    inicio = pagina * FOTOS_POR_PAGINA
+    
+    col_ant, col_pagina, col_sig = st.columns([1, 3, 1])
+    col_ant.button("⬅️ ANT", key="grilla_prev", on_click=cambiar_pagina, args=(-1, total_paginas))
+    col_pagina.markdown(f"**Página {pagina + 1} de {total_paginas}** ({len(filas)} fotos)")
+    col_sig.button("SIG ➡️", key="grilla_next", on_click=cambiar_pagina, args=(1, total_paginas))
+
+    fs = obtener_fs()
+    vista = obtener_vista(st.session_state.opcion_elegida, st.session_state.generaciones_vista, fs)
+    derivados = obtener_indice_derivados(fs)
+    presentes = presencia_vista(st.session_state.opcion_elegida, st.session_state.generaciones_vista, fs) if st.session_state.ocultar_faltantes else None
+    filas_pagina = filas[inicio:inicio + FOTOS_POR_PAGINA]
+    
+    for inicio_fila in range(0, len(filas_pagina), COLUMNAS_GRILLA):
+        columnas = st.columns(COLUMNAS_GRILLA)
+        for offset, fila in enumerate(filas_pagina[inicio_fila:inicio_fila + COLUMNAS_GRILLA]):
+            indice = inicio + inicio_fila + offset
+            row, clave_familia = obtener_fila(vista, fila)
+            foto = datos_foto(row, clave_familia, derivados)
+            with columnas[offset]:
+                if presentes is not None and not presentes[fila]:
+                    st.markdown(f"🚫 `{foto['nombre_archivo']}`")
+                elif os.path.splitext(foto["nombre_archivo"])[1].lower() in EXTENSIONES_IMAGEN:
+                    st.markdown(f"""
+                    <img src="{foto["url_miniatura"]}" loading="lazy" style="
+                        width: 100%; 
+                        height: {ALTO_MINIATURA}px; 
+                        object-fit: cover; 
+                        display: block;
+                    ">
+                    """, unsafe_allow_html=True)
+                else:
+                    st.markdown(f"🎞️ `{foto['nombre_archivo']}`")
+                if st.button(f"{indice + 1}" + (f" ({foto['anio']})" if foto["anio"] else ""), key=f"grilla_{indice}"):
+                    abrir_foto(indice)
+
+
+# --- 4.2. PRESENTACIÓN EN EL NAVEGADOR (SIN IDA Y VUELTA AL SERVIDOR) ---
+
+PRECARGA_PRESENTACION = 3 # Imágenes siguientes que el navegador descarga por adelantado
+ALTO_PRESENTACION = 850 # Alto (px) del componente de presentación
+# Fotos por tramo de la presentación: el manifiesto solo lleva un tramo, no todo el resultado
+# (una búsqueda global sin criterio serían cientos de miles de entradas en la página).
+VENTANA_PRESENTACION = int(os.environ.get("VISOR_VENTANA_PRESENTACION", "500"))
+
+# Plantilla del visor en JavaScript: recibe el manifiesto una sola vez y navega, reproduce
+# y precarga sin volver a ejecutar el script de Streamlit.
+PLANTILLA_PRESENTACION = """
+<div id="visor" tabindex="0" style="font-family: sans-serif; outline: none;">
+  <div style="display: flex; align-items: center; gap: 6px; margin-bottom: 6px;">
+    <button id="ant">⬅️ ANT</button>
+    <button id="sig">SIG ➡️</button>
+    <button id="play">▶️</button>
+    <select id="intervalo">
+      <option value="3000">3 s</option>
+      <option value="5000" selected>5 s</option>
+      <option value="10000">10 s</option>
+    </select>
+    <span id="aviso" style="color: #b00;"></span>
+    <span id="contador" style="margin-left: auto; font-weight: bold;"></span>
+  </div>
+  <div style="position: relative; height: __ALTO_IMAGEN__px; display: flex; justify-content: left; overflow: hidden;">
+    <img id="foto" style="max-width: 100%; max-height: 100%; object-fit: contain; display: block;">
+    <div id="texto" style="position: absolute; bottom: 0; left: 50%; transform: translateX(-50%); max-width: 100%;
+         width: max-content; min-width: 20%; background: rgba(0, 0, 0, 0.7); color: white; padding: 8px 15px;
+         font-size: 1.1rem; font-weight: bold; text-align: center; border-radius: 5px 5px 0 0; box-sizing: border-box;"></div>
+  </div>
+  <p id="personajes" style="margin: 6px 0 0 0;"></p>
+</div>
+<script>
+const fotos = __MANIFIESTO__;
+const precarga = __PRECARGA__;
+const tamanos = "__TAMANOS__";
+const inicio = __INICIO__; // Posición del tramo en el resultado completo
+const total = __TOTAL__;
+const completo = fotos.length === total; // Con un solo tramo la navegación es circular
+let indice = __INDICE__;
+let temporizador = null;
+const cache = {};
+
+function esImagen(f) { return !f.v; }
+
+function precargar() {
+  for (let k = 1; k <= precarga; k++) {
+    if (!completo && indice + k >= fotos.length) break;
+    const f = fotos[(indice + k) % fotos.length];
+    if (esImagen(f) && !cache[f.u]) {
+      cache[f.u] = new Image();
+      if (f.s) { cache[f.u].sizes = tamanos; cache[f.u].srcset = f.s; }
+      cache[f.u].src = f.u;
+    }
+  }
+}
+
+function mostrar() {
+  const f = fotos[indice];
+  const img = document.getElementById("foto");
+  if (esImagen(f)) {
+    // Con las dimensiones conocidas el hueco de la foto se reserva antes de que llegue
+    if (f.w && f.h) { img.width = f.w; img.height = f.h; } else { img.removeAttribute("width"); img.removeAttribute("height"); }
+    img.style.display = "block"; img.sizes = tamanos; img.srcset = f.s || ""; img.src = f.u;
+  } else { img.style.display = "none"; img.removeAttribute("srcset"); img.removeAttribute("src"); }
+  const texto = (f.d + (f.a ? " (" + f.a + ")" : "")).trim();
+  document.getElementById("texto").textContent = esImagen(f) ? (texto || "Información no disponible") : "Archivo de video: " + f.n;
+  document.getElementById("personajes").textContent = "PERSONAJES: " + (f.p.length ? f.p.join(", ") : "No disponibles");
+  document.getElementById("contador").textContent = "Foto " + (inicio + indice + 1) + " de " + total;
+  document.getElementById("aviso").textContent = "";
+  precargar();
+}
+
+function mover(direccion) {
+  if (!completo && (indice + direccion < 0 || indice + direccion >= fotos.length)) {
+    if (temporizador) alternarReproduccion();
+    document.getElementById("aviso").textContent = "Fin del tramo: use los botones de tramo de arriba.";
+    return;
+  }
+  indice = (indice + direccion + fotos.length) % fotos.length; // Navegación circular
+  mostrar();
+}
+
+function alternarReproduccion() {
+  const boton = document.getElementById("play");
+  if (temporizador) { clearInterval(temporizador); temporizador = null; boton.textContent = "▶️"; }
+  else { temporizador = setInterval(() => mover(1), Number(document.getElementById("intervalo").value)); boton.textContent = "⏸️"; }
+}
+
+document.getElementById("ant").onclick = () => mover(-1);
+document.getElementById("sig").onclick = () => mover(1);
+document.getElementById("play").onclick = alternarReproduccion;
+document.getElementById("intervalo").onchange = () => { if (temporizador) { alternarReproduccion(); alternarReproduccion(); } };
+document.addEventListener("keydown", (e) => {
+  if (e.key === "ArrowLeft") mover(-1);
+  else if (e.key === "ArrowRight") mover(1);
+  else if (e.key === " ") { e.preventDefault(); alternarReproduccion(); }
+});
+mostrar();
+document.getElementById("visor").focus();
+</script>
+"""
+
+def incrustar_html(html, alto):
+    """Incrusta HTML con JavaScript en un iframe (`st.iframe` en versiones nuevas, `components.html` en las anteriores)."""
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=alto)
+    else:
+        components.html(html, height=alto)
+
+def _columna(df, nombre, defecto=None):
+    return df[nombre].tolist() if nombre in df.columns else [defecto] * len(df)
+
+def _manifiesto_familia(df, clave_familia, derivados):
+    """Entradas del manifiesto de las filas `df` de una familia, recorriendo columnas en vez de filas."""
+    carpeta = consultas_individuales[clave_familia]["carpeta_fotos"]
+    derivados = derivados or {}
+    nombres = [str(nombre).strip() for nombre in df["NOMBRE_FOTO"].tolist()]
+    columnas_personajes = [_columna(df, col) for col in df.columns if "PERSONAJE" in col]
+    personajes = [
+        [str(valor).strip() for valor in valores if pd.notna(valor) and str(valor).strip() != ""]
+        for valores in zip(*columnas_personajes)
+    ] if columnas_personajes else [[] for _ in nombres]
+    return [
+        {
+            "u": url_objeto(f"{carpeta}/{nombre}"),
+            "s": _srcset_derivados(carpeta, nombre, derivados.get(f"{carpeta}/{nombre}"), "webp"),
+            "n": nombre,
+            "d": _texto_celda(descripcion),
+            "a": _texto_anio(anio),
+            "w": _dimension(ancho),
+            "h": _dimension(alto),
+            "p": personas,
+            "v": os.path.splitext(nombre)[1].lower() not in EXTENSIONES_IMAGEN,
+        }
+        for nombre, descripcion, anio, ancho, alto, personas in zip(
+            nombres, _columna(df, "DESCRIPCION", ""), _columna(df, "AÑO"), _columna(df, "ANCHO"), _columna(df, "ALTO"), personajes
+        )
+    ]
+
+def manifiesto_presentacion(vista, filas, derivados=None):
+    """Lista compacta (URL, descripción, año, personajes) de los resultados para el visor del navegador.
+    
+    Las filas se agrupan por familia y de cada una se toman sus columnas de una vez (sin una Serie por fila).
+    """
+    filas = np.asarray(filas)
+    familia_de = np.searchsorted(vista["desplazamientos"], filas, side='right') - 1
+    manifiesto = [None] * len(filas)
+    for i, (familia, desplazamiento) in enumerate(zip(vista["familias"], vista["desplazamientos"])):
+        posiciones = np.flatnonzero(familia_de == i)
+        if len(posiciones) == 0:
+            continue
+        df = familia["df"].iloc[filas[posiciones] - desplazamiento]
+        for posicion, entrada in zip(posiciones.tolist(), _manifiesto_familia(df, familia["clave"], derivados)):
+            manifiesto[posicion] = entrada
+    return manifiesto
+
+@cache_medida("manifiesto", st.cache_resource(max_entries=4, show_spinner=False))
+def _manifiesto_json(opcion, generaciones, generacion_derivados, clave_filas, _filas, _fs):
+    vista = obtener_vista(opcion, generaciones, _fs)
+    manifiesto = manifiesto_presentacion(vista, _filas, obtener_indice_derivados(_fs))
+    return json.dumps(manifiesto, ensure_ascii=False).replace("</", "<\\/")
+
+def tramo_presentacion(indice, total, ventana=VENTANA_PRESENTACION):
+    """Posiciones [inicio, fin) del tramo de resultados que contiene `indice` (tramos alineados de `ventana` fotos)."""
+    inicio = (indice // ventana) * ventana
+    return inicio, min(inicio + ventana, total)
+
+@medido("pintado_presentacion")
+def presentacion_navegador():
+    """Envía el manifiesto del tramo actual una sola vez; ANT/SIG, teclado y reproducción automática ocurren en el navegador.
+    
+    Solo viaja el tramo de `VENTANA_PRESENTACION` fotos que contiene la foto actual. El manifiesto (ya en JSON) se
+    guarda por consulta, generaciones y filas del tramo: volver a la presentación no lo reconstruye.
+    """
+    fs = obtener_fs()
+    filas = st.session_state.filas_resultado
+    indice = int(st.session_state.photo_index)
+    inicio, fin = tramo_presentacion(indice, len(filas))
+    filas_tramo = filas[inicio:fin]
+    clave_filas = hashlib.sha1(np.ascontiguousarray(filas_tramo, dtype=np.int32).tobytes()).hexdigest()
+    manifiesto = _manifiesto_json(
+        st.session_state.opcion_elegida, st.session_state.generaciones_vista,
+        obtener_generacion_objeto(RUTA_INDICE_DERIVADOS, fs), clave_filas, filas_tramo, fs,
+    )
+    html = (PLANTILLA_PRESENTACION
+        .replace("__MANIFIESTO__", manifiesto)
+        .replace("__PRECARGA__", str(PRECARGA_PRESENTACION))
+        .replace("__TAMANOS__", TAMANOS_IMAGEN)
+        .replace("__INICIO__", str(inicio))
+        .replace("__TOTAL__", str(len(filas)))
+        .replace("__INDICE__", str(indice - inicio))
+        .replace("__ALTO_IMAGEN__", str(ALTO_PRESENTACION - 100)))
+    incrustar_html(html, ALTO_PRESENTACION)
+
+
+# --- 4.4. SERVIDOR DE MEDIOS: VÍDEOS POR RANGOS DE BYTES ---
+# Streamlit no atiende peticiones Range, así que los vídeos se sirven desde un pequeño servidor HTTP
+# del mismo proceso. Lee del almacenamiento por fragmentos y los guarda en una caché LRU acotada:
+# la reproducción empieza con los primeros fragmentos y al saltar solo se leen los que faltan.
+
+MEDIOS_HOST = os.environ.get("VISOR_MEDIOS_HOST", "0.0.0.0")
+MEDIOS_PUERTO = int(os.environ.get("VISOR_MEDIOS_PUERTO", "8502"))
+# URL pública con la que el navegador llega al servidor (p. ej. un proxy https hacia MEDIOS_PUERTO). Sin ella no se
+# le envía ninguna URL del servidor: en Cloud Run solo se expone $PORT y una URL http rompería una página https.
+MEDIOS_URL = os.environ.get("VISOR_MEDIOS_URL", "").rstrip("/") or None
+FRAGMENTO_VIDEO = 1024 * 1024 # Bytes por lectura del almacenamiento (unidad de la caché)
+MAX_RESPUESTA_VIDEO = 4 * FRAGMENTO_VIDEO # Bytes máximos por respuesta 206: el navegador pide el resto después
+FRAGMENTOS_ADELANTADOS = 2 # Fragmentos que se leen por adelantado después de cada respuesta
+CACHE_VIDEO_MB = float(os.environ.get("VISOR_CACHE_VIDEO_MB", "256")) # Memoria máxima de la caché de fragmentos
+TIPOS_VIDEO = {'.mp4': 'video/mp4', '.mov': 'video/quicktime', '.mkv': 'video/x-matroska', '.avi': 'video/x-msvideo'}
+# Imágenes del Bucket privado: copia en disco (LRU por tamaño) para no volver a leerlas de GCS
+CACHE_IMAGENES_DIR = os.environ.get("VISOR_CACHE_IMAGENES_DIR", os.path.join(tempfile.gettempdir(), "visor_imagenes"))
+CACHE_IMAGENES_MB = float(os.environ.get("VISOR_CACHE_IMAGENES_MB", "2048"))
+CACHE_CONTROL_IMAGENES = os.environ.get("VISOR_CACHE_CONTROL_IMAGENES", "public, max-age=86400")
+TIPOS_IMAGEN = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+                '.bmp': 'image/bmp', '.tiff': 'image/tiff', '.webp': 'image/webp'}
+
+class CacheFragmentos:
+    """LRU de fragmentos de archivos acotada por memoria; una lectura en curso se comparte entre peticiones."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._pendientes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, leer):
+        """Devuelve el fragmento `clave`, llamando a `leer()` solo si no está guardado ni leyéndose."""
+        with self._lock:
+            datos = self._entradas.get(clave)
+            if datos is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return datos
+            futuro = self._pendientes.get(clave)
+            if futuro is None:
+                futuro = self._pendientes[clave] = Future()
+                self.fallos += 1
+                propio = True
+            else:
+                propio = False
+        if not propio:
+            return futuro.result()
+
+        try:
+            datos = leer()
+        except Exception as e:
+            with self._lock:
+                self._pendientes.pop(clave, None)
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            self._pendientes.pop(clave, None)
+            if len(datos) <= self.max_bytes:
+                self._entradas[clave] = datos
+                self._bytes += len(datos)
+                while self._bytes > self.max_bytes:
+                    _, descartado = self._entradas.popitem(last=False)
+                    self._bytes -= len(descartado)
+        futuro.set_result(datos)
+        return datos
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas), "bytes": self._bytes}
+
+class CacheDisco:
+    """LRU en disco de objetos del Bucket, acotada por tamaño; se conserva entre reinicios del proceso.
+    
+    Cada copia se guarda como `<hash de la ruta>.<etag>`, con el etag calculado del contenido, así que
+    al arrancar se reconstruye el índice (del uso más antiguo al más reciente) solo listando la carpeta.
+    Los objetos se tratan como inmutables: una foto ya copiada no se vuelve a pedir a GCS.
+    """
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict() # hash de la ruta -> (archivo, tamaño, etag)
+        self._pendientes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(directorio, exist_ok=True)
+        existentes = []
+        for archivo in os.listdir(directorio):
+            ruta = os.path.join(directorio, archivo)
+            if archivo.endswith(".tmp"):
+                os.remove(ruta) # Escritura interrumpida
+                continue
+            info = os.stat(ruta)
+            existentes.append((info.st_mtime, archivo, info.st_size))
+        for _, archivo, tamano in sorted(existentes):
+            clave, _, etag = archivo.partition('.')
+            self._entradas[clave] = (archivo, tamano, etag)
+            self._bytes += tamano
+        with self._lock:
+            self._recortar()
+
+    def _recortar(self):
+        while self._bytes > self.max_bytes and self._entradas:
+            _, (archivo, tamano, _) = self._entradas.popitem(last=False)
+            self._bytes -= tamano
+            try:
+                os.remove(os.path.join(self.directorio, archivo))
+            except FileNotFoundError:
+                pass
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas), "bytes": self._bytes}
+
+    def _abrir(self, clave):
+        """(archivo abierto, tamaño, etag) de una copia guardada; None si no está. Requiere el lock."""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        ruta = os.path.join(self.directorio, entrada[0])
+        try:
+            archivo = open(ruta, 'rb') # Abierto dentro del lock: un descarte posterior no lo invalida
+        except FileNotFoundError:
+            del self._entradas[clave]
+            self._bytes -= entrada[1]
+            return None
+        self._entradas.move_to_end(clave)
+        os.utime(ruta) # El orden LRU se conserva al reiniciar
+        return archivo, entrada[1], entrada[2]
+
+    def obtener(self, ruta, leer):
+        """Copia de `ruta` como (archivo abierto, tamaño, etag); llama a `leer()` solo si aún no está en disco."""
+        clave = hashlib.sha1(ruta.encode('utf-8')).hexdigest()
+        with self._lock:
+            abierto = self._abrir(clave)
+            if abierto is not None:
+                self.aciertos += 1
+                return abierto
+            futuro = self._pendientes.get(clave)
+            if futuro is None:
+                futuro = self._pendientes[clave] = Future()
+                self.fallos += 1
+                propio = True
+            else:
+                propio = False
+        if not propio:
+            futuro.result() # Espera a la lectura en curso de otra petición
+            with self._lock:
+                abierto = self._abrir(clave)
+            return abierto if abierto is not None else self.obtener(ruta, leer)
+
+        try:
+            datos = leer()
+            etag = hashlib.sha1(datos).hexdigest()[:20]
+            archivo = f"{clave}.{etag}"
+            ruta_tmp = os.path.join(self.directorio, f"{archivo}.{threading.get_ident()}.tmp")
+            with open(ruta_tmp, 'wb') as f:
+                f.write(datos)
+            os.replace(ruta_tmp, os.path.join(self.directorio, archivo))
+        except Exception as e:
+            with self._lock:
+                self._pendientes.pop(clave, None)
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            self._pendientes.pop(clave, None)
+            self._entradas[clave] = (archivo, len(datos), etag)
+            self._bytes += len(datos)
+            abierto = self._abrir(clave)
+            self._recortar()
+        futuro.set_result(None)
+        return abierto if abierto is not None else (io.BytesIO(datos), len(datos), etag)
+
+def _ruta_permitida(ruta_url, prefijo, extensiones):
+    """Ruta relativa al Bucket de `<prefijo><ruta>` si está en una carpeta de fotos (o de derivados) y
+    tiene una de las `extensiones`; None en otro caso."""
+    ruta_url = unquote(ruta_url.split('?', 1)[0])
+    if not ruta_url.startswith(prefijo):
+        return None
+    ruta = ruta_url[len(prefijo):]
+    partes = ruta.split('/')
+    carpetas = {config["carpeta_fotos"] for config in consultas_individuales.values()} | {PREFIJO_DERIVADOS}
+    if partes[0] not in carpetas or len(partes) < 2 or '..' in partes or '' in partes:
+        return None
+    if os.path.splitext(ruta)[1].lower() not in extensiones:
+        return None
+    return ruta
+
+class ServidorMedios:
+    """Vídeos del Bucket por rangos (caché de fragmentos en memoria) e imágenes con copia en disco."""
+    def __init__(self, fs):
+        self.fs = fs
+        self.fragmentos = CacheFragmentos(int(CACHE_VIDEO_MB * 1024 * 1024))
+        self.imagenes = CacheDisco(CACHE_IMAGENES_DIR, int(CACHE_IMAGENES_MB * 1024 * 1024))
+        METRICAS.registrar_cache("video", self.fragmentos.estadisticas)
+        METRICAS.registrar_cache("imagenes", self.imagenes.estadisticas)
+        self._info = {} # ruta -> (instante, tamaño, generación)
+        self._adelanto = ThreadPoolExecutor(max_workers=2, thread_name_prefix="medios-adelanto")
+
+    def ruta_video(self, ruta_url):
+        """Ruta en el Bucket de `/video/<carpeta>/<nombre>`, o None si no es un vídeo de una carpeta de fotos."""
+        ruta = _ruta_permitida(ruta_url, "/video/", TIPOS_VIDEO)
+        return None if ruta is None or ruta.startswith(PREFIJO_DERIVADOS) else f"{BUCKET_NAME}/{ruta}"
+
+    def ruta_imagen(self, ruta_url):
+        """Ruta en el Bucket de `/objeto/<ruta>`, o None si no es una foto o un derivado."""
+        ruta = _ruta_permitida(ruta_url, "/objeto/", TIPOS_IMAGEN)
+        return None if ruta is None else f"{BUCKET_NAME}/{ruta}"
+
+    def imagen(self, ruta):
+        return self.imagenes.obtener(ruta, lambda: _leer_objeto(self.fs, ruta))
+
+    def info(self, ruta):
+        """(tamaño, generación) del archivo, consultando sus metadatos como mucho cada METADATA_TTL segundos."""
+        guardado = self._info.get(ruta)
+        if guardado is not None and time.monotonic() - guardado[0] < METADATA_TTL:
+            return guardado[1:]
+        info = self.fs.info(ruta)
+        generacion = info.get("generation") or info.get("etag") or info.get("mtime") or info.get("updated") or ""
+        self._info[ruta] = (time.monotonic(), int(info["size"]), str(generacion))
+        return self._info[ruta][1:]
+
+    def fragmento(self, ruta, tamano, generacion, indice):
+        inicio = indice * FRAGMENTO_VIDEO
+        fin = min(inicio + FRAGMENTO_VIDEO, tamano)
+        return self.fragmentos.obtener((ruta, generacion, indice), lambda: _leer_objeto(self.fs, ruta, inicio, fin))
+
+    def leer(self, ruta, tamano, generacion, inicio, fin):
+        """Bytes [inicio, fin] (fin incluido) del archivo; después adelanta la lectura de los siguientes fragmentos."""
+        primero, ultimo = inicio // FRAGMENTO_VIDEO, fin // FRAGMENTO_VIDEO
+        bloque = b"".join(self.fragmento(ruta, tamano, generacion, i) for i in range(primero, ultimo + 1))
+        total_fragmentos = -(-tamano // FRAGMENTO_VIDEO)
+        for i in range(ultimo + 1, min(ultimo + 1 + FRAGMENTOS_ADELANTADOS, total_fragmentos)):
+            self._adelanto.submit(self.fragmento, ruta, tamano, generacion, i)
+        desplazamiento = inicio - primero * FRAGMENTO_VIDEO
+        return bloque[desplazamiento:desplazamiento + fin - inicio + 1]
+
+def _rango_pedido(cabecera, tamano):
+    """(inicio, fin) de una cabecera `Range: bytes=...` (un solo rango); None si no se puede satisfacer."""
+    coincidencia = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', cabecera or "")
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        return None
+    desde, hasta = coincidencia.groups()
+    if desde == '': # Sufijo: los últimos N bytes
+        inicio, fin = max(0, tamano - int(hasta)), tamano - 1
+    else:
+        inicio, fin = int(desde), min(int(hasta), tamano - 1) if hasta else tamano - 1
+    if inicio > fin or inicio >= tamano:
+        return None
+    return inicio, fin
+
+class _ManejadorMedios(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass # Sin una línea de log por cada rango pedido
+
+    def do_HEAD(self):
+        self._responder(con_cuerpo=False)
+
+    def do_GET(self):
+        self._responder(con_cuerpo=True)
+
+    def _responder(self, con_cuerpo):
+        if self.path.startswith("/objeto/"):
+            self._responder_imagen(con_cuerpo)
+        elif self.path.split('?', 1)[0] == "/metrics":
+            self._responder_metricas(con_cuerpo)
+        else:
+            self._responder_video(con_cuerpo)
+
+    def _responder_metricas(self, con_cuerpo):
+        if not METRICAS_ACTIVAS:
+            self.send_error(404)
+            return
+        cuerpo = METRICAS.texto_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if con_cuerpo:
+            self.wfile.write(cuerpo)
+
+    def _responder_imagen(self, con_cuerpo):
+        medios = self.server.medios
+        ruta = medios.ruta_imagen(self.path)
+        if ruta is None:
+            self.send_error(404)
+            return
+        try:
+            archivo, tamano, etag = medios.imagen(ruta)
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        except Exception:
+            self.send_error(502)
+            return
+
+        with archivo:
+            try:
+                etiquetas = {e.strip().removeprefix("W/") for e in self.headers.get("If-None-Match", "").split(',')}
+                if f'"{etag}"' in etiquetas or "*" in etiquetas:
+                    self.send_response(304)
+                    self.send_header("ETag", f'"{etag}"')
+                    self.send_header("Cache-Control", CACHE_CONTROL_IMAGENES)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", TIPOS_IMAGEN[os.path.splitext(ruta)[1].lower()])
+                self.send_header("Content-Length", str(tamano))
+                self.send_header("ETag", f'"{etag}"')
+                self.send_header("Cache-Control", CACHE_CONTROL_IMAGENES)
+                self.end_headers()
+                if con_cuerpo:
+                    shutil.copyfileobj(archivo, self.wfile)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _responder_video(self, con_cuerpo):
+        medios = self.server.medios
+        ruta = medios.ruta_video(self.path)
+        if ruta is None:
+            self.send_error(404)
+            return
+        try:
+            tamano, generacion = medios.info(ruta)
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        except Exception:
+            self.send_error(502)
+            return
+
+        if tamano == 0 or "Range" not in self.headers:
+            inicio, fin, estado = 0, tamano - 1, 200
+        else:
+            rango = _rango_pedido(self.headers["Range"], tamano)
+            if rango is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{tamano}")
+                self.end_headers()
+                return
+            inicio, fin = rango[0], min(rango[1], rango[0] + MAX_RESPUESTA_VIDEO - 1)
+            estado = 206
+
+        try:
+            self.send_response(estado)
+            self.send_header("Content-Type", TIPOS_VIDEO[os.path.splitext(ruta)[1].lower()])
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", f'"{generacion}"')
+            self.send_header("Cache-Control", "private, max-age=3600")
+            self.send_header("Content-Length", str(fin - inicio + 1))
+            if estado == 206:
+                self.send_header("Content-Range", f"bytes {inicio}-{fin}/{tamano}")
+            self.end_headers()
+            if not con_cuerpo:
+                return
+            # Sin Range se envía el archivo entero, fragmento a fragmento.
+            for desde in range(inicio, fin + 1, MAX_RESPUESTA_VIDEO):
+                self.wfile.write(medios.leer(ruta, tamano, generacion, desde, min(desde + MAX_RESPUESTA_VIDEO - 1, fin)))
+        except (BrokenPipeError, ConnectionResetError):
+            pass # El reproductor cerró la conexión (p. ej. al saltar a otro punto del vídeo)
+
+@st.cache_resource(show_spinner=False)
+def iniciar_servidor_medios(_fs):
+    """Arranca, una sola vez por proceso, el servidor de vídeos; None si su puerto no está disponible."""
+    try:
+        servidor = ThreadingHTTPServer((MEDIOS_HOST, MEDIOS_PUERTO), _ManejadorMedios)
+    except OSError:
+        return None
+    servidor.daemon_threads = True
+    servidor.medios = ServidorMedios(_fs)
+    threading.Thread(target=servidor.serve_forever, name="servidor-medios", daemon=True).start()
+    return servidor.medios
+
+def url_video(carpeta, nombre_archivo, url_publica):
+    """URL del vídeo en el servidor de medios, o la pública del Bucket si no hay VISOR_MEDIOS_URL o el servidor no pudo arrancar."""
+    if MEDIOS_URL is None or iniciar_servidor_medios(obtener_fs()) is None:
+        return url_publica
+    return f"{MEDIOS_URL}/video/{quote(carpeta)}/{quote(nombre_archivo)}"
+
+
+# --- 5. INTERFAZ DE STREAMLIT ---
+
+st.set_page_config(layout="wide", page_title="Visor Familiar Cloud")
+
+# 5.1. Carga inicial de datos (para cache). Los catálogos son compartidos por todas las sesiones y se
+# calientan en segundo plano al arrancar el proceso; el menú no espera por ellos y cada consulta
+# carga bajo demanda los que aún falten.
+if PRECARGA_AL_INICIO:
+    iniciar_precarga_en_segundo_plano()
+if BUCKET_PRIVADO and MEDIOS_URL is None:
+    st.sidebar.warning("VISOR_BUCKET_PRIVADO=1 necesita VISOR_MEDIOS_URL (la URL del servidor de medios): mientras tanto se usan las URLs públicas del Bucket.")
+elif BUCKET_PRIVADO and iniciar_servidor_medios(obtener_fs()) is None:
+    st.sidebar.warning(f"El servidor de medios no pudo arrancar en el puerto {MEDIOS_PUERTO}: mientras tanto se usan las URLs públicas del Bucket.")
+if METRICAS_ACTIVAS:
+    iniciar_servidor_medios(obtener_fs()) # Publica /metrics aunque nadie vea vídeos
+
+NOMBRES_MODO = {"D": "DESCRIPCIÓN", "P": "PERSONAJE", "B": "VARIAS PERSONAS"}
+
+# 5.2. Lógica del Menú Principal (INICIO)
+if st.session_state.menu_state == 'INICIO':
+    st.subheader("Seleccione una Consulta") 
+    
+    col_ind, col_global = st.columns([1, 1])
+
+    with col_ind:
+        st.markdown("### Consultas Individuales")
+        for key, config in consultas_individuales.items():
+            if st.button(f"{key} - {config['nombre']}", key=f"btn_{key}"):
+                st.session_state.config_actual = config
+                st.session_state.opcion_elegida = key
+                fs = obtener_fs()
+                generaciones = generaciones_consulta(key, fs)
+                vista = obtener_vista(key, generaciones, fs)
+                
+                if vista is not None:
+                    st.session_state.generaciones_vista = generaciones
+                    st.session_state.menu_state = 'MODO_BUSQUEDA'
+                    st.rerun()
+
+    with col_global:
+        st.markdown("### Consultas Globales")
+        for key, config in consultas_globales.items():
+            if st.button(f"{key} - {config['nombre']}", key=f"btn_{key}"):
+                st.session_state.config_actual = config
+                st.session_state.opcion_elegida = key
+                
+                fs = obtener_fs()
+                generaciones = generaciones_consulta(key, fs)
+                precargar_catalogos(fs, generaciones) # Descarga en paralelo las familias que aún no estén en memoria.
+                vista = obtener_vista(key, generaciones, fs)
+                if vista is not None and vista["total"] > 0:
+                    # Se fijan solo las familias que se cargaron: las que fallaron no se reintentan en cada pantalla.
+                    cargadas = {familia["clave"] for familia in vista["familias"]}
+                    st.session_state.generaciones_vista = tuple(g for g in generaciones if g[0] in cargadas)
+                    st.session_state.menu_state = 'MODO_BUSQUEDA'
+                    st.rerun()
+                
+    st.sidebar.markdown("Presione el botón para empezar.")
+
+# 5.3. Selección de Modo de Búsqueda (MODO_BUSQUEDA)
+elif st.session_state.menu_state == 'MODO_BUSQUEDA':
+    st.subheader(f"Consulta: {st.session_state.config_actual['nombre']}") 
+    
+    st.markdown(f"**Modo Actual: {NOMBRES_MODO.get(st.session_state.modo_busqueda, 'PERSONAJE')}**")
+    st.warning("Seleccione D para DESCRIPCIÓN, P para PERSONAJE o B para VARIAS PERSONAS:")
+    
+    col_d, col_p, col_b, col_volver = st.columns([1, 1, 1, 1])
+    
+    if col_d.button("D - DESCRIPCIÓN"):
+        st.session_state.modo_busqueda = "D"
+        st.session_state.menu_state = 'FILTRAR'
+        st.rerun()
+    
+    if col_p.button("P - PERSONAJE"):
+        st.session_state.modo_busqueda = "P"
+        st.session_state.menu_state = 'FILTRAR'
+        st.rerun()
+
+    if col_b.button("B - VARIAS PERSONAS"):
+        st.session_state.modo_busqueda = "B"
+        st.session_state.menu_state = 'FILTRAR'
+        st.rerun()
+
+    if col_volver.button("⬅️ Volver al Menú"):
+        go_home()
+        st.rerun()
+
+    # Revisión de archivos: filas del Excel sin foto en el Bucket y fotos que ningún Excel menciona.
+    # Lista las carpetas de la consulta, así que solo se hace cuando se pide.
+    if st.button("📋 Revisar archivos faltantes y huérfanos"):
+        st.session_state.revision_visible = True
+    revision = None
+    if st.session_state.revision_visible:
+        revision = revision_archivos(st.session_state.opcion_elegida, st.session_state.generaciones_vista, obtener_fs())
+        if revision is None:
+            st.warning("No se pudieron listar las carpetas de fotos.")
+    if revision is not None:
+        n_faltantes = sum(len(v) for v in revision["faltantes"].values())
+        n_huerfanos = sum(len(v) for v in revision["huerfanos"].values())
+        st.caption(f"{n_faltantes} filas sin archivo en el Bucket · {n_huerfanos} archivos sin fila en el Excel")
+        if n_faltantes or n_huerfanos:
+            with st.expander("Ver archivos faltantes y huérfanos"):
+                for key in revision["faltantes"]:
+                    st.markdown(f"**{consultas_individuales[key]['nombre']}** (`{consultas_individuales[key]['carpeta_fotos']}`)")
+                    if revision["faltantes"][key]:
+                        st.text("Faltantes: " + ", ".join(revision["faltantes"][key]))
+                    if revision["huerfanos"][key]:
+                        st.text("Huérfanos: " + ", ".join(revision["huerfanos"][key]))
+
+# 5.4. Interfaz de Filtrado (FILTRAR)
+elif st.session_state.menu_state == 'FILTRAR':
+    st.subheader(f"Filtrar: {st.session_state.config_actual['nombre']} (Modo: {NOMBRES_MODO.get(st.session_state.modo_busqueda, 'PERSONAJE')})") 
+    
+    if st.session_state.modo_busqueda == "B":
+        st.session_state.criterio_busqueda = st.text_input(
+            "Ingrese personas combinadas con AND, OR y NOT (p. ej. José Velasco AND Ana Coner NOT Juan Carlos):"
+        )
+        col_desde, col_hasta = st.columns([1, 1])
+        st.session_state.anio_filtro = col_desde.text_input("Desde el año (opcional):")
+        st.session_state.anio_hasta = col_hasta.text_input("Hasta el año (opcional):")
+    else:
+        st.session_state.criterio_busqueda = st.text_input("Ingrese palabra o nombre clave (Vacío para ver todo en modo D):")
+        st.session_state.anio_filtro = st.text_input("Ingrese un año para filtrar (dejar en blanco para ver todas):")
+        st.session_state.anio_hasta = None
+    st.session_state.ocultar_faltantes = st.checkbox(
+        "Ocultar las fotos cuyo archivo no está en el Bucket", value=st.session_state.ocultar_faltantes
+    )
+    if st.session_state.opcion_elegida in consultas_globales:
+        st.session_state.agrupar_duplicados = st.checkbox(
+            "Mostrar una sola vez las fotos repetidas en varias carpetas", value=st.session_state.agrupar_duplicados
+        )
+
+    col_filtrar, col_cambiar_modo, col_volver = st.columns([1, 1, 1])
+    
+    if col_filtrar.button("🔍 Buscar (Ver Fotos)"):
+        if st.session_state.modo_busqueda in ("P", "B") and not st.session_state.criterio_busqueda:
+            st.error(f"Debe ingresar una palabra para buscar por {NOMBRES_MODO[st.session_state.modo_busqueda]}.")
+        else:
+            st.session_state.filas_resultado = filtrar_resultados(
+                st.session_state.opcion_elegida,
+                st.session_state.generaciones_vista,
+                st.session_state.modo_busqueda,
+                st.session_state.criterio_busqueda,
+                st.session_state.anio_filtro,
+                st.session_state.ocultar_faltantes,
+                obtener_fs(),
+                st.session_state.anio_hasta,
+                st.session_state.agrupar_duplicados
+            )
+
+            if len(st.session_state.filas_resultado) == 0:
+                st.warning("❌ No se encontró ninguna imagen que coincida con el criterio.")
+            else:
+                st.session_state.photo_index = 0
+                st.session_state.menu_state = 'VER_FOTO'
+                st.rerun()
+    
+    if col_cambiar_modo.button("🔄 Cambiar Modo (D/P/B)"):
+        st.session_state.menu_state = 'MODO_BUSQUEDA'
+        st.rerun()
+
+    if col_volver.button("⬅️ Volver al Menú"):
+        go_home()
+        st.rerun()
+
+# 5.5. Visualización de Foto y Navegación (VER_FOTO)
+elif st.session_state.menu_state == 'VER_FOTO':
+    
+    if len(st.session_state.filas_resultado) == 0:
+        st.warning("No hay resultados para mostrar.")
+        if st.button("Volver al Filtro"):
+            st.session_state.menu_state = 'FILTRAR'
+            st.rerun()
+        st.stop()
+
+    visor_foto()
+
+# 5.6. Presentación en el navegador (PRESENTACION)
+elif st.session_state.menu_state == 'PRESENTACION':
+    st.subheader(f"Presentación: {st.session_state.config_actual['nombre']} (← → para navegar, espacio para reproducir)")
+    
+    col_visor, col_menu = st.columns([1, 1])
+    if col_visor.button("🖼️ Volver al Visor"):
+        st.session_state.menu_state = 'VER_FOTO'
+        st.rerun()
+    if col_menu.button("🏠 MENÚ"):
+        go_home()
+
+    total = len(st.session_state.filas_resultado)
+    if total == 0:
+        st.warning("No hay resultados para mostrar.")
+    else:
+        if total > VENTANA_PRESENTACION:
+            inicio, fin = tramo_presentacion(int(st.session_state.photo_index), total)
+            col_anterior, col_tramo, col_siguiente = st.columns([1, 2, 1])
+            # Los tramos son circulares, como la navegación del visor.
+            if col_anterior.button("⏪ Tramo anterior"):
+                st.session_state.photo_index = tramo_presentacion((inicio - 1) % total, total)[0]
+                st.rerun()
+            col_tramo.caption(f"Fotos {inicio + 1}–{fin} de {total}")
+            if col_siguiente.button("Tramo siguiente ⏩"):
+                st.session_state.photo_index = fin % total
+                st.rerun()
+        presentacion_navegador()
+
+# 5.7. Cuadrícula de resultados (GRILLA)
+elif st.session_state.menu_state == 'GRILLA':
+    st.subheader(f"Resultados: {st.session_state.config_actual['nombre']}")
+    
+    col_visor, col_menu = st.columns([1, 1])
+    if col_visor.button("🖼️ Volver al Visor"):
+        st.session_state.menu_state = 'VER_FOTO'
+        st.rerun()
+    if col_menu.button("🏠 MENÚ"):
+        go_home()
+
+    if len(st.session_state.filas_resultado) == 0:
+        st.warning("No hay resultados para mostrar.")
+    else:
+        grilla_resultados()